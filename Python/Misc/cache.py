@@ -0,0 +1,172 @@
+"""
+cache.py is a persistent, SQLite-backed cache for responses from the remote identifier services. Entries are keyed by
+(service, namespace, normalized query), expire after a time-to-live and are evicted least-recently-used first once the
+cache grows past its size limit.
+
+The cache is shared by the PubChem, MetaboAnalyst and MyGene clients, so overlapping metabolite and gene lists only
+pay the network cost once.
+
+@author: Scott Campit
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from instrument import count
+
+DEFAULT_PATH = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                            'responses.sqlite')
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 2000000
+
+# Maximum number of bound parameters per statement in older SQLite builds
+_SQLITE_BATCH = 900
+
+
+def normalizeQuery(query):
+    """
+    normalizeQuery collapses whitespace and folds case, so that 'L-Glutamine ' and 'l-glutamine' share a cache entry.
+
+    :param query: A string (or anything with a string form) denoting the query
+    :return:      The normalized query string
+    """
+    return ' '.join(str(query).split()).casefold()
+
+
+class ResponseCache:
+    """
+    ResponseCache stores JSON-serializable responses on disk. It is safe to share one instance between threads.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, maxEntries=DEFAULT_MAX_ENTRIES):
+        """
+        :param path:       A string denoting the path of the SQLite database file (':memory:' for a throwaway cache)
+        :param ttl:        A number denoting how many seconds an entry stays valid (None never expires)
+        :param maxEntries: An integer denoting the number of entries kept before LRU eviction kicks in
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'service TEXT, namespace TEXT, query TEXT, value TEXT, '
+                           'created REAL, accessed REAL, '
+                           'PRIMARY KEY (service, namespace, query))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        # An upper bound on the number of rows, so that writes only count the table when it may be full
+        self._rows = self._count()
+
+    def get(self, service, namespace, query, default=None):
+        """
+        get returns the cached value for a single query, or `default` on a miss.
+        """
+        return self.getMany(service, namespace, [query]).get(normalizeQuery(query), default)
+
+    def getMany(self, service, namespace, queries):
+        """
+        getMany looks up several queries at once.
+
+        :param service:   A string denoting the remote service (e.g. 'pubchem')
+        :param namespace: A string denoting the kind of lookup within the service
+        :param queries:   An iterable of query strings
+        :return hits:     A dictionary mapping each normalized query that was found to its cached value
+        """
+        keys = list(dict.fromkeys(normalizeQuery(q) for q in queries))
+        now = time.time()
+        oldest = now - self.ttl if self.ttl is not None else 0
+        hits = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQLITE_BATCH):
+                batch = keys[i:i + _SQLITE_BATCH]
+                marks = ','.join('?' * len(batch))
+                rows = self._conn.execute('SELECT query, value FROM responses '
+                                          'WHERE service=? AND namespace=? AND created>=? AND query IN (%s)' % marks,
+                                          [service, namespace, oldest] + batch).fetchall()
+                for query, value in rows:
+                    hits[query] = json.loads(value)
+                self._conn.executemany('UPDATE responses SET accessed=? WHERE service=? AND namespace=? AND query=?',
+                                       [(now, service, namespace, q) for q, _ in rows])
+            self.hits += len(hits)
+            self.misses += len(keys) - len(hits)
+        count(cache_hits=len(hits), cache_misses=len(keys) - len(hits))
+        return hits
+
+    def set(self, service, namespace, query, value):
+        """
+        set stores the value for a single query.
+        """
+        self.setMany(service, namespace, {query: value})
+
+    def setMany(self, service, namespace, items):
+        """
+        setMany stores several values in one transaction and evicts old entries if the cache is full.
+
+        :param service:   A string denoting the remote service (e.g. 'pubchem')
+        :param namespace: A string denoting the kind of lookup within the service
+        :param items:     A dictionary mapping query strings to JSON-serializable values
+        """
+        now = time.time()
+        rows = [(service, namespace, normalizeQuery(q), json.dumps(v), now, now) for q, v in items.items()]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.execute('COMMIT')
+            # Replaced rows are counted as new ones, so the count is recounted before anything is evicted
+            self._rows += len(rows)
+            if self._rows > self.maxEntries:
+                self._evict()
+
+    def _count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def _evict(self):
+        self._rows = self._count()
+        if self._rows > self.maxEntries and self.ttl is not None:
+            self._conn.execute('DELETE FROM responses WHERE created<?', [time.time() - self.ttl])
+            self._rows = self._count()
+        excess = self._rows - self.maxEntries
+        if excess > 0:
+            self._conn.execute('DELETE FROM responses WHERE rowid IN '
+                               '(SELECT rowid FROM responses ORDER BY accessed LIMIT ?)', [excess])
+            self._rows -= excess
+
+    def clear(self):
+        """
+        clear removes every entry from the cache.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._rows = 0
+
+    def close(self):
+        self._conn.close()
+
+
+_default = None
+
+
+def resolveCache(cache):
+    """
+    resolveCache turns the `cache` argument accepted by the remote clients into a ResponseCache (or None).
+
+    :param cache: True for the shared on-disk cache at DEFAULT_PATH, False/None to disable caching, or a ResponseCache
+    :return:      A ResponseCache or None
+    """
+    global _default
+    if cache is True:
+        if _default is None:
+            _default = ResponseCache()
+        return _default
+    if cache is False:
+        return None
+    return cache
@@ -0,0 +1,67 @@
+"""
+geneids.py reads the gene IDs of a metabolic model without building a cobra model. SBML geneProduct elements are
+streamed with iterparse, the 'genes' field of a COBRA .mat struct is read with scipy, and the 'genes' array of a JSON
+model is streamed with ijson (plain json when ijson is not installed). SBML IDs are decoded the way cobrapy decodes
+them, so the IDs match cobrapy's gene IDs.
+
+@author: Scott Campit
+"""
+
+import os
+
+from sbml import FBC, FBC_GENE_PRODUCT, decodeSbmlId, iterElements
+
+
+def sbmlGeneIds(model):
+    """
+    sbmlGeneIds returns the gene IDs of an SBML model from its fbc:geneProduct elements.
+    """
+    return [decodeSbmlId(element.get(FBC + 'id'), 'G_') for element in iterElements(model, FBC_GENE_PRODUCT)]
+
+
+def matGeneIds(model):
+    """
+    matGeneIds returns the gene IDs of a COBRA Toolbox .mat model from the 'genes' field of its model struct.
+    """
+    from scipy.io import loadmat
+
+    variables = loadmat(model, squeeze_me=True, struct_as_record=True)
+    for name, value in variables.items():
+        if name.startswith('__') or getattr(value, 'dtype', None) is None or value.dtype.names is None:
+            continue
+        if 'genes' in value.dtype.names:
+            genes = value['genes']
+            # A 0-d struct array holds the field as an object array of strings
+            if getattr(genes, 'ndim', 1) == 0:
+                genes = genes.item()
+            return [str(g) for g in ([genes] if isinstance(genes, str) else genes)]
+    raise ValueError('No model struct with a genes field in %s' % model)
+
+
+def jsonGeneIds(model):
+    """
+    jsonGeneIds returns the gene IDs of a cobrapy JSON model from its 'genes' array.
+    """
+    try:
+        import ijson
+    except ImportError:
+        import json
+        with open(model) as f:
+            return [gene['id'] for gene in json.load(f).get('genes', [])]
+    with open(model, 'rb') as f:
+        return list(ijson.items(f, 'genes.item.id'))
+
+
+def readGeneIds(model):
+    """
+    readGeneIds returns the gene IDs of a metabolic model in model order.
+
+    :param model: A string denoting the path to the metabolic model (`.xml`, `.sbml`, `.mat` or `.json`)
+    :return:      A list of gene ID strings
+    """
+    suffix = os.path.splitext(model)[1].lower()
+    if suffix == '.mat':
+        return matGeneIds(model)
+    if suffix == '.json':
+        return jsonGeneIds(model)
+    return sbmlGeneIds(model)
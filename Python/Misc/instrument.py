@@ -0,0 +1,304 @@
+"""
+instrument.py records per-stage metrics for the parser and mapper runs. Each stage (a `with stage(...)` block or a
+function decorated with `timed`) appends one JSON line to the metrics file with its wall and CPU time, memory, rows in
+and out, and the network calls, bytes transferred and cache hits counted while it ran. A stage can also be profiled
+with cProfile (a .prof file for pstats/snakeviz) or with a low-overhead sampling profiler (collapsed stacks for
+flamegraph.pl/speedscope).
+
+Nothing is written unless a metrics file is configured, with configure() or the environment:
+
+  * UTILITIES_METRICS:     the JSON-lines metrics file
+  * UTILITIES_PROFILE:     'cprofile' or 'sample' to profile every stage
+  * UTILITIES_PROFILE_DIR: where profiles are written (next to the metrics file by default)
+  * UTILITIES_TRACEMALLOC: '1' to also report the tracemalloc peak of each stage (slower)
+
+Memory is reported as rss_delta_mb, how much the resident set grew (or shrank) while the stage ran, and
+peak_rss_so_far_mb, the peak RSS of the process up to the end of the stage. The latter is a process-lifetime peak, so it
+only tells which stage set a new peak, not how much memory a later stage needed on its own; use peak_traced_mb for that.
+
+`python instrument.py metrics.jsonl` summarizes a metrics file per stage.
+
+@author: Scott Campit
+"""
+
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILERS = ('cprofile', 'sample')
+
+# Counters shared by every thread; stages report how much they grew while the stage ran. failed_lookups counts the
+# requests a remote client gave up on after every retry, unparsed_ids the identifiers utilities.parse_ids could not read
+COUNTERS = ('network_calls', 'bytes_sent', 'bytes_received', 'cache_hits', 'cache_misses', 'failed_lookups',
+            'unparsed_ids')
+
+_settings = {'metrics': os.environ.get('UTILITIES_METRICS') or None,
+             'profile': os.environ.get('UTILITIES_PROFILE') or None,
+             'profileDir': os.environ.get('UTILITIES_PROFILE_DIR') or None,
+             'tracemalloc': os.environ.get('UTILITIES_TRACEMALLOC') == '1'}
+_counters = Counter()
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(metrics=None, profile=None, profileDir=None, traceMemory=None):
+    """
+    configure turns instrumentation on for the rest of the process. Arguments left as None keep their setting.
+
+    :param metrics:     A string denoting the JSON-lines file metrics are appended to
+    :param profile:     None, 'cprofile' or 'sample' to profile every stage
+    :param profileDir:  A string denoting the directory profiles are written to
+    :param traceMemory: A boolean flag to also report the tracemalloc peak of each stage (slower)
+    """
+    if profile is not None and profile not in PROFILERS:
+        raise ValueError('profile must be one of %s' % (PROFILERS,))
+    for key, value in (('metrics', metrics), ('profile', profile), ('profileDir', profileDir),
+                       ('tracemalloc', traceMemory)):
+        if value is not None:
+            _settings[key] = os.path.expanduser(value) if isinstance(value, str) else value
+
+
+def enabled():
+    return _settings['metrics'] is not None or _settings['profile'] is not None
+
+
+def count(**increments):
+    """
+    count adds to the shared counters, e.g. count(network_calls=1, bytes_received=2048).
+    """
+    with _lock:
+        _counters.update(increments)
+
+
+def total(key):
+    """
+    total returns the value a shared counter has reached in this process, e.g. total('failed_lookups').
+    """
+    with _lock:
+        return _counters[key]
+
+
+def _snapshot():
+    with _lock:
+        return {key: _counters[key] for key in COUNTERS}
+
+
+def _maxRssMb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def _rssMb():
+    """
+    _rssMb returns the current resident set size in MB, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def rows(value):
+    """
+    rows returns the number of rows of a dataframe, list or other sized result, or None.
+    """
+    if value is None or isinstance(value, (str, bytes)):
+        return None
+    if isinstance(value, dict):
+        return sum(rows(v) or 0 for v in value.values())
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _write(record):
+    path = _settings['metrics']
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    line = json.dumps(record, default=str) + '\n'
+    # One write per line in append mode, so lines from parallel jobs do not interleave
+    with _lock, open(path, 'a') as f:
+        f.write(line)
+
+
+class _Sampler:
+    """
+    _Sampler samples the stack of one thread at a fixed interval and counts each distinct stack.
+    """
+
+    def __init__(self, threadId, interval=0.005):
+        self.threadId = threadId
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, samples))
+
+
+def _profilePath(name, suffix):
+    directory = _settings['profileDir'] or os.path.dirname(os.path.abspath(_settings['metrics'] or 'metrics'))
+    os.makedirs(directory, exist_ok=True)
+    safe = re.sub(r'[^\w.-]+', '_', name)
+    return os.path.join(directory, '%s-%s-%d%s' % (safe, time.strftime('%Y%m%d-%H%M%S'), os.getpid(), suffix))
+
+
+class StageRecord(dict):
+    """
+    StageRecord is the metrics line of a running stage. The stage body may add to it, e.g. record['rows_out'] = n.
+    """
+    pass
+
+
+@contextmanager
+def stage(name, rowsIn=None, **extra):
+    """
+    stage measures the block it wraps and appends its metrics line when the block exits (also on errors).
+
+    :param name:   A string denoting the stage name
+    :param rowsIn: An optional integer denoting the number of input rows
+    :param extra:  Additional JSON-serializable fields for the metrics line
+    :return:       A StageRecord the block can set 'rows_out' (or anything else) on
+    """
+    record = StageRecord(stage=name, rows_in=rowsIn, rows_out=None, **extra)
+    if not enabled():
+        yield record
+        return
+
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    # Only the outermost stage of a thread is profiled; nested stages show up inside its profile
+    profiler = _settings['profile'] if depth == 0 else None
+    traced = _settings['tracemalloc'] and not tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.start()
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another thread is already being profiled (one cProfile at a time on newer Pythons)
+            profiler = None
+    elif profiler == 'sample':
+        profile = _Sampler(threading.get_ident())
+        profile.start()
+
+    before = _snapshot()
+    rssBefore = _rssMb()
+    started = time.time()
+    wall, cpu = time.perf_counter(), time.process_time()
+    record['status'] = 'ok'
+    try:
+        yield record
+    except BaseException as err:
+        record['status'] = 'error: %s' % type(err).__name__
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        after = _snapshot()
+        record.update((key, after[key] - before[key]) for key in COUNTERS)
+        if traced:
+            record['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        rssAfter = _rssMb()
+        record['rss_delta_mb'] = None if rssBefore is None or rssAfter is None else round(rssAfter - rssBefore, 1)
+        record['peak_rss_so_far_mb'] = _maxRssMb()
+        if profiler == 'cprofile':
+            profile.disable()
+            record['profile'] = _profilePath(name, '.prof')
+            profile.dump_stats(record['profile'])
+        elif profiler == 'sample':
+            record['profile'] = _profilePath(name, '.folded')
+            profile.stop(record['profile'])
+        record['started'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started))
+        record['pid'] = os.getpid()
+        _local.depth = depth
+        _write(record)
+
+
+def timed(name=None):
+    """
+    timed is a decorator that runs a function as a stage. Rows in are counted from the first argument and rows out
+    from the return value (see rows()).
+
+    :param name: A string denoting the stage name (the function name by default)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with stage(name or func.__name__, rowsIn=rows(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def summarize(path):
+    """
+    summarize totals a metrics file per stage.
+
+    :param path: A string denoting the JSON-lines metrics file
+    :return:     A Pandas dataframe with one row per stage, slowest first
+    """
+    import pandas as pd
+
+    df = pd.read_json(path, lines=True)
+    numeric = [c for c in ['wall_s', 'cpu_s'] + list(COUNTERS) if c in df]
+    summary = df.groupby('stage')[numeric].sum()
+    summary.insert(0, 'runs', df.groupby('stage').size())
+    for col in ('rss_delta_mb', 'peak_rss_so_far_mb', 'peak_traced_mb'):
+        if col in df:
+            summary[col] = df.groupby('stage')[col].max()
+    return summary.sort_values('wall_s', ascending=False)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize a stage metrics file per stage.')
+    parser.add_argument('metrics', help='JSON-lines metrics file')
+    args = parser.parse_args()
+    print(summarize(args.metrics).to_string())
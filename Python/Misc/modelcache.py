@@ -0,0 +1,247 @@
+"""
+modelcache.py keeps a compiled copy of each metabolic model on disk, keyed by the SHA-256 of the model file. A
+compiled model holds the species table, the identifiers.org annotations of every species and the gene list, stored
+as Parquet when pyarrow is installed (pickle otherwise). Every stage that needs one of these loads it in milliseconds
+instead of reparsing the model, and the cache is rebuilt automatically when the model file changes.
+
+@author: Scott Campit
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from sbml import (FBC, FBC_GENE_PRODUCT, SBML_SPECIES, decodeSbmlId, iterAnnotations, iterElements,
+                  parseIdentifiersUri)
+
+DEFAULT_DIR = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                           'models')
+
+# Bump when the compiled layout changes so stale entries are rebuilt
+FORMAT_VERSION = 2
+TABLES = ['species', 'annotations', 'genes']
+
+
+def fileDigest(path, blockSize=1 << 20):
+    """
+    fileDigest returns the SHA-256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cachedFileDigest(path, digestFile):
+    """
+    cachedFileDigest returns the SHA-256 of a file, remembering it in `digestFile` together with the file size and
+    modification time so that an unchanged file is not rehashed.
+
+    :param path:       A string denoting the path of the file to hash
+    :param digestFile: A string denoting the JSON file the digests are remembered in
+    :return:           The SHA-256 hex digest
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(digestFile) as f:
+            digests = json.load(f)
+    except (IOError, ValueError):
+        digests = {}
+
+    entry = digests.get(path)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha256']
+
+    digest = fileDigest(path)
+    digests[path] = {'stamp': stamp, 'sha256': digest}
+    os.makedirs(os.path.dirname(os.path.abspath(digestFile)), exist_ok=True)
+    tmp = digestFile + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(digests, f)
+    os.replace(tmp, digestFile)
+    return digest
+
+
+class CompiledModel:
+    """
+    CompiledModel holds the parts of a metabolic model that the parsers need:
+
+      * species:     one row per metabolite in model order, with 'id' (cobrapy ID, e.g. 'glc_D_c'), 'metaid', 'name'
+                     and 'compartment'. The row position is the metabolite position in the cobra model.
+      * annotations: one row per identifiers.org annotation, with the 'species' row position, 'namespace' and
+                     'identifier'
+      * genes:       one row per gene with its cobrapy 'id'
+    """
+
+    def __init__(self, species, annotations, genes):
+        self.species = species
+        self.annotations = annotations
+        self.genes = genes
+
+    @property
+    def metabolites(self):
+        return self.species['id'].tolist()
+
+    @property
+    def geneIds(self):
+        return self.genes['id'].tolist()
+
+
+def compileSbml(model):
+    """
+    compileSbml builds a CompiledModel from an SBML file in a single streaming pass, without cobrapy.
+    """
+    import pandas as pd
+
+    species = {'id': [], 'metaid': [], 'name': [], 'compartment': []}
+    annotations = {'species': [], 'namespace': [], 'identifier': []}
+    genes = []
+    for element in iterElements(model, (SBML_SPECIES, FBC_GENE_PRODUCT)):
+        if element.tag == FBC_GENE_PRODUCT:
+            genes.append(decodeSbmlId(element.get(FBC + 'id'), 'G_'))
+            continue
+        position = len(species['id'])
+        species['id'].append(decodeSbmlId(element.get('id'), 'M_'))
+        species['metaid'].append(element.get('metaid'))
+        species['name'].append(element.get('name'))
+        species['compartment'].append(element.get('compartment'))
+        for namespace, identifier in iterAnnotations(element):
+            annotations['species'].append(position)
+            annotations['namespace'].append(namespace)
+            annotations['identifier'].append(identifier)
+
+    return CompiledModel(pd.DataFrame(species), pd.DataFrame(annotations), pd.DataFrame({'id': genes}))
+
+
+def compileCobra(model):
+    """
+    compileCobra builds a CompiledModel from a MATLAB (.mat) or JSON model with cobrapy.
+    """
+    import cobra
+    import pandas as pd
+
+    if model.endswith('.mat'):
+        mdl = cobra.io.load_matlab_model(model)
+    else:
+        mdl = cobra.io.load_json_model(model)
+
+    species = pd.DataFrame({'id': [m.id for m in mdl.metabolites],
+                            'metaid': [m.id for m in mdl.metabolites],
+                            'name': [m.name for m in mdl.metabolites],
+                            'compartment': [m.compartment for m in mdl.metabolites]})
+    annotations = {'species': [], 'namespace': [], 'identifier': []}
+    for position, met in enumerate(mdl.metabolites):
+        for namespace, identifiers in met.annotation.items():
+            for identifier in (identifiers if isinstance(identifiers, list) else [identifiers]):
+                # Reuse the SBML URI rules so both paths yield the same namespaces and clean identifiers
+                annotation = parseIdentifiersUri('https://identifiers.org/%s/%s' % (namespace, identifier))
+                if annotation is not None:
+                    annotations['species'].append(position)
+                    annotations['namespace'].append(annotation[0])
+                    annotations['identifier'].append(annotation[1])
+    return CompiledModel(species, pd.DataFrame(annotations), pd.DataFrame({'id': [g.id for g in mdl.genes]}))
+
+
+def _usesParquet():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def _save(compiled, path):
+    os.makedirs(path, exist_ok=True)
+    parquet = _usesParquet()
+    for table in TABLES:
+        df = getattr(compiled, table)
+        if parquet:
+            df.to_parquet(os.path.join(path, table + '.parquet'), index=False)
+        else:
+            df.to_pickle(os.path.join(path, table + '.pkl'))
+
+
+def _load(path):
+    import pandas as pd
+
+    tables = {}
+    for table in TABLES:
+        parquetFile = os.path.join(path, table + '.parquet')
+        if os.path.exists(parquetFile):
+            tables[table] = pd.read_parquet(parquetFile)
+        else:
+            tables[table] = pd.read_pickle(os.path.join(path, table + '.pkl'))
+    return CompiledModel(**tables)
+
+
+class ModelCache:
+    """
+    ModelCache stores CompiledModels under `cacheDir/<sha256 of the model file>`. The digest of each model path is
+    remembered together with its size and modification time, so an unchanged model is not even rehashed.
+    """
+
+    def __init__(self, cacheDir=DEFAULT_DIR):
+        """
+        :param cacheDir: A string denoting the directory compiled models are stored in
+        """
+        self.cacheDir = cacheDir
+        self._digestFile = os.path.join(cacheDir, 'digests.json')
+
+    def _digest(self, model):
+        return cachedFileDigest(model, self._digestFile)
+
+    def load(self, model, build=True):
+        """
+        load returns the CompiledModel for a model file, compiling and storing it first if needed.
+
+        :param model:     A string denoting the path to the metabolic model (`.xml`, `.sbml`, `.mat` or `.json`)
+        :param build:     A boolean flag to compile a model that is not cached yet (None is returned otherwise)
+        :return compiled: A CompiledModel
+        """
+        path = os.path.join(self.cacheDir, '%s-v%d' % (self._digest(model), FORMAT_VERSION))
+        if os.path.isdir(path):
+            try:
+                return _load(path)
+            except (IOError, ValueError, EOFError):
+                pass
+        if not build:
+            return None
+
+        if os.path.splitext(model)[1] in ('.mat', '.json'):
+            compiled = compileCobra(model)
+        else:
+            compiled = compileSbml(model)
+
+        # Write to a scratch directory first so concurrent jobs never see a half-written entry
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        _save(compiled, tmp)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another job finished first; its entry is equivalent
+            shutil.rmtree(tmp, ignore_errors=True)
+        return compiled
+
+
+_default = None
+
+
+def loadCompiledModel(model, cacheDir=None, build=True):
+    """
+    loadCompiledModel returns the CompiledModel for a model file from the shared model cache.
+
+    :param model:    A string denoting the path to the metabolic model
+    :param cacheDir: An optional string denoting a cache directory other than DEFAULT_DIR
+    :param build:    A boolean flag to compile a model that is not cached yet (None is returned otherwise)
+    :return:         A CompiledModel
+    """
+    global _default
+    if cacheDir is not None:
+        return ModelCache(cacheDir).load(model, build=build)
+    if _default is None:
+        _default = ModelCache()
+    return _default.load(model, build=build)
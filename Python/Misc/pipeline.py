@@ -0,0 +1,256 @@
+"""
+pipeline.py is a small DAG runner with artifact checkpoints. Each stage's result is stored in a work directory
+together with a fingerprint of everything that produced it: the stage function, the source files of the code it runs,
+its parameters, the contents of its input files and the fingerprints of its upstream stages. A stage whose fingerprint
+has not changed is loaded from its checkpoint instead of being rerun, so the same command gives a cold run the first
+time and a fast warm run afterwards.
+A RunStamp goes one step further for command line tools: it remembers the arguments, inputs and code that wrote a set of
+output files, so a repeated command can exit before any stage (or pandas) is even imported.
+
+@author: Scott Campit
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+import instrument
+from modelcache import cachedFileDigest
+
+
+def _codeBytes(code):
+    # Nested code objects (comprehensions, lambdas) are hashed by content: their repr holds a memory address. The
+    # names a function calls are part of it too, since return foo(x) and return bar(x) compile to the same bytecode
+    parts = [code.co_code, ' '.join(code.co_names).encode('utf-8')]
+    for const in code.co_consts:
+        parts.append(_codeBytes(const) if inspect.iscode(const) else repr(const).encode('utf-8'))
+    return b'\0'.join(parts)
+
+
+def _codeDigest(func):
+    # Decorated functions (e.g. instrument.timed) are fingerprinted by the function they wrap
+    code = getattr(inspect.unwrap(func), '__code__', None)
+    if code is None:
+        return repr(func)
+    return hashlib.sha256(_codeBytes(code)).hexdigest()
+
+
+def _sourceDigests(directories, digestFile):
+    # The content digest of every .py file in `directories`, which covers code a stage function only calls
+    sources = sorted(os.path.join(d, f) for d in directories for f in os.listdir(d) if f.endswith('.py'))
+    return [cachedFileDigest(f, digestFile) for f in sources]
+
+
+class Stage:
+    """
+    Stage describes one step of a Pipeline.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=()):
+        """
+        :param name:   A string denoting the stage name (also the checkpoint file name)
+        :param func:   A callable taking the results of `inputs` positionally and `params` as keyword arguments
+        :param inputs: A list of upstream stage names
+        :param params: A dictionary of keyword arguments; their repr is part of the fingerprint
+        :param files:  A list of input file paths whose contents are part of the fingerprint
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.files = list(files)
+
+
+class Pipeline:
+    """
+    Pipeline runs Stages in dependency order and checkpoints their results in `workDir`.
+    """
+
+    def __init__(self, workDir, code=()):
+        """
+        :param workDir: A string denoting the directory checkpoints and manifests are written to
+        :param code:    A list of directories whose .py files are part of every stage's fingerprint, so an edit to a
+                        function a stage calls reruns it. Without them only the stage function itself is covered
+        """
+        self.workDir = os.path.expanduser(workDir)
+        os.makedirs(self.workDir, exist_ok=True)
+        self.stages = {}
+        self.code = [os.path.expanduser(d) for d in code]
+        # Stage name -> number of failed remote lookups during the last run (see instrument.COUNTERS)
+        self.failed = {}
+        self._digestFile = os.path.join(self.workDir, 'digests.json')
+
+    def add(self, name, func, inputs=(), params=None, files=()):
+        """
+        add registers a stage. Stages must be added after the stages they depend on.
+        """
+        for upstream in inputs:
+            if upstream not in self.stages:
+                raise KeyError('Stage %s depends on unknown stage %s' % (name, upstream))
+        self.stages[name] = Stage(name, func, inputs, params, files)
+        return self.stages[name]
+
+    def artifact(self, name, suffix):
+        """
+        artifact returns a path in the work directory for a stage that writes its own output file.
+        """
+        return os.path.join(self.workDir, name + suffix)
+
+    def _fingerprint(self, stage, fingerprints, sources):
+        payload = {'stage': stage.name,
+                   'code': _codeDigest(stage.func),
+                   'sources': sources,
+                   'params': {k: repr(v) for k, v in sorted(stage.params.items())},
+                   'files': [cachedFileDigest(f, self._digestFile) for f in stage.files],
+                   'inputs': [fingerprints[i] for i in stage.inputs]}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _manifest(self, name):
+        try:
+            with open(os.path.join(self.workDir, name + '.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _load(self, name, results):
+        if name not in results:
+            with open(os.path.join(self.workDir, name + '.pkl'), 'rb') as f:
+                results[name] = pickle.load(f)
+        return results[name]
+
+    def run(self, targets=None, force=()):
+        """
+        run executes the stages needed for `targets`, skipping every stage whose checkpoint is up to date. Checkpoints
+        of skipped stages are only read if a stage that does run (or a target) needs them. A stage during which a
+        remote client gave up on a lookup is not marked up to date (see `failed`), so the next run retries it.
+
+        :param targets: A list of stage names to produce (all stages by default)
+        :param force:   A list of stage names to rerun even if their checkpoint is up to date; the stages downstream of
+                        them are rerun too
+        :return:        A dictionary mapping each target to its result
+        """
+        targets = list(targets or self.stages)
+        self.failed = {}
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+
+        sources = _sourceDigests(self.code, self._digestFile)
+        fingerprints = {}
+        results = {}
+        rerun = set()
+        for name, stage in self.stages.items():
+            if name not in needed:
+                continue
+            fingerprints[name] = self._fingerprint(stage, fingerprints, sources)
+            checkpoint = os.path.join(self.workDir, name + '.pkl')
+
+            if (name not in force and not rerun.intersection(stage.inputs)
+                    and self._manifest(name).get('fingerprint') == fingerprints[name] and os.path.exists(checkpoint)):
+                print('Stage %s is up to date' % name)
+                continue
+
+            print('Running stage %s' % name)
+            rerun.add(name)
+            start = time.time()
+            failedBefore = instrument.total('failed_lookups')
+            with instrument.stage('pipeline.' + name) as record:
+                results[name] = stage.func(*[self._load(i, results) for i in stage.inputs], **stage.params)
+                record['rows_out'] = instrument.rows(results[name])
+            tmp = checkpoint + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(results[name], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, checkpoint)
+
+            # A stage whose remote lookups partly failed keeps its checkpoint for the stages after it, but gets no
+            # manifest, so the next run retries it (and reruns everything downstream)
+            manifest = os.path.join(self.workDir, name + '.json')
+            failed = instrument.total('failed_lookups') - failedBefore
+            if failed:
+                self.failed[name] = failed
+                print('Stage %s finished with %d failed lookups; it will be rerun next time' % (name, failed))
+                if os.path.exists(manifest):
+                    os.remove(manifest)
+                continue
+            with open(manifest, 'w') as f:
+                json.dump({'fingerprint': fingerprints[name],
+                           'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                           'seconds': round(time.time() - start, 3)}, f, indent=2)
+
+        return {name: self._load(name, results) for name in targets}
+
+
+def _stat(path):
+    try:
+        stat = os.stat(os.path.expanduser(path))
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class RunStamp:
+    """
+    RunStamp remembers which command wrote a set of output files.
+    """
+
+    def __init__(self, path, command, params, files=(), code=()):
+        """
+        :param path:    A string denoting the JSON file the stamp is kept in
+        :param command: A string denoting the command name
+        :param params:  A dictionary of the arguments that determine the outputs; their repr is part of the key
+        :param files:   A list of input file paths whose contents are part of the key
+        :param code:    A list of directories whose .py files are part of the key
+        """
+        self.path = os.path.expanduser(path)
+        self.command = command
+        self.params = dict(params)
+        self.files = [f for f in files if f]
+        self.code = list(code)
+        self._digestFile = os.path.join(os.path.dirname(os.path.abspath(self.path)), 'digests.json')
+
+    def key(self):
+        payload = {'command': self.command,
+                   'params': {k: repr(v) for k, v in sorted(self.params.items())},
+                   'files': [cachedFileDigest(f, self._digestFile) for f in self.files],
+                   'code': _sourceDigests(self.code, self._digestFile)}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def upToDate(self, outputs):
+        """
+        upToDate reports whether every output was written by a run with the same key and is unchanged since. Missing
+        inputs count as changed, so the real run reports them.
+
+        :param outputs: A list of output file paths
+        :return:        A boolean
+        """
+        try:
+            with open(self.path) as f:
+                stamp = json.load(f)
+            key = self.key()
+        except (IOError, ValueError):
+            return False
+        return (stamp.get('key') == key
+                and stamp.get('outputs') == {os.path.abspath(os.path.expanduser(o)): _stat(o) for o in outputs}
+                and all(_stat(o) is not None for o in outputs))
+
+    def record(self, outputs):
+        """
+        record stamps `outputs` as written by this run.
+
+        :param outputs: A list of output file paths
+        """
+        stamp = {'key': self.key(), 'command': self.command,
+                 'outputs': {os.path.abspath(os.path.expanduser(o)): _stat(o) for o in outputs},
+                 'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(stamp, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,160 @@
+"""
+remote.py contains the shared plumbing for talking to the remote identifier services (PubChem, MetaboAnalyst and
+MyGene): a thread-safe rate limiter, pooled HTTP sessions, retries with exponential backoff for transient failures
+and coalescing of identical requests that are in flight at the same time.
+@author: Scott Campit
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+from instrument import count
+
+# HTTP status codes that signal throttling or a busy server rather than a bad query
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+
+class TransientError(Exception):
+    """
+    TransientError is raised when a request still fails after every retry.
+    """
+    pass
+
+
+class RateLimiter:
+    """
+    RateLimiter spaces out calls so that no more than `rate` requests start per `period` seconds, across all threads
+    sharing the limiter.
+    """
+
+    def __init__(self, rate=5, period=1.0):
+        """
+        :param rate:   The maximum number of requests that may start per period
+        :param period: The length of the period in seconds
+        """
+        self.interval = float(period) / rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        """
+        wait blocks the calling thread until it is allowed to start its next request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SingleFlight:
+    """
+    SingleFlight coalesces concurrent calls that share a key: the first caller runs the call and every caller that
+    arrives while it is in flight waits for, and receives, the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        do returns func(*args, **kwargs), sharing one call between all concurrent callers with the same key.
+
+        :param key:  A hashable key identifying the request
+        :param func: The callable that performs the request
+        :return:     The result of the call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def makeSession(poolSize=10, headers=None):
+    """
+    makeSession creates a requests Session whose connection pool is large enough for `poolSize` concurrent workers,
+    so that connections are reused instead of being opened for every request.
+
+    :param poolSize: An integer denoting the number of connections to keep alive per host
+    :param headers:  A dictionary of headers sent with every request
+    :return session: A requests Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers is not None:
+        session.headers.update(headers)
+    return session
+
+
+def requestWithRetry(session, method, url, limiter=None, retries=5, backoff=1.0, maxBackoff=60.0, **kwargs):
+    """
+    requestWithRetry sends a request through `session`, waiting on `limiter` before every attempt. Throttling, server
+    errors, dropped connections and timeouts are retried with jittered exponential backoff (or the server's
+    Retry-After header). Any other response, including 4xx errors, is returned to the caller as-is.
+
+    :param session:    A requests Session
+    :param method:     A string denoting the HTTP method
+    :param url:        A string denoting the URL to request
+    :param limiter:    An optional RateLimiter shared by all workers hitting the same service
+    :param retries:    An integer denoting the number of retries after the first attempt
+    :param backoff:    A float denoting the initial backoff in seconds
+    :param maxBackoff: A float denoting the longest backoff in seconds
+    :return response:  A requests Response
+    """
+    import requests
+
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        retryAfter = None
+        body = kwargs.get('data') or ''
+        count(network_calls=1, bytes_sent=len(body if isinstance(body, (str, bytes)) else urlencode(body)))
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            error = err
+        else:
+            # Streamed bodies have not been read yet; count what the server announced
+            if kwargs.get('stream'):
+                count(bytes_received=int(response.headers.get('Content-Length') or 0))
+            else:
+                count(bytes_received=len(response.content))
+            if response.status_code not in TRANSIENT_STATUS:
+                return response
+            error = 'HTTP %d' % response.status_code
+            retryAfter = response.headers.get('Retry-After')
+
+        if attempt == retries:
+            break
+        if retryAfter is not None and retryAfter.isdigit():
+            delay = float(retryAfter)
+        else:
+            delay = min(maxBackoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        time.sleep(delay)
+
+    raise TransientError('%s %s failed after %d attempts: %s' % (method, url, retries + 1, error))
@@ -0,0 +1,150 @@
+"""
+sbml.py contains streaming helpers for reading SBML metabolic models with lxml without loading the whole document
+into memory.
+@author: Scott Campit
+"""
+
+import re
+from urllib.parse import unquote
+
+SBML_CORE = '{http://www.sbml.org/sbml/level3/version1/core}'
+SBML_SPECIES = SBML_CORE + 'species'
+FBC = '{http://www.sbml.org/sbml/level3/version1/fbc/version2}'
+FBC_GENE_PRODUCT = FBC + 'geneProduct'
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+RDF_LI = RDF + 'li'
+RDF_RESOURCE = RDF + 'resource'
+
+# identifiers.org namespace -> (annotation key, local ID prefix to strip). Compact URIs such as
+# https://identifiers.org/CHEBI:15422 are matched on the lower-cased prefix instead of a namespace path segment.
+IDENTIFIERS_NAMESPACES = {
+    'chebi': ('chebi', 'CHEBI:'),
+    'hmdb': ('hmdb', ''),
+    'kegg.compound': ('kegg.compound', ''),
+    'bigg.metabolite': ('bigg.metabolite', ''),
+    'metanetx.chemical': ('metanetx.chemical', ''),
+    'inchikey': ('inchikey', ''),
+    'seed.compound': ('seed', ''),
+    'seed': ('seed', ''),
+    'pubchem.compound': ('pubchem.compound', ''),
+}
+ANNOTATION_KEYS = list(dict.fromkeys(key for key, _ in IDENTIFIERS_NAMESPACES.values()))
+
+# cobrapy escapes characters that are not allowed in SBML IDs as '__<ord>__' and the dots of gene IDs as
+# '__SBML_DOT__' when it writes a model
+SBML_DOT = '__SBML_DOT__'
+_SBML_ESCAPE = re.compile(r'__(\d+)__')
+
+_IDENTIFIERS_URI = re.compile(r'^(?:https?://)?identifiers\.org/(?:([^/:]+)/)?(?:([^/:]+):)?([^/]+)$', re.IGNORECASE)
+
+
+def parseIdentifiersUri(uri):
+    """
+    parseIdentifiersUri splits an identifiers.org URI into an annotation key and a clean identifier with a single regex
+    match and a table lookup, e.g. 'http://identifiers.org/chebi/CHEBI:15422' -> ('chebi', '15422').
+
+    :param uri: A string denoting the rdf:resource of an annotation
+    :return:    A tuple of (annotation key, identifier), or None for namespaces outside IDENTIFIERS_NAMESPACES
+    """
+    match = _IDENTIFIERS_URI.match(uri)
+    if match is None:
+        return None
+    namespace, prefix, local = match.groups()
+    entry = IDENTIFIERS_NAMESPACES.get((namespace or prefix or '').lower())
+    if entry is None:
+        return None
+
+    key, strip = entry
+    identifier = unquote(local)
+    if namespace is not None and prefix is not None:
+        identifier = prefix + ':' + identifier
+    if strip and identifier.upper().startswith(strip):
+        identifier = identifier[len(strip):]
+    return key, identifier
+
+
+def iterAnnotations(element):
+    """
+    iterAnnotations reads the rdf:resource attribute of every rdf:li under an element (usually a <species>) and
+    yields the identifiers.org annotations it recognizes, in document order.
+
+    :param element: An lxml element
+    :return:        A generator of (annotation key, identifier) tuples
+    """
+    for li in element.iter(RDF_LI):
+        uri = li.get(RDF_RESOURCE)
+        if uri is None:
+            continue
+        annotation = parseIdentifiersUri(uri)
+        if annotation is not None:
+            yield annotation
+
+
+def iterElements(model, tag):
+    """
+    iterElements streams the elements with the given tag from an SBML file. Every other element is cleared at its end
+    event unless it sits inside a streamed element, and each element is detached from its already-processed siblings,
+    so sections the caller does not read (reactions, their annotations, ...) are never kept either and memory stays
+    flat regardless of model size.
+
+    :param model: A string denoting the path to the metabolic model (`.xml` or `.sbml`)
+    :param tag:   A string (or tuple of strings) denoting the fully qualified tag(s) to stream, e.g. SBML_SPECIES
+    :return:      A generator of lxml elements
+    """
+    from lxml import etree
+
+    tags = {tag} if isinstance(tag, str) else set(tag)
+    # Depth inside a streamed element, whose children must be kept until the caller has read them
+    depth = 0
+    for event, element in etree.iterparse(model, events=('start', 'end')):
+        if event == 'start':
+            if depth or element.tag in tags:
+                depth += 1
+            continue
+        if depth:
+            depth -= 1
+            if depth:
+                continue
+            yield element
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+def iterSpecies(model):
+    """
+    iterSpecies streams the <species> elements of an SBML level 3 model.
+
+    :param model: A string denoting the path to the metabolic model (`.xml` or `.sbml`)
+    :return:      A generator of lxml elements
+    """
+    return iterElements(model, SBML_SPECIES)
+
+
+def stripPrefix(identifier, prefix):
+    """
+    stripPrefix removes the SBML type prefix ('M_', 'G_', 'R_') from an identifier, like cobrapy's _clip.
+    """
+    if identifier is not None and identifier.startswith(prefix):
+        return identifier[len(prefix):]
+    return identifier
+
+
+def decodeSbmlId(identifier, prefix):
+    """
+    decodeSbmlId turns an SBML ID back into the ID cobrapy gives it when it reads a model, following cobrapy's
+    _f_gene and _f_specie: '__SBML_DOT__' becomes '.' (genes only), every '__NN__' escape becomes chr(NN), and the
+    type prefix is clipped last, e.g. 'G_3098__46__1' -> '3098.1'.
+
+    :param identifier: A string denoting the SBML ID
+    :param prefix:     A string denoting the SBML type prefix ('M_', 'G_' or 'R_')
+    :return:           The cobrapy ID
+    """
+    if identifier is None:
+        return identifier
+    if prefix == 'G_':
+        identifier = identifier.replace(SBML_DOT, '.')
+    identifier = _SBML_ESCAPE.sub(lambda match: chr(int(match.group(1))), identifier)
+    return stripPrefix(identifier, prefix)
@@ -0,0 +1,151 @@
+"""
+sheetcache.py keeps a columnar copy of the sheets of an Excel workbook, so each sheet is only parsed by openpyxl the
+first time it is read. Sheets are converted one at a time as they are requested. The sidecar is keyed by the SHA-256
+of the workbook (the digest itself is remembered by file size and modification time), and each sheet is stored as
+Feather when pyarrow is installed (pickle otherwise). Feather sheets are memory-mapped and only the requested columns
+are read.
+
+@author: Scott Campit
+"""
+
+import json
+import os
+
+import pandas as pd
+
+from modelcache import cachedFileDigest
+
+try:
+    from pyarrow.lib import ArrowException
+except ImportError:
+    # Without pyarrow to_feather raises ImportError, which _saveSheet catches anyway
+    ArrowException = ImportError
+
+DEFAULT_DIR = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                           'sheets')
+
+# Bump when the sidecar layout changes so stale entries are rebuilt
+FORMAT_VERSION = 2
+
+
+def _saveSheet(df, path):
+    # Written under a temporary name, so a job reading the sheet never sees a partial file
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        df.reset_index(drop=True).to_feather(tmp)
+        suffix = '.feather'
+    except (ImportError, ValueError, TypeError, ArrowException):
+        # No pyarrow, or a sheet Arrow cannot store (non-string headers, mixed-type columns)
+        df.to_pickle(tmp)
+        suffix = '.pkl'
+    os.replace(tmp, path + suffix)
+
+
+def _loadSheet(path, columns=None):
+    """
+    _loadSheet reads a converted sheet, or returns None if the sheet has not been converted yet.
+    """
+    if os.path.exists(path + '.feather'):
+        from pyarrow import feather
+        return feather.read_table(path + '.feather', columns=columns, memory_map=True).to_pandas()
+    if not os.path.exists(path + '.pkl'):
+        return None
+    df = pd.read_pickle(path + '.pkl')
+    return df if columns is None else df[columns]
+
+
+class SheetCache:
+    """
+    SheetCache stores the sheets of each workbook under `cacheDir/<sha256 of the workbook>`, one file per sheet that has
+    been read plus a `sheets.json` listing the sheet names in workbook order.
+    """
+
+    def __init__(self, cacheDir=DEFAULT_DIR):
+        """
+        :param cacheDir: A string denoting the directory sidecars are stored in
+        """
+        self.cacheDir = cacheDir
+        self._digestFile = os.path.join(cacheDir, 'digests.json')
+
+    def _entry(self, filename):
+        """
+        _entry returns the sidecar directory and sheet names of a workbook, reading the sheet names first if needed.
+        """
+        path = os.path.join(self.cacheDir, '%s-v%d' % (cachedFileDigest(filename, self._digestFile),
+                                                       FORMAT_VERSION))
+        try:
+            with open(os.path.join(path, 'sheets.json')) as f:
+                return path, json.load(f)
+        except (IOError, ValueError):
+            pass
+
+        # Only the workbook index is read here; the sheets themselves are converted when they are first requested
+        with pd.ExcelFile(os.path.expanduser(filename)) as workbook:
+            names = workbook.sheet_names
+        os.makedirs(path, exist_ok=True)
+        tmp = os.path.join(path, 'sheets.json.%d.tmp' % os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(names, f)
+        os.replace(tmp, os.path.join(path, 'sheets.json'))
+        return path, names
+
+    def sheetNames(self, filename):
+        """
+        sheetNames returns the sheet names of a workbook in workbook order.
+        """
+        return self._entry(filename)[1]
+
+    def read(self, filename, sheet=0, columns=None):
+        """
+        read returns one sheet of a workbook.
+
+        :param filename: A string denoting the path to the Excel workbook
+        :param sheet:    A string denoting the tab name, or an integer denoting its position
+        :param columns:  An optional list of column names to read
+        :return:         A Pandas dataframe
+        """
+        path, names = self._entry(filename)
+        if isinstance(sheet, int):
+            position = sheet
+        elif sheet in names:
+            position = names.index(sheet)
+        else:
+            raise ValueError('Worksheet named %r not found' % sheet)
+        sheetPath = os.path.join(path, str(position))
+        df = _loadSheet(sheetPath, columns)
+        if df is None:
+            _saveSheet(pd.read_excel(os.path.expanduser(filename), sheet_name=names[position]), sheetPath)
+            df = _loadSheet(sheetPath, columns)
+        return df
+
+
+_default = None
+
+
+def _resolve(cacheDir):
+    global _default
+    if cacheDir is not None:
+        return SheetCache(cacheDir)
+    if _default is None:
+        _default = SheetCache()
+    return _default
+
+
+def readSheet(filename, sheet=0, columns=None, cacheDir=None):
+    """
+    readSheet reads one sheet of an Excel workbook through the shared sheet cache.
+
+    :param filename: A string denoting the path to the Excel workbook
+    :param sheet:    A string denoting the tab name, or an integer denoting its position
+    :param columns:  An optional list of column names to read
+    :param cacheDir: An optional string denoting a cache directory other than DEFAULT_DIR
+    :return:         A Pandas dataframe
+    """
+    return _resolve(cacheDir).read(filename, sheet, columns)
+
+
+def sheetNames(filename, cacheDir=None):
+    """
+    sheetNames returns the sheet names of an Excel workbook through the shared sheet cache.
+    """
+    return _resolve(cacheDir).sheetNames(filename)
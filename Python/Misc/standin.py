@@ -0,0 +1,370 @@
+"""
+standin.py is a local HTTP stand-in for the remote identifier services (PubChem PUG-REST, MetaboAnalyst mapcompounds and
+mygene.info), for load-testing the bulk clients offline. It replays recorded responses and can inject latency, server
+errors and rate limiting. Responses are recorded per item, by proxying to the real services in record mode or with the
+record* methods, and are stored in a ResponseCache, so a recording answers any batching of the same names:
+
+  * pubchem/sids:            name -> list of SIDs ([] when PubChem has no match)
+  * pubchem/sid:             SID -> raw PC_Substances record
+  * metaboanalyst/name:      name -> mapcompounds row
+  * mygene/<scopes;fields;species>: identifier -> list of hits
+
+Each service is served under its own prefix. Point the clients at `serviceUrl(service)`, or export the
+PUBCHEM_URL, METABOANALYST_URL and MYGENE_URL variables printed when the stand-in is run as a script:
+
+    python standin.py --store recording.sqlite --latency 0.2 --error-rate 0.05 --rate-limit 5
+
+@author: Scott Campit
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from cache import ResponseCache, normalizeQuery
+
+DEFAULT_PATH = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                            'standin.sqlite')
+
+# Service prefix -> real API root (used in record mode) and the environment variable its clients read
+UPSTREAMS = {'pubchem': 'https://pubchem.ncbi.nlm.nih.gov/rest/pug',
+             'metaboanalyst': 'http://api.xialab.ca',
+             'mygene': 'https://mygene.info/v3'}
+ENVIRONMENT = {'pubchem': 'PUBCHEM_URL', 'metaboanalyst': 'METABOANALYST_URL', 'mygene': 'MYGENE_URL'}
+
+# mapcompounds columns; '-' marks a missing identifier
+MAPCOMPOUNDS_COLUMNS = ['query', 'hmdb_id', 'kegg_id', 'pubchem_id', 'chebi_id', 'metlin_id']
+
+
+def myGeneNamespace(scopes, fields, species):
+    """
+    myGeneNamespace returns the store namespace for a MyGene query, with list parameters joined by commas.
+    """
+    def joined(value):
+        value = value if isinstance(value, str) else ','.join(value)
+        return ','.join(v.strip() for v in value.split(',') if v.strip())
+    return 'scopes=%s;fields=%s;species=%s' % (joined(scopes), joined(fields), species)
+
+
+class _Reply(Exception):
+    """
+    _Reply carries a response out of a request handler.
+    """
+
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, clientAddress):
+        # Clients closing idle keep-alive connections are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, clientAddress)
+
+
+def _notFound():
+    return _Reply(404, {'Fault': {'Code': 'PUGREST.NotFound', 'Message': 'No CID found'}})
+
+
+class StandInServer:
+    """
+    StandInServer replays recorded responses for the remote identifier services, with optional fault injection.
+    Request counts are kept in `stats`.
+    """
+
+    def __init__(self, store=DEFAULT_PATH, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, errorRate=0.0,
+                 rateLimit=None, record=False, seed=None):
+        """
+        :param store:     A string denoting the recording (a ResponseCache database), or a ResponseCache
+        :param host:      A string denoting the interface to listen on
+        :param port:      An integer denoting the port to listen on (0 picks a free port)
+        :param latency:   A float denoting the seconds every response is delayed by
+        :param jitter:    A float denoting the largest random delay in seconds added on top of `latency`
+        :param errorRate: A float denoting the fraction of requests answered with HTTP 503
+        :param rateLimit: An optional number of requests allowed per second; requests over it get HTTP 429 with a
+                          Retry-After header
+        :param record:    A boolean flag to proxy every request to the real service and record its response
+        :param seed:      An optional integer seed for the injected faults
+        """
+        if isinstance(store, str):
+            # Recordings never expire and are never evicted
+            store = ResponseCache(os.path.expanduser(store), ttl=None, maxEntries=float('inf'))
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.rateLimit = rateLimit
+        self.record = record
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'misses': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._session = None
+        self._thread = None
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                standin._handle(self, 'GET')
+
+            def do_POST(self):
+                standin._handle(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def serviceUrl(self, service):
+        """
+        serviceUrl returns the base URL a client of `service` ('pubchem', 'metaboanalyst' or 'mygene') should use.
+        The MetaboAnalyst client takes the full endpoint, `serviceUrl('metaboanalyst') + '/mapcompounds'`.
+        """
+        return '%s/%s' % (self.url, service)
+
+    def environment(self):
+        """
+        environment returns the environment variables that point every client at this stand-in.
+        """
+        return {ENVIRONMENT[s]: self.serviceUrl(s) + ('/mapcompounds' if s == 'metaboanalyst' else '')
+                for s in UPSTREAMS}
+
+    def start(self):
+        """
+        start serves requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Recording
+
+    def recordPubChem(self, name, records):
+        """
+        recordPubChem stores the substance records PubChem returns for a name (an empty list records 'not found').
+
+        :param name:    A string denoting the metabolite name
+        :param records: A list of raw PC_Substances records
+        """
+        self.store.set('pubchem', 'sids', name, [r['sid']['id'] for r in records])
+        self.store.setMany('pubchem', 'sid', {str(r['sid']['id']): r for r in records})
+
+    def recordMetaboAnalyst(self, rows):
+        """
+        recordMetaboAnalyst stores mapcompounds rows, each keyed by its 'query'.
+        """
+        self.store.setMany('metaboanalyst', 'name', {row['query']: row for row in rows})
+
+    def recordMyGene(self, scopes, fields, species, hits):
+        """
+        recordMyGene stores MyGene hits (including {'query': ..., 'notfound': True} entries), grouped by query.
+        """
+        grouped = {}
+        for hit in hits:
+            grouped.setdefault(hit['query'], []).append(hit)
+        self.store.setMany('mygene', myGeneNamespace(scopes, fields, species), grouped)
+
+    # Request handling
+
+    def _inject(self):
+        now = time.monotonic()
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.rateLimit is not None:
+                while self._recent and self._recent[0] <= now - 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rateLimit:
+                    self.stats['throttled'] += 1
+                    raise _Reply(429, {'error': 'rate limit exceeded'}, {'Retry-After': '1'})
+                self._recent.append(now)
+            if self._random.random() < self.errorRate:
+                self.stats['errors'] += 1
+                raise _Reply(503, {'error': 'injected failure'})
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handle(self, handler, method):
+        parts = urlsplit(handler.path)
+        service, _, path = parts.path.lstrip('/').partition('/')
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        try:
+            if service not in UPSTREAMS:
+                raise _Reply(404, {'error': 'unknown service %r' % service})
+            self._inject()
+            path = '/' + path.rstrip('/')
+            if self.record:
+                self._forward(service, method, path, parts.query, body, handler.headers.get('Content-Type'))
+            getattr(self, '_' + service)(method, path, parse_qs(parts.query), body)
+        except _Reply as reply:
+            payload = reply.body if isinstance(reply.body, bytes) else json.dumps(reply.body).encode()
+            handler.send_response(reply.status)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(payload)))
+            for key, value in reply.headers.items():
+                handler.send_header(key, value)
+            handler.end_headers()
+            handler.wfile.write(payload)
+
+    def _forward(self, service, method, path, query, body, contentType):
+        """
+        _forward sends a request on to the real service, records the items in its response and replies with it as-is.
+        """
+        if self._session is None:
+            from remote import makeSession
+            self._session = makeSession(poolSize=16)
+        url = UPSTREAMS[service] + path + ('?' + query if query else '')
+        response = self._session.request(method, url, data=body or None, timeout=120,
+                                         headers={'Content-Type': contentType} if contentType else None)
+        if response.status_code in (200, 404):
+            self._recordResponse(service, path, body, response)
+        raise _Reply(response.status_code, response.content)
+
+    def _recordResponse(self, service, path, body, response):
+        form = _form(body)
+        if service == 'pubchem':
+            name = _pubchemName(path, form)
+            result = response.json() if response.status_code == 200 else {}
+            if path.endswith('/sids/JSON') and name is not None:
+                self.store.set('pubchem', 'sids', name, result.get('IdentifierList', {}).get('SID', []))
+            elif name is not None:
+                self.recordPubChem(name, result.get('PC_Substances', []))
+            else:
+                self.store.setMany('pubchem', 'sid', {str(r['sid']['id']): r
+                                                      for r in result.get('PC_Substances', [])})
+        elif service == 'metaboanalyst' and response.status_code == 200:
+            columns = response.json()
+            self.recordMetaboAnalyst(dict(zip(columns, values)) for values in zip(*columns.values()))
+        elif service == 'mygene' and response.status_code == 200:
+            self.recordMyGene(form.get('scopes', ''), form.get('fields', ''), form.get('species', ''),
+                              response.json())
+
+    def _lookup(self, service, namespace, queries):
+        found = self.store.getMany(service, namespace, queries)
+        missing = sum(normalizeQuery(q) not in found for q in queries)
+        if missing:
+            with self._lock:
+                self.stats['misses'] += missing
+        return found
+
+    def _pubchem(self, method, path, query, body):
+        form = _form(body)
+        name = _pubchemName(path, form)
+        if name is not None:
+            sids = self._lookup('pubchem', 'sids', [name]).get(normalizeQuery(name))
+            if not sids:
+                raise _notFound()
+            if path.endswith('/sids/JSON'):
+                raise _Reply(200, {'IdentifierList': {'SID': sids}})
+        elif path == '/substance/sid/JSON':
+            sids = [s for s in (form.get('sid') or query.get('sid', [''])[0]).split(',') if s]
+        else:
+            raise _Reply(400, {'Fault': {'Code': 'PUGREST.BadRequest', 'Message': 'Unsupported request'}})
+
+        records = self._lookup('pubchem', 'sid', [str(s) for s in sids])
+        found = [records[str(s)] for s in sids if str(s) in records]
+        if not found:
+            raise _notFound()
+        raise _Reply(200, {'PC_Substances': found})
+
+    def _metaboanalyst(self, method, path, query, body):
+        names = [n for n in json.loads(body or b'{}').get('queryList', '').split(';') if n]
+        rows = self._lookup('metaboanalyst', 'name', names)
+        columns = {col: [] for col in MAPCOMPOUNDS_COLUMNS}
+        for name in names:
+            row = rows.get(normalizeQuery(name), {})
+            for col, values in columns.items():
+                values.append(name if col == 'query' else row.get(col, '-'))
+        raise _Reply(200, columns)
+
+    def _mygene(self, method, path, query, body):
+        form = _form(body) if method == 'POST' else {k: v[0] for k, v in query.items()}
+        ids = [i.strip() for i in form.get('q', '').split(',') if i.strip()]
+        namespace = myGeneNamespace(form.get('scopes', ''), form.get('fields', ''), form.get('species', ''))
+        hits = self._lookup('mygene', namespace, ids)
+        out = []
+        for i in ids:
+            out.extend(dict(hit, query=i) for hit in hits.get(normalizeQuery(i), [{'notfound': True}]))
+        raise _Reply(200, out)
+
+
+def _form(body):
+    """
+    _form decodes a url-encoded request body into a dictionary of single values.
+    """
+    try:
+        return {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+    except UnicodeDecodeError:
+        return {}
+
+
+def _pubchemName(path, form):
+    """
+    _pubchemName returns the name of a PUG-REST substance/name request, from the URL (PubChemClient) or from the form
+    body (pubchempy posts names), or None for other requests.
+    """
+    segments = path.strip('/').split('/')
+    if segments[:2] != ['substance', 'name']:
+        return None
+    if len(segments) > 3 and segments[2] not in ('JSON', 'sids'):
+        return unquote(segments[2])
+    return form.get('name')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve recorded PubChem, MetaboAnalyst and MyGene responses.')
+    parser.add_argument('--store', default=DEFAULT_PATH, help='Recording to replay (and add to with --record)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Largest random extra delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 503')
+    parser.add_argument('--rate-limit', type=float, help='Requests per second before answering HTTP 429')
+    parser.add_argument('--record', action='store_true', help='Proxy to the real services and record the responses')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = StandInServer(args.store, args.host, args.port, args.latency, args.jitter, args.error_rate,
+                           args.rate_limit, args.record, args.seed)
+    for key, value in server.environment().items():
+        print('export %s=%s' % (key, value))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(server.stats)
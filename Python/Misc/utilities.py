@@ -2,22 +2,239 @@
 @author: Scott Campit
 """
 
+import os
+import re
+import unicodedata
+import warnings
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 
+from instrument import count
+
+# Characters stripped from metabolite names before matching
+NAME_JUNK = '[]\'".'
+_NAME_JUNK_TABLE = str.maketrans('', '', NAME_JUNK)
+
+GREEK_LETTERS = {'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta', 'ε': 'epsilon', 'ζ': 'zeta',
+                 'η': 'eta', 'θ': 'theta', 'ι': 'iota', 'κ': 'kappa', 'λ': 'lambda', 'μ': 'mu',
+                 'ν': 'nu', 'ξ': 'xi', 'ο': 'omicron', 'π': 'pi', 'ρ': 'rho', 'σ': 'sigma',
+                 'ς': 'sigma', 'τ': 'tau', 'υ': 'upsilon', 'φ': 'phi', 'χ': 'chi', 'ψ': 'psi',
+                 'ω': 'omega'}
+_GREEK_TABLE = str.maketrans({**GREEK_LETTERS,
+                              **{k.upper(): v for k, v in GREEK_LETTERS.items() if k != 'ς'}})
+
+# Identifier columns with a numeric local part -> (prefix, zero-padded width). Model map and MetaboAnalyst columns
+# share the same formats, so both sides of a join compact to the same integers.
+ID_FORMATS = {'CHEBI': ('', 0), 'HMDB': ('HMDB', 7), 'KEGG': ('C', 5), 'PUBCHEM': ('', 0),
+              'chebi_id': ('', 0), 'hmdb_id': ('HMDB', 7), 'kegg_id': ('C', 5), 'pubchem_id': ('', 0),
+              'metlin_id': ('', 0)}
+
+# Placeholders that stand for a missing identifier
+MISSING_ID_TEXT = ['', '-', 'nan', 'NaN', 'None', '<NA>']
+
+_UINT32_MAX = 2 ** 32 - 1
+
+
 def convert_to_string(df, col):
-    df[col] = df[col].fillna(-1)
-    df[col] = df[col].astype(int)
-    df[col] = df[col].astype(str)
-    df[col] = df[col].replace('-1', np.nan)
+    """
+    convert_to_string turns a numeric identifier column into strings of integers ('15422.0' -> '15422'), leaving
+    missing values as NaN. The column is converted in a single pass.
+    """
+    values = pd.to_numeric(df[col], errors='coerce')
+    present = values.notna().values
+    out = np.full(len(values), np.nan, dtype=object)
+    out[present] = values[present].astype(np.int64).astype(str).values
+    df[col] = out
     return df
 
-def sep_object(df, col, regex):
-    s = df[col].str.split(regex).apply(pd.Series, 1).stack()
-    s.index = s.index.droplevel(-1)
-    s.name = col
-    del df[col]
-    s = pd.DataFrame(s)
-    df = pd.merge(df, s, how='inner', left_index=True, right_index=True)
-    df = df.drop_duplicates(keep='first')
-    return df
+
+def parse_ids(values, prefix='', warn=False):
+    """
+    parse_ids extracts the numeric local part of identifiers, e.g. 'HMDB0000122' -> 122 with prefix 'HMDB'.
+
+    :param values: A Series or list of identifiers (strings or numbers)
+    :param prefix: A string denoting the namespace prefix in front of the digits
+    :param warn:   A boolean flag to warn about (and count as 'unparsed_ids', see instrument.COUNTERS) identifiers
+                   that are present but do not match, for callers that treat them as missing
+    :return:       A nullable Int64 Series; values that are missing or do not match are <NA>
+    """
+    values = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.astype('Int64')
+    text = values.astype(object).where(values.notna(), '').astype(str).str.strip()
+    digits = text.str.extract('^%s(\\d+)(?:\\.0)?$' % re.escape(prefix), expand=False)
+    parsed = pd.to_numeric(digits, errors='coerce').astype('Int64')
+    if warn:
+        dropped = parsed.isna() & ~text.isin(MISSING_ID_TEXT)
+        if dropped.any():
+            count(unparsed_ids=int(dropped.sum()))
+            warnings.warn('%d identifiers do not have the form %s<digits> and are treated as missing, e.g. %r'
+                          % (dropped.sum(), prefix, text[dropped].iloc[0]), stacklevel=2)
+    return parsed
+
+
+def compact_ids(values, prefix='', width=0):
+    """
+    compact_ids stores an identifier column compactly: as a nullable uint32 array of local numbers when every
+    identifier is `prefix` followed by digits, or as a categorical otherwise. Missing placeholders become <NA>.
+
+    :param values: A Series or list of identifiers
+    :param prefix: A string denoting the namespace prefix (restored by expand_ids)
+    :param width:  An integer denoting the zero-padded width of the digits (restored by expand_ids)
+    :return:       A UInt32 or categorical Series
+    """
+    values = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    missing = values.isna() | values.astype(str).isin(MISSING_ID_TEXT)
+    parsed = parse_ids(values, prefix)
+    found = parsed.notna()
+    if (found | missing).all() and (not found.any() or parsed.max() <= _UINT32_MAX):
+        return parsed.astype('UInt32')
+    return values.where(~missing).astype('category')
+
+
+def expand_ids(values, prefix='', width=0):
+    """
+    expand_ids is the inverse of compact_ids: integer identifiers are turned back into prefixed, zero-padded strings
+    and categoricals back into plain objects.
+    """
+    if pd.api.types.is_integer_dtype(values.dtype):
+        present = values.notna().values
+        out = np.full(len(values), np.nan, dtype=object)
+        out[present] = (prefix + values[present].astype(np.int64).astype(str).str.zfill(width)).values
+        return pd.Series(out, index=values.index, name=values.name)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    return values
+
+
+def compact_frame(df, formats=None):
+    """
+    compact_frame returns a copy of a mapping table with identifier columns (see ID_FORMATS) compacted with
+    compact_ids and the other text columns stored as categoricals. The formats of the integer columns are kept in
+    `df.attrs['id_formats']` so expand_frame can turn them back into strings (in the canonical format, e.g. zero-padded
+    to the width of ID_FORMATS).
+
+    :param df:      A Pandas dataframe
+    :param formats: An optional dictionary of column -> (prefix, width) used instead of ID_FORMATS
+    :return:        A Pandas dataframe
+    """
+    formats = ID_FORMATS if formats is None else formats
+    out = pd.DataFrame(index=df.index)
+    kept = {}
+    for col in df.columns:
+        if col in formats:
+            out[col] = compact_ids(df[col], *formats[col])
+            if pd.api.types.is_integer_dtype(out[col].dtype):
+                kept[col] = formats[col]
+        elif df[col].dtype == object:
+            out[col] = df[col].astype('category')
+        else:
+            out[col] = df[col]
+    out.attrs['id_formats'] = kept
+    return out
+
+
+def expand_frame(df):
+    """
+    expand_frame returns a copy of a dataframe with compacted identifier columns turned back into strings, e.g. before
+    it is written to a .csv or Excel file.
+    """
+    formats = dict(ID_FORMATS, **df.attrs.get('id_formats', {}))
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_integer_dtype(out[col].dtype) and col in formats:
+            out[col] = expand_ids(out[col], *formats[col])
+        elif isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype(object)
+    return out
+
+
+def sep_object(df, col, regex, chunksize=None):
+    """
+    sep_object splits the strings in one column on a separator and gives each piece its own row, keeping the other
+    columns. Rows whose value is missing are dropped, as are duplicate rows.
+
+    Earlier versions joined the pieces back onto the frame by index label. Each row is now split on its own, so two
+    differences show up: rows sharing an index label are no longer paired with each other's pieces, and rows keep the
+    order of `df` instead of the order of the index merge (sorted by label before pandas 2.2).
+
+    :param df:        A Pandas dataframe
+    :param col:       A string denoting the column to split
+    :param regex:     A string denoting the separator (a regular expression when longer than one character)
+    :param chunksize: An optional integer denoting the number of input rows split at a time, to bound the size of
+                      the intermediate arrays
+    :return:          A Pandas dataframe with `col` as the last column and the index of the row each piece came from
+    """
+    if chunksize is None:
+        return _explode_column(df, col, regex).drop_duplicates(keep='first')
+    chunks = (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+    return pd.concat(list(iter_sep_object(chunks, col, regex)) or [_explode_column(df.iloc[:0], col, regex)])
+
+
+def iter_sep_object(chunks, col, regex):
+    """
+    iter_sep_object is the streaming form of sep_object for tables larger than memory, e.g.
+    iter_sep_object(pd.read_csv(path, chunksize=100000), 'synonyms', ','). Duplicates are removed across chunks by
+    remembering a 64-bit hash of every row written so far. Rows keep the order of the stream.
+
+    :param chunks: An iterable of Pandas dataframes
+    :param col:    A string denoting the column to split
+    :param regex:  A string denoting the separator (a regular expression when longer than one character)
+    :return:       A generator of split dataframes
+    """
+    seen = set()
+    for chunk in chunks:
+        out = _explode_column(chunk, col, regex)
+        hashes = pd.util.hash_pandas_object(out, index=False).values
+        fresh = ~pd.Series(hashes).duplicated().values
+        fresh &= np.fromiter((h not in seen for h in hashes), dtype=bool, count=len(hashes))
+        seen.update(hashes[fresh].tolist())
+        yield out[fresh]
+
+
+def _explode_column(df, col, regex):
+    pieces = df[col].str.split(regex).reset_index(drop=True).explode()
+    pieces = pieces[pieces.notna()]
+    out = df.drop(col, axis=1).iloc[pieces.index.values]
+    out[col] = pieces.values
+    return out
+
+
+@lru_cache(maxsize=2 ** 18)
+def normalize_name(name, fold_unicode=False):
+    """
+    normalize_name returns the canonical form of one metabolite name: brackets, quotes and periods removed, whitespace
+    collapsed and case folded. With fold_unicode, Greek letters are spelled out (α -> alpha) and accents are dropped.
+    Results are memoized because synonym tables repeat the same names many times.
+    """
+    name = name.translate(_NAME_JUNK_TABLE)
+    if fold_unicode:
+        name = unicodedata.normalize('NFKD', name).translate(_GREEK_TABLE)
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.split()).casefold()
+
+
+def normalize_names(values, fold_unicode=False):
+    """
+    normalize_names applies normalize_name to a Series, Index or list of names. Each distinct name is normalized once
+    and the results are broadcast back, so heavily duplicated columns cost one pass over their unique values.
+    Missing values stay missing.
+    """
+    if not isinstance(values, (pd.Series, pd.Index)):
+        values = pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(values)
+    normalized = np.array([normalize_name(str(u), fold_unicode) for u in uniques] + [np.nan], dtype=object)
+    normalized = normalized[codes]
+    if isinstance(values, pd.Index):
+        return pd.Index(normalized, name=values.name)
+    return pd.Series(normalized, index=values.index, name=values.name)
+
+
+def append_csv(df, path, **kwargs):
+    """
+    append_csv appends a dataframe to a .csv file, writing the header only when the file does not exist yet.
+    """
+    path = os.path.expanduser(path)
+    df.to_csv(path, mode='a', header=not os.path.exists(path), **kwargs)
@@ -0,0 +1,305 @@
+"""
+genedb.py is a local gene identifier database for machines without outbound network access. It is built from the NCBI
+gene_info and gene2ensembl dumps, the HGNC complete set and UniProt idmapping files, and stored in SQLite as one
+(taxid, gene, field, value) table with two covering indexes: identifier -> Entrez gene for matching queries, and
+Entrez gene -> identifiers for returning fields. Lookups return the same dataframe shape as
+MyGeneInfo.querymany(..., as_dataframe=True), with field names following mygene.info ('symbol', 'ensembl.gene',
+'refseq.rna', 'HGNC', 'MIM', ...).
+
+Dumps:
+  * https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene_info.gz (or a per-organism file such as Homo_sapiens.gene_info.gz)
+  * https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2ensembl.gz
+  * https://ftp.ebi.ac.uk/pub/databases/genenames/hgnc/tsv/hgnc_complete_set.txt
+  * https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/by_organism/
+    HUMAN_9606_idmapping.dat.gz
+
+@author: Scott Campit
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+DEFAULT_PATH = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                            'genes.sqlite')
+
+# mygene.info species names -> NCBI taxonomy IDs
+TAXIDS = {'human': 9606, 'mouse': 10090, 'rat': 10116, 'fruitfly': 7227, 'nematode': 6239, 'zebrafish': 7955,
+          'thale-cress': 3702, 'frog': 8364, 'pig': 9823}
+
+# gene_info dbXrefs prefix -> field
+GENE_INFO_XREFS = {'MIM': 'MIM', 'HGNC': 'HGNC', 'Ensembl': 'ensembl.gene'}
+
+# gene2ensembl column -> field
+GENE2ENSEMBL_COLUMNS = {'Ensembl_gene_identifier': 'ensembl.gene',
+                        'RNA_nucleotide_accession.version': 'refseq.rna',
+                        'Ensembl_rna_identifier': 'ensembl.transcript',
+                        'protein_accession.version': 'refseq.protein',
+                        'Ensembl_protein_identifier': 'ensembl.protein'}
+
+# HGNC column -> field; multi-valued columns are '|' separated
+HGNC_COLUMNS = {'hgnc_id': 'HGNC', 'symbol': 'symbol', 'ensembl_gene_id': 'ensembl.gene', 'uniprot_ids': 'uniprot',
+                'alias_symbol': 'alias', 'prev_symbol': 'alias', 'omim_id': 'MIM', 'enzyme_id': 'ec'}
+
+# UniProt idmapping type -> field
+UNIPROT_TYPES = {'KEGG': 'kegg', 'PDB': 'pdb', 'Reactome': 'reactome'}
+
+_INSERT_BATCH = 100000
+_CHUNKSIZE = 500000
+
+
+def taxonomyId(species):
+    """
+    taxonomyId turns a mygene.info species name (or a taxonomy ID) into an NCBI taxonomy ID.
+    """
+    if isinstance(species, int):
+        return species
+    species = str(species)
+    return int(species) if species.isdigit() else TAXIDS[species]
+
+
+def _asList(value):
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value)
+
+
+def _missing(value):
+    return not isinstance(value, str) or value in ('', '-')
+
+
+class GeneDatabase:
+    """
+    GeneDatabase holds gene identifiers on disk and answers querymany-style bulk lookups without the network.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param path: A string denoting the path of the SQLite database file
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ids ('
+                           'taxid INTEGER, gene INTEGER, field TEXT, value TEXT, key TEXT, '
+                           'PRIMARY KEY (taxid, field, key, gene, value)) WITHOUT ROWID')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ids_gene ON ids (gene, field, value)')
+
+    def add(self, rows):
+        """
+        add inserts (taxid, gene, field, value) rows, committing in large batches.
+
+        :param rows: An iterable of (taxid, Entrez gene ID, field, identifier) tuples
+        :return:     The number of rows read
+        """
+        batch, count = [], 0
+        for taxid, gene, field, value in rows:
+            count += 1
+            batch.append((int(taxid), int(gene), field, value, value.casefold()))
+            if len(batch) >= _INSERT_BATCH:
+                self._flush(batch)
+                batch = []
+        self._flush(batch)
+        return count
+
+    def _flush(self, batch):
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO ids VALUES (?, ?, ?, ?, ?)', batch)
+
+    def _chunks(self, path, usecols, species=None, taxidColumn='#tax_id'):
+        for chunk in pd.read_csv(path, sep='\t', dtype=str, usecols=usecols, chunksize=_CHUNKSIZE):
+            if species is not None:
+                chunk = chunk[chunk[taxidColumn] == str(taxonomyId(species))]
+            yield chunk
+
+    def addGeneInfo(self, path, species=None):
+        """
+        addGeneInfo loads an NCBI gene_info file: Entrez ID, symbol, aliases, name, gene type and the MIM, HGNC and
+        Ensembl cross references.
+
+        :param path:    A string denoting the path of the (optionally gzipped) gene_info file
+        :param species: An optional species name or taxonomy ID to keep (all species by default)
+        """
+        def rows(chunk):
+            for taxid, gene, symbol, synonyms, xrefs, name, kind in zip(
+                    chunk['#tax_id'], chunk['GeneID'], chunk['Symbol'], chunk['Synonyms'], chunk['dbXrefs'],
+                    chunk['description'], chunk['type_of_gene']):
+                yield taxid, gene, 'entrezgene', gene
+                for field, value in (('symbol', symbol), ('name', name), ('type_of_gene', kind)):
+                    if not _missing(value):
+                        yield taxid, gene, field, value
+                if not _missing(synonyms):
+                    for alias in synonyms.split('|'):
+                        yield taxid, gene, 'alias', alias
+                if not _missing(xrefs):
+                    for xref in xrefs.split('|'):
+                        db, _, value = xref.partition(':')
+                        if db in GENE_INFO_XREFS:
+                            # HGNC cross references repeat the prefix ('HGNC:HGNC:5')
+                            yield taxid, gene, GENE_INFO_XREFS[db], value.replace('HGNC:', '')
+
+        usecols = ['#tax_id', 'GeneID', 'Symbol', 'Synonyms', 'dbXrefs', 'description', 'type_of_gene']
+        return sum(self.add(rows(chunk)) for chunk in self._chunks(path, usecols, species))
+
+    def addGene2Ensembl(self, path, species=None):
+        """
+        addGene2Ensembl loads the NCBI gene2ensembl file: Ensembl gene, transcript and protein IDs and RefSeq RNA and
+        protein accessions.
+        """
+        def rows(chunk):
+            for column, field in GENE2ENSEMBL_COLUMNS.items():
+                for taxid, gene, value in zip(chunk['#tax_id'], chunk['GeneID'], chunk[column]):
+                    if not _missing(value):
+                        yield taxid, gene, field, value
+
+        usecols = ['#tax_id', 'GeneID'] + list(GENE2ENSEMBL_COLUMNS)
+        return sum(self.add(rows(chunk)) for chunk in self._chunks(path, usecols, species))
+
+    def addHgnc(self, path):
+        """
+        addHgnc loads the HGNC complete set (human only): HGNC IDs, approved and previous symbols, Ensembl genes,
+        UniProt accessions, MIM numbers and EC numbers of every gene with an Entrez ID.
+        """
+        def rows(chunk):
+            chunk = chunk[chunk['entrez_id'].notna()]
+            for column, field in HGNC_COLUMNS.items():
+                for gene, values in zip(chunk['entrez_id'], chunk[column]):
+                    if not _missing(values):
+                        for value in values.split('|'):
+                            yield TAXIDS['human'], gene, field, value.replace('HGNC:', '')
+
+        return sum(self.add(rows(chunk)) for chunk in self._chunks(path, ['entrez_id'] + list(HGNC_COLUMNS)))
+
+    def addUniProtIdMapping(self, path, species='human'):
+        """
+        addUniProtIdMapping loads a UniProt idmapping .dat file ('accession<TAB>type<TAB>value'): UniProt
+        accessions, KEGG gene IDs, PDB structures and Reactome pathways, attached to genes through the GeneID rows.
+
+        :param path:    A string denoting the path of the (optionally gzipped) idmapping file
+        :param species: A species name or taxonomy ID; the by-organism files cover a single species
+        """
+        taxid = taxonomyId(species)
+        geneIds, xrefs = [], []
+        for chunk in pd.read_csv(path, sep='\t', header=None, names=['accession', 'type', 'value'], dtype=str,
+                                 chunksize=_CHUNKSIZE):
+            geneIds.append(chunk[chunk['type'] == 'GeneID'])
+            xrefs.append(chunk[chunk['type'].isin(list(UNIPROT_TYPES))])
+        genes = pd.concat(geneIds)[['accession', 'value']].rename(columns={'value': 'gene'})
+        xrefs = pd.merge(genes, pd.concat(xrefs), on='accession')
+
+        count = self.add((taxid, gene, 'uniprot', accession)
+                         for accession, gene in zip(genes['accession'], genes['gene']))
+        return count + self.add((taxid, gene, UNIPROT_TYPES[kind], value)
+                                for gene, kind, value in zip(xrefs['gene'], xrefs['type'], xrefs['value']))
+
+    def querymany(self, ids, scopes='symbol', fields='symbol', species='human'):
+        """
+        querymany looks up a list of identifiers, like MyGeneInfo.querymany(..., as_dataframe=True). Identifiers are
+        matched case-insensitively; scopes and fields are field names and must match exactly. A field also selects its
+        sub-fields ('refseq' returns 'refseq.rna' and 'refseq.protein').
+        Fields with several values hold a list, as in mygene.info responses.
+
+        :param ids:     A list of identifiers
+        :param scopes:  A string (comma separated) or list denoting the fields the identifiers are matched against
+        :param fields:  A string (comma separated) or list denoting the fields to return
+        :param species: A species name or taxonomy ID
+        :return:        A Pandas dataframe indexed by query, with '_id' (Entrez ID), the requested fields and a
+                        'notfound' column for identifiers without a match
+        """
+        taxid = taxonomyId(species)
+        scopes, fields = _asList(scopes), _asList(fields)
+        queries = [str(i) for i in dict.fromkeys(ids)]
+
+        self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_keys (key TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._conn.execute('DELETE FROM query_keys')
+        self._conn.executemany('INSERT OR IGNORE INTO query_keys VALUES (?)', ((q.casefold(),) for q in queries))
+        matches = {}
+        for key, gene in self._conn.execute(
+                'SELECT DISTINCT q.key, i.gene FROM query_keys q JOIN ids i '
+                'ON i.taxid = ? AND i.field IN (%s) AND i.key = q.key' % ','.join('?' * len(scopes)),
+                [taxid] + scopes):
+            matches.setdefault(key, []).append(gene)
+
+        self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_genes (gene INTEGER PRIMARY KEY)')
+        self._conn.execute('DELETE FROM query_genes')
+        self._conn.executemany('INSERT OR IGNORE INTO query_genes VALUES (?)',
+                               ((g,) for genes in matches.values() for g in genes))
+        values = {}
+        # Field names are compared exactly (LIKE would ignore case and treat '_' as a wildcard)
+        selected = ' OR '.join(['i.field = ? OR substr(i.field, 1, ?) = ?'] * len(fields))
+        for gene, field, value in self._conn.execute(
+                'SELECT i.gene, i.field, i.value FROM query_genes g JOIN ids i ON i.gene = g.gene '
+                'AND (%s)' % selected, [p for f in fields for p in (f, len(f) + 1, f + '.')]):
+            values.setdefault(gene, {}).setdefault(field, []).append(value)
+
+        records = []
+        for query in queries:
+            genes = sorted(matches.get(query.casefold(), []))
+            if not genes:
+                records.append({'query': query, 'notfound': True})
+            for gene in genes:
+                record = {'query': query, '_id': str(gene)}
+                for field, found in values.get(gene, {}).items():
+                    record[field] = found[0] if len(found) == 1 else found
+                records.append(record)
+        # 'query' and '_id' are always there, also when no identifiers were passed in
+        df = pd.DataFrame(records)
+        return df.reindex(columns=list(dict.fromkeys(['query', '_id'] + list(df.columns)))).set_index('query')
+
+    def empty(self):
+        """
+        empty reports whether the database holds no identifiers yet.
+        """
+        return self._conn.execute('SELECT 1 FROM ids LIMIT 1').fetchone() is None
+
+    def close(self):
+        self._conn.close()
+
+
+def resolveGeneDatabase(geneDb):
+    """
+    resolveGeneDatabase turns the `geneDb` argument of the identifier-mapper functions into a GeneDatabase. A database
+    file that does not exist or holds no identifiers is an error, since every gene would come back unmapped.
+
+    :param geneDb: None or False for no database, True for the database at DEFAULT_PATH, a path, or a GeneDatabase
+    :return:       A GeneDatabase, or None
+    """
+    if geneDb is None or geneDb is False:
+        return None
+    if geneDb is True or isinstance(geneDb, str):
+        path = DEFAULT_PATH if geneDb is True else os.path.expanduser(geneDb)
+        if not os.path.exists(path):
+            raise FileNotFoundError('No gene database at %s; build one with gene-database (see genedb.py)' % path)
+        geneDb = GeneDatabase(path)
+        if geneDb.empty():
+            geneDb.close()
+            raise ValueError('The gene database at %s holds no identifiers; load the dumps with gene-database '
+                             '(see genedb.py)' % path)
+    return geneDb
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the local gene identifier database.')
+    parser.add_argument('--gene-info', help='NCBI gene_info file')
+    parser.add_argument('--gene2ensembl', help='NCBI gene2ensembl file')
+    parser.add_argument('--hgnc', help='HGNC complete set')
+    parser.add_argument('--uniprot', help='UniProt idmapping .dat file for --species')
+    parser.add_argument('--species', default='human', help='Species to keep from the NCBI files')
+    parser.add_argument('--db', default=DEFAULT_PATH, help='SQLite database to add to')
+    args = parser.parse_args()
+
+    db = GeneDatabase(args.db)
+    if args.gene_info:
+        print('Loaded %d identifiers from %s' % (db.addGeneInfo(args.gene_info, args.species), args.gene_info))
+    if args.gene2ensembl:
+        print('Loaded %d identifiers from %s' % (db.addGene2Ensembl(args.gene2ensembl, args.species),
+                                                 args.gene2ensembl))
+    if args.hgnc:
+        print('Loaded %d identifiers from %s' % (db.addHgnc(args.hgnc), args.hgnc))
+    if args.uniprot:
+        print('Loaded %d identifiers from %s' % (db.addUniProtIdMapping(args.uniprot, args.species), args.uniprot))
+    db.close()
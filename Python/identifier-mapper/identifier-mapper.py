@@ -3,64 +3,170 @@ identifier_mapping gets several different ids using the mygene API.
 @author: Scott Campit
 """
 
-import mygene
-import cobra
-import pathlib
-import pandas as pd
+import os
+import sys
 
-def getMapfromCOBRAGenes(modelFilePath, inputType='BiGG', outputType='All', Species='human'):
+# Shared helpers (response cache, ...) live in Python/Misc
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Misc'))
+from instrument import timed
+
+
+# Fields returned for model genes when outputType is 'All'
+MODEL_FIELDS = ['accession.genomic', 'ec',
+                'ensembl.gene', 'entrezgene',
+                'ensembl.transcript',
+                'kegg', 'reactome',
+                'pdb', 'refseq',
+                'reporter', 'symbol',
+                'uniprot']
+
+
+@timed()
+def queryMyGene(idList, scopes, fields, species, cache=True, df_index=True, bulk=False, chunkSize=1000, maxWorkers=4,
+                rate=5, geneDb=None, baseUrl=None):
     """
+    queryMyGene wraps MyGeneInfo.querymany with the shared response cache. Only identifiers that are not cached are
+    sent to mygene.info, and the result has the same shape as querymany(..., as_dataframe=True). In bulk mode the
+    identifiers are posted in concurrent, rate-limited chunks, each cached as soon as it finishes, so rerunning an
+    interrupted mapping only sends the unfinished chunks.
 
-    :param model:
-    :param idType:
-    :return:
+    :param idList:   A list of gene identifiers
+    :param scopes:   A string or list denoting the MyGene fields the identifiers are matched against
+    :param fields:   A string or list denoting the MyGene fields to return
+    :param species:  A string denoting the species
+    :param cache:    True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param df_index: A boolean flag to index the dataframe by query, as querymany does
+    :param bulk:     A boolean flag to use the concurrent, chunked MyGeneClient instead of querymany
+    :param chunkSize:  An integer denoting the number of identifiers per request (bulk mode only)
+    :param maxWorkers: An integer denoting the number of requests in flight at once (bulk mode only)
+    :param rate:     An integer denoting the number of requests per second (bulk mode only)
+    :param geneDb:   An optional local gene database (True, a path or a GeneDatabase) that answers the query
+                     offline instead of mygene.info
+    :param baseUrl:  An optional string denoting the mygene.info API root, e.g. of a local stand-in (see standin.py)
+    :return:         A Pandas dataframe with one row per hit
     """
-    # Read in COBRA model
-    if pathlib.Path(modelFilePath).suffix is '.mat':
-        model = cobra.io.load_matlab_model(modelFilePath)
-    elif pathlib.Path(modelFilePath).suffix is '.sbml' or '.xml':
-        model = cobra.io.read_sbml_model(modelFilePath)
-    else:
-        model = cobra.io.load_json_model(modelFilePath)
+    from genedb import resolveGeneDatabase
+
+    geneDb = resolveGeneDatabase(geneDb)
+    if geneDb is not None:
+        df = geneDb.querymany(idList, scopes=scopes, fields=fields, species=species)
+        return df if df_index else df.reset_index()
+
+    from cache import normalizeQuery, resolveCache
+    from mygeneclient import MYGENE, MyGeneClient, cacheNamespace
+    try:
+        from pandas import json_normalize
+    except ImportError:
+        from pandas.io.json import json_normalize
+
+    cache = resolveCache(cache)
+    namespace = cacheNamespace(scopes, fields, species)
+    idList = [str(i) for i in dict.fromkeys(idList)]
+    hits = {}
+    if cache is not None:
+        hits = cache.getMany('mygene', namespace, idList)
+    missing = [i for i in idList if normalizeQuery(i) not in hits]
 
-    # Get gene identifiers from COBRA model
-    geneNames = []
-    for gene in model.genes:
-        geneNames.append(gene.id)
+    if missing and bulk is True:
+        client = MyGeneClient(baseUrl=baseUrl or MYGENE, chunkSize=chunkSize, maxWorkers=maxWorkers, rate=rate,
+                              cache=cache)
+        fresh = client.queryMany(missing, scopes=scopes, fields=fields, species=species)
+        hits.update((normalizeQuery(q), h) for q, h in fresh.items())
+        for chunk, err in client.failed:
+            print("MyGene chunk of %d identifiers failed after retries (%s)" % (len(chunk), err))
+    elif missing:
+        import mygene
 
+        mg = mygene.MyGeneInfo(url=baseUrl or MYGENE)
+        fresh = {}
+        for hit in mg.querymany(missing, scopes=scopes, fields=fields, species=species,
+                                as_dataframe=False, returnall=False):
+            fresh.setdefault(hit['query'], []).append(hit)
+        if cache is not None:
+            cache.setMany('mygene', namespace, fresh)
+        hits.update((normalizeQuery(q), h) for q, h in fresh.items())
+
+    out = [hit for i in idList for hit in hits.get(normalizeQuery(i), [])]
+    df = json_normalize(out)
+    if df_index and 'query' in df:
+        df = df.set_index('query')
+    return df
+
+
+def collapseGeneIds(geneNames, inputType):
+    """
+    collapseGeneIds strips isoform suffixes ('1234.1' for Entrez IDs, '1234_AT1' for BiGG IDs) and drops the
+    duplicates this creates, keeping the first-seen order.
+
+    :param geneNames: A list of gene identifiers from a metabolic model
+    :param inputType: A string denoting the identifier type ('entrezgene' or 'BiGG')
+    :return:          A tuple of (unique identifiers, MyGene scope to query them with)
+    """
     # BiGG uses a combination of Entrez and Ensemble to denote isozymes. Get the real Entrez ID
-    if inputType is 'entrezgene':
+    if inputType == 'entrezgene':
         geneNames = [x.split('.')[0] for x in geneNames]
-    elif inputType is 'BiGG':
+    elif inputType == 'BiGG':
         geneNames = [x.split('_')[0] for x in geneNames]
         inputType = 'entrezgene'
+    return list(dict.fromkeys(geneNames)), inputType
+
+
+@timed()
+def getMapfromCOBRAGenes(modelFilePath, inputType='BiGG', outputType='All', Species='human', cache=True,
+                         modelCache=True, bulk=False, geneDb=None, baseUrl=None):
+    """
+
+    :param model:
+    :param idType:
+    :param cache:      True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param modelCache: A boolean flag to take the gene list from the compiled model cache when the model is already
+                       in it; a model is never compiled just for its genes
+    :param bulk:       A boolean flag to query MyGene in concurrent, resumable chunks
+    :param geneDb:     An optional local gene database (True, a path or a GeneDatabase) used instead of MyGene
+    :param baseUrl:    An optional string denoting the mygene.info API root, e.g. of a local stand-in
+    :return:
+    """
+    compiled = None
+    if modelCache is True:
+        from modelcache import loadCompiledModel
+        compiled = loadCompiledModel(modelFilePath, build=False)
+    if compiled is not None:
+        geneNames = compiled.geneIds
+    else:
+        # Read the gene IDs straight from the model file, without building a cobra model
+        from geneids import readGeneIds
+        geneNames = readGeneIds(modelFilePath)
+
+    geneCount = len(geneNames)
+    geneNames, inputType = collapseGeneIds(geneNames, inputType)
+    print("%d model genes collapse to %d unique identifiers" % (geneCount, len(geneNames)))
 
     # If not specified, return everything
-    if outputType is 'All':
-        outputType=['accession.genomic', 'ec',
-                    'ensembl.gene', 'entrezgene',
-                    'ensembl.transcript',
-                    'kegg', 'reactome',
-                    'pdb', 'refseq',
-                    'reporter', 'symbol',
-                    'uniprot']
+    if outputType == 'All':
+        outputType = MODEL_FIELDS
 
     # Use MyGene API to query identifiers as Pandas dataframe
-    mg = mygene.MyGeneInfo()
-    return mg.querymany(geneNames, scopes=inputType,
-                        fields=outputType, species=Species,
-                        as_dataframe=True)
+    return queryMyGene(geneNames, scopes=inputType,
+                       fields=outputType, species=Species,
+                       cache=cache, bulk=bulk, geneDb=geneDb, baseUrl=baseUrl)
 
-def getMapFromList(idList, inputType='symbol', outputType='All', Species='human'):
+@timed()
+def getMapFromList(idList, inputType='symbol', outputType='All', Species='human', cache=True, bulk=False,
+                   geneDb=None, baseUrl=None):
     """
 
     :param model:
     :param idType:
+    :param cache:  True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param bulk:   A boolean flag to query MyGene in concurrent, resumable chunks
+    :param geneDb: An optional local gene database (True, a path or a GeneDatabase) used instead of MyGene, for
+                   machines without network access
+    :param baseUrl: An optional string denoting the mygene.info API root, e.g. of a local stand-in (see standin.py)
     :return:
     """
 
     # If not specified, return everything
-    if outputType is 'All':
+    if outputType == 'All':
         outputType=['entrezgene', 'kegg',
                     'ec', 'refseq',
                     'refseq.protein',
@@ -71,32 +177,78 @@ def getMapFromList(idList, inputType='symbol', outputType='All', Species='human'
                     'reactome']
 
     # Use MyGene API to query identifiers as Pandas dataframe
-    mg = mygene.MyGeneInfo()
-    return mg.querymany(idList, scopes=inputType,
-                        fields=outputType, species=Species,
-                        as_dataframe=True, df_index=True,
-                        returnall=False)
+    return queryMyGene(idList, scopes=inputType,
+                       fields=outputType, species=Species,
+                       cache=cache, df_index=True, bulk=bulk, geneDb=geneDb, baseUrl=baseUrl)
 
-if __name__ == "__main__":
 
-    ## Get identifiers from metabolic model
-    # Read in RECON1 from BiGG database
-    #if sys.argv[1] is None:
-    #    modelFilePath="/home/scampit/Data/CBM/MetabolicModels/RECON1/RECON1.xml"
-    #else:
-    #    modelFilePath=sys.argv[1]
-    #df = getMapfromGenes(modelFilePath, inputType='BiGG', outputType=['symbol', 'ensembl.gene'])
-
-    # Save everything to default genemap.csv in current working directory
-    #if sys.argv[2] is None:
-    #    df.to_csv('genemap.csv')
-    #else:
-    #    df.to_csv(sys.argv[2])
-
-    ## Get identifiers from list of gene symbols
-    fileName="~/Data/Mappings/MetabolicModelMaps/metabolic_map.xlsx"
-    df = pd.read_excel(fileName, sheet_name='Genes')
-    genelist = list(df['Gene symbol'])
-    query = getMapFromList(genelist)
-    print(query)
-    query.to_csv('histoneMap.csv')
+@timed()
+def getMapsFromModelDirectory(modelDir, inputType='BiGG', outputType='All', Species='human', cache=True,
+                              geneDb=None, baseUrl=None):
+    """
+    getMapsFromModelDirectory maps the genes of every metabolic model (.xml, .sbml, .mat or .json) in a directory. The
+    gene lists are pooled and deduplicated, so genes shared between models are queried once, in concurrent chunks.
+
+    :param modelDir: A string denoting the directory containing the metabolic models
+    :param cache:    True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param geneDb:   An optional local gene database (True, a path or a GeneDatabase) used instead of MyGene
+    :param baseUrl:  An optional string denoting the mygene.info API root, e.g. of a local stand-in
+    :return:         A dictionary mapping each model file name to its gene map
+    """
+    from geneids import readGeneIds
+
+    models = sorted(f for f in os.listdir(modelDir)
+                    if os.path.splitext(f)[1] in ('.xml', '.sbml', '.mat', '.json'))
+    geneIds = {f: collapseGeneIds(readGeneIds(os.path.join(modelDir, f)), inputType)[0] for f in models}
+
+    # One pooled bulk query, split back into per-model maps
+    allIds = list(dict.fromkeys(g for ids in geneIds.values() for g in ids))
+    print("%d models, %d unique gene identifiers" % (len(models), len(allIds)))
+    if outputType == 'All':
+        outputType = MODEL_FIELDS
+    df = queryMyGene(allIds, scopes=collapseGeneIds([], inputType)[1], fields=outputType, species=Species,
+                     cache=cache, bulk=True, geneDb=geneDb, baseUrl=baseUrl)
+    return {f: df[df.index.isin(ids)] for f, ids in geneIds.items()}
+
+
+def writeGeneMap(source, outFile, sheet='Genes', column='Gene symbol', inputType=None, outputType='All',
+                 Species='human', cache=True, bulk=False, geneDb=None, baseUrl=None):
+    """
+    writeGeneMap maps the genes of a metabolic model, of every model in a directory, or of a column of an Excel sheet
+    and writes the maps to .csv files. This is what the identifier-mapper command runs.
+
+    :param source:     A string denoting a metabolic model, a directory of models, or an Excel workbook
+    :param outFile:    A string denoting the .csv file to write (a directory of <model>.csv files for a model directory)
+    :param sheet:      A string denoting the tab holding the gene list (workbooks only)
+    :param column:     A string denoting the column holding the gene list (workbooks only)
+    :param inputType:  A string denoting the identifier type (default: 'BiGG' for models, 'symbol' for gene lists)
+    :return:           A list of the files written
+    """
+    source = os.path.expanduser(source)
+    if os.path.isdir(source):
+        os.makedirs(outFile, exist_ok=True)
+        written = []
+        for model, df in getMapsFromModelDirectory(source, inputType=inputType or 'BiGG', outputType=outputType,
+                                                   Species=Species, cache=cache, geneDb=geneDb,
+                                                   baseUrl=baseUrl).items():
+            written.append(os.path.join(outFile, os.path.splitext(model)[0] + '.csv'))
+            df.to_csv(written[-1])
+        return written
+
+    if os.path.splitext(source)[1] in ('.xml', '.sbml', '.mat', '.json'):
+        df = getMapfromCOBRAGenes(source, inputType=inputType or 'BiGG', outputType=outputType, Species=Species,
+                                  cache=cache, bulk=bulk, geneDb=geneDb, baseUrl=baseUrl)
+    else:
+        from sheetcache import readSheet
+        genelist = list(readSheet(source, sheet, columns=[column])[column])
+        df = getMapFromList(genelist, inputType=inputType or 'symbol', outputType=outputType, Species=Species,
+                            cache=cache, bulk=bulk, geneDb=geneDb, baseUrl=baseUrl)
+    df.to_csv(outFile)
+    return [outFile]
+
+
+if __name__ == "__main__":
+    # The command line lives in idmapping.cli, which parses arguments before anything heavy is imported
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from idmapping.cli import identifierMapper
+    identifierMapper(module=sys.modules[__name__])
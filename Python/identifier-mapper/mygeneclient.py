@@ -0,0 +1,109 @@
+"""
+mygeneclient.py is a bulk client for the mygene.info query API. Gene lists are split into chunks that are posted
+concurrently under a rate limit, with retries for transient failures. Every finished chunk is written to the response
+cache straight away, so an interrupted mapping resumes with only the chunks that had not finished.
+
+@author: Scott Campit
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from instrument import count
+from remote import RateLimiter, TransientError, makeSession, requestWithRetry
+
+# MYGENE_URL points the client elsewhere, e.g. at a local stand-in (see standin.py)
+MYGENE = os.environ.get('MYGENE_URL', 'https://mygene.info/v3')
+
+# mygene.info accepts up to 1000 identifiers per POST
+MAX_CHUNK = 1000
+
+
+def cacheNamespace(scopes, fields, species):
+    """
+    cacheNamespace returns the response cache namespace for a MyGene query.
+    """
+    return 'scopes=%s;fields=%s;species=%s' % (scopes, fields, species)
+
+
+def _joined(value):
+    return value if isinstance(value, str) else ','.join(value)
+
+
+class MyGeneClient:
+    """
+    MyGeneClient maps gene identifiers with mygene.info. Chunks that still fail after every retry are kept in
+    `failed` instead of aborting the whole run.
+    """
+
+    def __init__(self, baseUrl=MYGENE, chunkSize=MAX_CHUNK, maxWorkers=4, rate=5, retries=5, timeout=120,
+                 cache=None):
+        """
+        :param baseUrl:    A string denoting the mygene.info API root URL
+        :param chunkSize:  An integer denoting the number of identifiers posted per request (at most 1000)
+        :param maxWorkers: An integer denoting the number of chunks in flight at once
+        :param rate:       An integer denoting the number of requests allowed per second
+        :param retries:    An integer denoting the number of retries for transient failures
+        :param timeout:    A float denoting the per-request timeout in seconds
+        :param cache:      An optional ResponseCache finished chunks are written to
+        """
+        self.baseUrl = baseUrl.rstrip('/')
+        self.chunkSize = min(chunkSize, MAX_CHUNK)
+        self.maxWorkers = maxWorkers
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = RateLimiter(rate=rate, period=1.0)
+        self.session = makeSession(poolSize=maxWorkers)
+        self.failed = []
+
+    def queryChunk(self, ids, scopes, fields, species):
+        """
+        queryChunk posts one chunk of identifiers to the query endpoint.
+
+        :param ids:     A list of gene identifiers
+        :param scopes:  A string or list denoting the MyGene fields the identifiers are matched against
+        :param fields:  A string or list denoting the MyGene fields to return
+        :param species: A string denoting the species
+        :return:        A list of hit dictionaries, including {'query': ..., 'notfound': True} entries
+        """
+        response = requestWithRetry(self.session, 'POST', self.baseUrl + '/query',
+                                    limiter=self.limiter, retries=self.retries, timeout=self.timeout,
+                                    data={'q': ','.join(ids), 'scopes': _joined(scopes),
+                                          'fields': _joined(fields), 'species': species})
+        response.raise_for_status()
+        return response.json()
+
+    def _safeQueryChunk(self, ids, scopes, fields, species):
+        try:
+            return self.queryChunk(ids, scopes, fields, species)
+        except (TransientError, IOError, ValueError) as err:
+            self.failed.append((ids, str(err)))
+            count(failed_lookups=1)
+            return []
+
+    def queryMany(self, ids, scopes, fields, species):
+        """
+        queryMany maps a list of identifiers in concurrent chunks.
+
+        :param ids:     A list of unique gene identifiers
+        :param scopes:  A string or list denoting the MyGene fields the identifiers are matched against
+        :param fields:  A string or list denoting the MyGene fields to return
+        :param species: A string denoting the species
+        :return hits:   A dictionary mapping each answered identifier to its list of hits
+        """
+        namespace = cacheNamespace(scopes, fields, species)
+        chunks = [ids[i:i + self.chunkSize] for i in range(0, len(ids), self.chunkSize)]
+        hits = {}
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            futures = [pool.submit(self._safeQueryChunk, chunk, scopes, fields, species) for chunk in chunks]
+            for done, future in enumerate(as_completed(futures), 1):
+                fresh = {}
+                for hit in future.result():
+                    fresh.setdefault(hit['query'], []).append(hit)
+                # Checkpoint each chunk as soon as it finishes
+                if self.cache is not None:
+                    self.cache.setMany('mygene', namespace, fresh)
+                hits.update(fresh)
+                print('MyGene chunk %d/%d done' % (done, len(chunks)))
+        return hits
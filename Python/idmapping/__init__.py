@@ -0,0 +1,61 @@
+"""
+idmapping makes the metabolomics parser and the identifier mapper importable. Their directories and scripts have
+hyphenated names, so the package loads them under importable ones:
+
+    from idmapping import metabolomics_parser, identifier_mapper
+
+Installed, the script directories live inside the package (idmapping/Misc, idmapping/metabolomics and
+idmapping/genes, see pyproject.toml); in the source tree they are the package's siblings. Their modules import each
+other by flat name, so those directories are added to sys.path. Nothing heavy is imported here: pandas, cobra, lxml,
+pubchempy, mygene and openpyxl are loaded by the functions that use them.
+
+@author: Scott Campit
+"""
+
+import os
+import sys
+from importlib.machinery import SourceFileLoader
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Installed package name -> source tree name of each script directory
+DIRECTORIES = {'Misc': 'Misc', 'metabolomics': 'metabolomics-parser', 'genes': 'identifier-mapper'}
+
+
+def directory(name):
+    """
+    directory returns the path of a script directory, installed or in the source tree.
+
+    :param name: A string denoting a key of DIRECTORIES
+    :return:     The directory path
+    """
+    installed = os.path.join(_HERE, name)
+    if os.path.isdir(installed):
+        return installed
+    return os.path.normpath(os.path.join(_HERE, os.pardir, DIRECTORIES[name]))
+
+
+def addPaths():
+    """
+    addPaths appends the script directories to sys.path, so their flat imports (from cache import ...) resolve.
+    """
+    for name in DIRECTORIES:
+        path = directory(name)
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def loadScript(module, name, filename):
+    """
+    loadScript runs a hyphenated script as the body of `module`. Its functions get the module's importable name, so
+    they can be pickled for process pools.
+
+    :param module:   The module object to fill (sys.modules[__name__] of the wrapper module)
+    :param name:     A string denoting the key of DIRECTORIES holding the script
+    :param filename: A string denoting the script file name
+    """
+    addPaths()
+    path = os.path.join(directory(name), filename)
+    # The scripts locate Python/Misc relative to their own __file__
+    module.__file__ = path
+    SourceFileLoader(module.__name__, path).exec_module(module)
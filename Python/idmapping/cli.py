@@ -0,0 +1,176 @@
+"""
+cli.py holds the console entry points (see pyproject.toml). Arguments are parsed before anything heavy is imported,
+and a command whose outputs were already written from the same arguments, inputs and code exits right after that
+check (see pipeline.RunStamp), so `--help` and repeated invocations return in a few tens of milliseconds. A run in which
+a remote lookup still failed after every retry exits with status 1 and is not stamped, so repeating it retries them.
+
+@author: Scott Campit
+"""
+
+import argparse
+import hashlib
+import os
+import runpy
+
+from idmapping import DIRECTORIES, addPaths, directory
+
+CACHE_ROOT = os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities'))
+
+
+def _code():
+    # Every source file of the package is part of a run's key, so any code change reruns the command
+    return [os.path.dirname(os.path.abspath(__file__))] + [directory(name) for name in DIRECTORIES]
+
+
+def _addInstrumentArguments(parser):
+    parser.add_argument('--metrics', default=None, help='JSON-lines file per-stage metrics are appended to')
+    parser.add_argument('--profile', choices=['cprofile', 'sample'], default=None,
+                        help='Profile every stage (written next to the metrics file)')
+    parser.add_argument('--tracemalloc', action='store_true', help='Report the tracemalloc peak of every stage')
+
+
+def _configure(args):
+    addPaths()
+    from instrument import configure
+    configure(metrics=args.metrics, profile=args.profile, traceMemory=args.tracemalloc or None)
+
+
+def _failedLookups():
+    from instrument import total
+    return total('failed_lookups')
+
+
+def _finish(stamp, outputs, failedBefore):
+    # A run whose remote lookups partly failed is not stamped, so repeating the command retries them
+    failed = _failedLookups() - failedBefore
+    if failed:
+        raise SystemExit('%d remote lookups failed after every retry; %s may be incomplete. Run the same command '
+                         'again to retry them.' % (failed, ', '.join(outputs)))
+    if stamp is not None:
+        stamp.record(outputs)
+
+
+def metabolomicsParser(argv=None, module=None):
+    """
+    metabolomicsParser is the metabolomics-parser command (see metabolomics_parser.mapWorkbook).
+
+    :param argv:   A list of command line arguments (sys.argv[1:] by default)
+    :param module: The parser module to run (imported after the up-to-date check by default)
+    """
+    parser = argparse.ArgumentParser(description='Map metabolomics data onto a metabolic model, resuming from the '
+                                                 'last checkpoint of an earlier run.')
+    parser.add_argument('model', nargs='?',
+                        default=r'/home/scampit/Data/CBM/MetabolicModels/RECON1/RECON1.xml')
+    parser.add_argument('data', nargs='?',
+                        default=r'/home/scampit/Data/Expression/Metabolomics/ME1/raw/ME1_Metabolomics.xlsx')
+    parser.add_argument('sheet', nargs='?', default=None,
+                        help='Tab to map (default: every tab but the first, merged in parallel)')
+    parser.add_argument('--workdir', default='~/Data/Mappings/ME1/pipeline')
+    parser.add_argument('--synmatch', action='store_true', help='Expand names with PubChem synonyms')
+    parser.add_argument('--synonym-index', default=None, help='Offline synonym index (see synonyms.py)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Map and match the synonyms in bounded-memory buffers (with --synmatch)')
+    parser.add_argument('--buffer-size', type=int, default=10000, help='Synonym rows per buffer (with --stream)')
+    parser.add_argument('--force', nargs='*', default=None,
+                        help='Stages to rerun even if they are up to date (none: only skip the up-to-date check)')
+    _addInstrumentArguments(parser)
+    parser.add_argument('--output',
+                        default=r'/home/scampit/Data/Expression/Metabolomics/ME1/processed/ME1_mapped_metabolomics.xlsx')
+    args = parser.parse_args(argv)
+    _configure(args)
+
+    from pipeline import RunStamp
+    stamp = RunStamp(os.path.join(args.workdir, 'command.json'), 'metabolomics-parser',
+                     {'model': args.model, 'data': args.data, 'sheet': args.sheet, 'synmatch': args.synmatch,
+                      'synonymIndex': args.synonym_index, 'stream': args.stream, 'bufferSize': args.buffer_size},
+                     files=[args.model, args.data, args.synonym_index], code=_code())
+    if args.force is None and stamp.upToDate([args.output]):
+        print('%s is up to date' % args.output)
+        return
+
+    if module is None:
+        from idmapping import metabolomics_parser as module
+    failedBefore = _failedLookups()
+    module.mapWorkbook(args.model, args.data, args.output, sheet=args.sheet, workDir=args.workdir,
+                       synmatch=args.synmatch, synonymIndex=args.synonym_index, force=args.force or (),
+                       stream=args.stream, bufferSize=args.buffer_size)
+    _finish(stamp, [args.output], failedBefore)
+
+
+def identifierMapper(argv=None, module=None):
+    """
+    identifierMapper is the identifier-mapper command (see identifier_mapper.writeGeneMap).
+
+    :param argv:   A list of command line arguments (sys.argv[1:] by default)
+    :param module: The mapper module to run (imported after the up-to-date check by default)
+    """
+    parser = argparse.ArgumentParser(description='Map the gene identifiers of a metabolic model, a directory of '
+                                                 'models or a gene list in an Excel sheet with MyGene.info.')
+    parser.add_argument('source', nargs='?', default='~/Data/Mappings/MetabolicModelMaps/metabolic_map.xlsx',
+                        help='Metabolic model (.xml, .sbml, .mat or .json), directory of models, or Excel workbook')
+    parser.add_argument('output', nargs='?', default='histoneMap.csv',
+                        help='.csv file to write (a directory of .csv files for a directory of models)')
+    parser.add_argument('--sheet', default='Genes', help='Tab holding the gene list (workbooks only)')
+    parser.add_argument('--column', default='Gene symbol', help='Column holding the gene list (workbooks only)')
+    parser.add_argument('--input-type', default=None,
+                        help="Identifier type (default: 'BiGG' for models, 'symbol' for gene lists)")
+    parser.add_argument('--fields', nargs='+', default=None, help='MyGene fields to return (default: all)')
+    parser.add_argument('--species', default='human')
+    parser.add_argument('--bulk', action='store_true', help='Query MyGene in concurrent, resumable chunks')
+    parser.add_argument('--gene-db', default=None, help='Local gene database used instead of MyGene (see genedb.py)')
+    parser.add_argument('--base-url', default=None, help='mygene.info API root, e.g. of a local stand-in')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the shared response cache')
+    parser.add_argument('--force', action='store_true', help='Rerun even if the output is up to date')
+    _addInstrumentArguments(parser)
+    args = parser.parse_args(argv)
+    _configure(args)
+
+    from pipeline import RunStamp
+    source = os.path.expanduser(args.source)
+    stamp = None
+    if not os.path.isdir(source):
+        output = os.path.abspath(os.path.expanduser(args.output))
+        stamp = RunStamp(os.path.join(CACHE_ROOT, 'commands',
+                                      hashlib.sha256(output.encode('utf-8')).hexdigest()[:16] + '.json'),
+                         'identifier-mapper',
+                         {k: v for k, v in vars(args).items()
+                          if k not in ('force', 'metrics', 'profile', 'tracemalloc')},
+                         files=[source, args.gene_db], code=_code())
+        if not args.force and stamp.upToDate([args.output]):
+            print('%s is up to date' % args.output)
+            return
+
+    if module is None:
+        from idmapping import identifier_mapper as module
+    failedBefore = _failedLookups()
+    written = module.writeGeneMap(source, args.output, sheet=args.sheet, column=args.column,
+                                  inputType=args.input_type, outputType=args.fields or 'All', Species=args.species,
+                                  cache=not args.no_cache, bulk=args.bulk, geneDb=args.gene_db,
+                                  baseUrl=args.base_url)
+    _finish(stamp, written, failedBefore)
+
+
+def _runScript(name):
+    # Tools whose command line is their module's __main__ block
+    addPaths()
+    runpy.run_module(name, run_name='__main__', alter_sys=True)
+
+
+def synonymIndex():
+    """synonymIndex is the metabolite-synonyms command (see synonyms.py)."""
+    _runScript('synonyms')
+
+
+def geneDatabase():
+    """geneDatabase is the gene-database command (see genedb.py)."""
+    _runScript('genedb')
+
+
+def standIn():
+    """standIn is the service-standin command (see standin.py)."""
+    _runScript('standin')
+
+
+def stageMetrics():
+    """stageMetrics is the stage-metrics command (see instrument.py)."""
+    _runScript('instrument')
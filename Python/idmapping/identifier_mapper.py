@@ -0,0 +1,9 @@
+"""
+identifier_mapper is identifier-mapper/identifier-mapper.py under an importable name.
+"""
+
+import sys
+
+from idmapping import loadScript
+
+loadScript(sys.modules[__name__], 'genes', 'identifier-mapper.py')
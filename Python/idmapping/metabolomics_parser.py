@@ -0,0 +1,9 @@
+"""
+metabolomics_parser is metabolomics-parser/metabolomics-parser.py under an importable name.
+"""
+
+import sys
+
+from idmapping import loadScript
+
+loadScript(sys.modules[__name__], 'metabolomics', 'metabolomics-parser.py')
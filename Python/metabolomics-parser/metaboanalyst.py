@@ -0,0 +1,120 @@
+"""
+metaboanalyst.py is a bulk client for the MetaboAnalyst compound mapping API. Name lists are split into batches that
+are posted concurrently over a pooled session, with retries for transient failures.
+
+@author: Scott Campit
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import normalizeQuery
+from instrument import count
+from remote import TransientError, makeSession, requestWithRetry
+
+# METABOANALYST_URL points the client elsewhere, e.g. at a local stand-in (see standin.py)
+MAPCOMPOUNDS = os.environ.get('METABOANALYST_URL', 'http://api.xialab.ca/mapcompounds')
+
+# Identifier columns in the mapping response; '-' marks a missing identifier
+IDENTIFIER_COLUMNS = ['hmdb_id', 'kegg_id', 'pubchem_id', 'chebi_id', 'metlin_id']
+
+
+def parseMapping(response):
+    """
+    parseMapping turns a mapcompounds response into row dictionaries. The response body is column-oriented
+    ({"query": [...], "hmdb_id": [...], ...}). When ijson is installed the body is parsed incrementally from the socket
+    instead of being buffered and decoded in one piece.
+
+    :param response: A streamed requests Response
+    :return rows:    A list of dictionaries, one per mapped name
+    """
+    try:
+        import ijson
+    except ImportError:
+        columns = response.json()
+    else:
+        response.raw.decode_content = True
+        columns = dict(ijson.kvitems(response.raw, '', use_float=True))
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+class MetaboAnalystClient:
+    """
+    MetaboAnalystClient maps metabolite names to HMDB, KEGG, PubChem, ChEBI and METLIN identifiers. Batches that still
+    fail after every retry are kept in `failed` instead of aborting the whole run.
+    """
+
+    def __init__(self, url=MAPCOMPOUNDS, batchSize=500, maxWorkers=4, retries=5, timeout=120, cache=None):
+        """
+        :param url:        A string denoting the mapcompounds endpoint
+        :param batchSize:  An integer denoting the number of names posted per request
+        :param maxWorkers: An integer denoting the number of batches in flight at once
+        :param retries:    An integer denoting the number of retries for transient failures
+        :param timeout:    A float denoting the per-request timeout in seconds
+        :param cache:      An optional ResponseCache checked before going to the network
+        """
+        self.url = url
+        self.batchSize = batchSize
+        self.maxWorkers = maxWorkers
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.session = makeSession(poolSize=maxWorkers,
+                                   headers={'Content-Type': "application/json",
+                                            'cache-control': "no-cache"})
+        self.failed = []
+
+    def mapBatch(self, names):
+        """
+        mapBatch posts one batch of names to MetaboAnalyst.
+
+        :param names: A list of metabolite names
+        :return:      A list of row dictionaries
+        """
+        queryDict = {"queryList": ';'.join(names),
+                     "inputType": "name"}
+        response = requestWithRetry(self.session, 'POST', self.url, retries=self.retries,
+                                    data=json.dumps(queryDict), timeout=self.timeout, stream=True)
+        response.raise_for_status()
+        try:
+            return parseMapping(response)
+        finally:
+            response.close()
+
+    def _safeMapBatch(self, names):
+        try:
+            return self.mapBatch(names)
+        except (TransientError, IOError, ValueError) as err:
+            self.failed.append((names, str(err)))
+            count(failed_lookups=1)
+            return []
+
+    def mapNames(self, names):
+        """
+        mapNames maps every unique name, answering cached names locally and posting the rest in concurrent batches.
+        Each returned row carries the name as it was passed in, even if an equivalent spelling was the one posted.
+
+        :param names: An iterable of metabolite names
+        :return rows: A list of row dictionaries in the order of the first occurrence of each name
+        """
+        names = list(dict.fromkeys(names))
+        rows = {}
+        if self.cache is not None:
+            rows = self.cache.getMany('metaboanalyst', 'name', names)
+        # Names that only differ in case or spacing are posted once and fanned back out below
+        missing = {}
+        for n in names:
+            if normalizeQuery(n) not in rows:
+                missing.setdefault(normalizeQuery(n), n)
+        missing = list(missing.values())
+        batches = [missing[i:i + self.batchSize] for i in range(0, len(missing), self.batchSize)]
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for batch in pool.map(self._safeMapBatch, batches):
+                fresh = {row['query']: row for row in batch}
+                if self.cache is not None:
+                    self.cache.setMany('metaboanalyst', 'name', fresh)
+                rows.update((normalizeQuery(q), row) for q, row in fresh.items())
+
+        return [dict(rows[normalizeQuery(n)], query=n) for n in names if normalizeQuery(n) in rows]
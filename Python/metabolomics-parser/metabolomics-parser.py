@@ -13,54 +13,189 @@ import re
 import pandas as pd
 import numpy as np
 
+# Shared helpers (rate limiting, retries, ...) live in Python/Misc
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Misc'))
+from instrument import count, timed
+from utilities import ID_FORMATS, append_csv, compact_frame, compact_ids, expand_frame, normalize_names
 
-def queryPubChem(data):
+# identifiers.org annotation keys (see sbml.IDENTIFIERS_NAMESPACES) -> columns in the model map
+ANNOTATION_COLUMNS = {'hmdb': 'HMDB', 'chebi': 'CHEBI', 'kegg.compound': 'KEGG',
+                      'bigg.metabolite': 'BIGG_METABOLITE', 'metanetx.chemical': 'METANETX',
+                      'inchikey': 'INCHIKEY', 'seed': 'SEED', 'pubchem.compound': 'PUBCHEM'}
+
+
+@timed()
+def readDataset(filename, sheet='Sheet1', columns=None):
+    """
+    readDataset reads one sheet of an Excel workbook, or a .csv file. Workbooks are read through the shared sheet
+    cache, so openpyxl only parses a workbook the first time it is read.
+
+    :param filename: A string denoting the path to a text delimited or Excel file containing the metabolomics data
+    :param sheet:    A string denoting the tab name to read in (Excel only)
+    :param columns:  An optional list of column names to read
+    :return:         A Pandas dataframe
+    """
+    if os.path.splitext(filename)[1].lower() in ('.xls', '.xlsx'):
+        from sheetcache import readSheet
+        return readSheet(filename, sheet, columns=columns)
+    return pd.read_csv(filename, usecols=columns)
+
+
+@timed()
+def queryPubChem(data, bulk=False, maxWorkers=5, rate=5, cache=True,
+                 outFile='~/Data/Mappings/ME1/pubmed_me1_query.csv', synonymIndex=None, baseUrl=None):
     """
     queryPubChem maps the metabolite name from a pandas Dataframe in the 'Compound Method' column and extracts
     synoynms from several databases using the PubChem API.
     :param data:           A Pandas Dataframe of the metabolomics dataframe with the common metabolite identifiers
                            under the 'Compound Method' column
+    :param bulk:           A boolean flag to resolve all names concurrently with the rate-limited PubChemClient
+                           instead of one blocking request per metabolite
+    :param maxWorkers:     An integer denoting the number of PubChem requests kept in flight (bulk mode only)
+    :param rate:           An integer denoting the number of PubChem requests per second (bulk mode only)
+    :param cache:          True to use the shared on-disk response cache, False to disable it, or a ResponseCache;
+                           names that are cached are not sent to PubChem
+    :param outFile:        A string denoting the path of the .csv file the synonyms are appended to (the header is
+                           written when the file is created)
+    :param synonymIndex:   An optional offline synonym index (True, a path or a SynonymIndex); names it resolves are
+                           written with their CIDs and not sent to PubChem (bulk mode only)
+    :param baseUrl:        An optional string denoting the PUG-REST root URL, e.g. of a local stand-in (see standin.py)
     :return all_compounds: A Pandas Dataframe from the PubChem API containing the metabolite map. This dataframe is
                            saved as a .csv file.
     :return queryList:     A string with semicolon delimters to be fed into a REST-API
     """
-    import pubchempy as pcp
-
     # Split 'Compound Method' column by the '/' regex and clean up some data
     data = data.drop('Compound Method', axis=1).join(data['Compound Method']
                                                      .str.split('/', expand=True)
                                                      .stack().reset_index(level=1, drop=True)
                                                      .rename('Metabolite'))
     data['Metabolite'] = data['Metabolite'].str.lower()
-    pubChemQuery = data['Metabolite'].tolist()
-
-    # Mine the PubChem database for synonyms
-    all_compounds = []
+    print("%d metabolite names, %d unique" % (len(data), len(set(normalize_names(data['Metabolite'])))))
+
+    # Each name is looked up and written once (in the spelling of its first occurrence). The synonyms reach every
+    # occurrence of the name when the mapped identifiers are joined back onto the dataset by name
+    from cache import normalizeQuery
+    pubChemQuery = {}
+    for metabolite in data['Metabolite']:
+        pubChemQuery.setdefault(normalizeQuery(metabolite), metabolite)
+    pubChemQuery = list(pubChemQuery.values())
+
+    # Mine the PubChem database for synonyms. Rows are streamed into the .csv as they are produced, so memory does
+    # not grow with the number of synonyms per compound
+    from pubchem import SynonymWriter, iterSynonymRows
     print("Mapping metabolite names to PubChem database for synonym matching and ID retrieval.")
 
+    if bulk is True:
+        from cache import resolveCache
+        from pubchem import PUGREST, PubChemClient
+        from synonyms import resolveSynonymIndex
+
+        with SynonymWriter(outFile) as writer:
+            local = {}
+            index = resolveSynonymIndex(synonymIndex)
+            if index is not None:
+                hits = index.lookup(pubChemQuery)
+                for cid, query in zip(hits['pubchem_id'], hits['query']):
+                    local.setdefault(query, []).append((None, None, 'synonym index', int(cid), query, query))
+
+            client = PubChemClient(baseUrl=baseUrl or PUGREST, maxWorkers=maxWorkers, rate=rate,
+                                   cache=resolveCache(cache))
+            substances = client.getSubstances(q for q in pubChemQuery if q not in local)
+            for metabolite in pubChemQuery:
+                if metabolite in local:
+                    writer.writeRows(local[metabolite])
+                elif metabolite in substances:
+                    writer.writeRows(iterSynonymRows(metabolite, substances[metabolite]))
+
+        for query, err in client.failed:
+            print("PubChem query failed after retries: %s (%s)" % (query, err))
+        print("Finished metabolite common name -> identifier synoynm matching!")
+        return
+
+    import pubchempy as pcp
+    from cache import resolveCache
+    from pubchem import PUGREST, substanceRecord
+
+    # Same cache entries as the bulk client, so a warm rerun does not go back to PubChem
+    cache = resolveCache(cache)
+    cached = {}
+    if cache is not None:
+        cached = cache.getMany('pubchem', 'substance/name', pubChemQuery)
+
     # The data is too large to keep in memory. So I wrote it into a csv file, and will read in.
-    for metabolite in pubChemQuery:
-        try:
-            df = pcp.get_substances(identifier=metabolite,
-                                    namespace='name',
-                                    as_dataframe=True)
-            df['Name'] = metabolite
-            df = df.applymap(str)
-            df = df.drop('synonyms', axis=1).join(df['synonyms']
-                                            .str.split(',', expand=True)
-                                            .stack().reset_index(level=1, drop=True)
-                                            .rename('synonyms'))
-            df.to_csv('~/Data/Mappings/ME1/pubmed_me1_query.csv',
-                      mode='a',
-                      header=False, index=False)
-
-        except (KeyError, TimeoutError, pcp.TimeoutError):
-            continue
+    fetched = {}
+    # pubchempy reads its API root from a module global, which is put back for the rest of the process afterwards
+    apiBase, pcp.API_BASE = pcp.API_BASE, baseUrl or PUGREST
+    try:
+        with SynonymWriter(outFile) as writer:
+            for metabolite in pubChemQuery:
+                if normalizeQuery(metabolite) not in cached:
+                    try:
+                        substances = [substanceRecord(s)
+                                      for s in pcp.get_substances(identifier=metabolite, namespace='name')]
+                    except pcp.NotFoundError:
+                        substances = []
+                    except (KeyError, TimeoutError, pcp.TimeoutError):
+                        count(failed_lookups=1)
+                        continue
+                    cached[normalizeQuery(metabolite)] = fetched[metabolite] = substances
+                writer.writeRows(iterSynonymRows(metabolite, cached[normalizeQuery(metabolite)]))
+    finally:
+        pcp.API_BASE = apiBase
+        # One transaction for the whole run, which still keeps the answers of an interrupted run
+        if cache is not None and fetched:
+            cache.setMany('pubchem', 'substance/name', fetched)
 
     print("Finished metabolite common name -> identifier synoynm matching!")
 
 
-def queryMetaboAnalyst(filename='', sheet='Sheet1', synmatch=True):
+@timed()
+def mapCompounds(names, cache=True, batchSize=500, maxWorkers=4, synonymIndex=None, url=None):
+    """
+    mapCompounds queries the MetaboAnalyst compound mapping API with a list of metabolite names. The names are split
+    into batches that are posted concurrently, and names that are already in the response cache are not sent again.
+
+    :param names:        A list of metabolite names
+    :param cache:        True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param batchSize:    An integer denoting the number of names posted per request
+    :param maxWorkers:   An integer denoting the number of requests in flight at once
+    :param synonymIndex: An optional offline synonym index (True, a path or a SynonymIndex); names it resolves are not
+                         sent to MetaboAnalyst
+    :param url:          An optional string denoting the mapcompounds endpoint, e.g. of a local stand-in
+    :return data:        A Pandas dataframe with one row per mapped name and the MetaboAnalyst identifier columns
+    """
+    from cache import resolveCache
+    from metaboanalyst import IDENTIFIER_COLUMNS, MAPCOMPOUNDS, MetaboAnalystClient
+    from synonyms import resolveSynonymIndex
+
+    names = list(names)
+    local = None
+    index = resolveSynonymIndex(synonymIndex)
+    if index is not None:
+        local = index.lookup(names).reindex(columns=['query'] + IDENTIFIER_COLUMNS)
+        resolved = set(local['query'])
+        names = [n for n in names if n not in resolved]
+        print("Resolved %d names with the offline synonym index" % len(resolved))
+
+    # The columns are fixed, so a run in which every batch failed still gives a (empty) frame with every column
+    columns = ['query'] + IDENTIFIER_COLUMNS
+    rows = []
+    if names:
+        client = MetaboAnalystClient(url=url or MAPCOMPOUNDS, batchSize=batchSize, maxWorkers=maxWorkers,
+                                     cache=resolveCache(cache))
+        rows = client.mapNames(names)
+        for batch, err in client.failed:
+            print("MetaboAnalyst batch of %d names failed after retries (%s)" % (len(batch), err))
+    data = pd.DataFrame(rows, columns=columns)
+    if local is not None:
+        data = pd.concat([local, data], ignore_index=True).reindex(columns=columns)
+    return data
+
+
+@timed()
+def queryMetaboAnalyst(filename='', sheet='Sheet1', synmatch=True, cache=True,
+                       pubchemFile='~/Data/Mappings/ME1/pubmed_me1_query.csv',
+                       outFile='~/Data/Mappings/ME1/metaboanalyst_me1_query.csv', synonymIndex=None, url=None):
     """
     queryMetaboAnalyst takes the file (currently only written for csv files),
     and uses the first column as metabolite names in the file.
@@ -72,19 +207,20 @@ def queryMetaboAnalyst(filename='', sheet='Sheet1', synmatch=True):
     :param   filename: A string denoting the path to a text delimited or Excel file containing the metabolomics data
     :param   sheet:    A string denoting the tab name to read in
     :param   synmatch: A boolean flag determining whether to perform synonym matching or not
+    :param   cache:    True to use the shared on-disk response cache, False to disable it, or a ResponseCache
+    :param   pubchemFile: A string denoting the .csv file written by queryPubChem (synmatch only)
+    :param   outFile:  A string denoting the .csv file the mapped synonyms are appended to (synmatch only)
+    :param   synonymIndex: An optional offline synonym index (True, a path or a SynonymIndex) tried before
+                       MetaboAnalyst
+    :param   url:      An optional string denoting the mapcompounds endpoint, e.g. of a local stand-in
 
     OUTPUT:
     :return: data:     A Pandas dataframe with a metabolite map containing several different metabolite identifiers
     """
 
-    import requests
-    import json
+    from metaboanalyst import IDENTIFIER_COLUMNS
 
     print('Mapping metabolomics data to additional identifiers')
-    if os.path.splitext(filename)[1] is '.xls' or 'xlsx':
-        fileData = pd.read_excel(filename, sheet_name=sheet)
-    else:
-        fileData = pd.read_csv(filename)
 
     # Load from Google Drive
     # wb = gc.open_by_url(filename)
@@ -95,79 +231,96 @@ def queryMetaboAnalyst(filename='', sheet='Sheet1', synmatch=True):
     # fileData = fileData[1:]
     # fileData.columns = header
 
-    patterns = ["[", "]", "'", '"', '.']
     if synmatch is True:
         # Get synonyms of each metabolite from PubChem
         #queryPubChem(fileData)
-        all_compounds = pd.read_csv(r'~/Data/Mappings/ME1/pubmed_me1_query.csv', chunksize=1E3)
+        all_compounds = pd.read_csv(pubchemFile, chunksize=1000)
+
+        # Collect the unique names from every chunk first, so MetaboAnalyst sees a few large concurrent batches
+        # instead of one request per chunk
+        queryNames = {}
         for chunk in all_compounds:
             chunk['Name'] = chunk['Name'].astype(str)
 
             # Clean up regexes and get unique compounds
-            for p in patterns:
-                chunk['Name'] = chunk['Name'].str.replace(p, '')
-                chunk['Name'] = chunk['Name'].str.strip()
-            chunk['Name'] = chunk['Name'].str.lower()
+            chunk['Name'] = normalize_names(chunk['Name'])
             chunk['Compound Method'] = chunk['Name']
+            queryNames.update(dict.fromkeys(chunk['Compound Method'].unique()))
 
-            queryList = ';'.join(chunk['Compound Method'].unique())
-
-            # Query metaboAnalyst for additional database identifiers
-            queryDict = {"queryList": queryList,
-                         "inputType": "name"}
-            metabolites = json.dumps(queryDict)
-
-            # Query MetaboAnalyst using data set metabolites
-            url = "http://api.xialab.ca/mapcompounds"
-            headers = {
-                'Content-Type': "application/json",
-                'cache-control': "no-cache",
-            }
-            response = requests.request("POST", url, data=metabolites, headers=headers).json()
-            data = pd.DataFrame(response)
-
-            identifiers = ['hmdb_id', 'kegg_id', 'pubchem_id', 'chebi_id', 'chebi_id', 'metlin_id']
-            for id in identifiers:
-                data[id] = data[id].replace('-', np.nan)
-                data[id] = data[id].astype(str)
-
-            data.to_csv('~/Data/Mappings/ME1/metaboanalyst_me1_query.csv', mode='a', header=False)
-            print('MetaboAnalyst query done!')
+        # Query metaboAnalyst for additional database identifiers
+        data = mapCompounds(list(queryNames), cache=cache, synonymIndex=synonymIndex, url=url)
+
+        for id in IDENTIFIER_COLUMNS:
+            data[id] = compact_ids(data[id], *ID_FORMATS.get(id, ('', 0)))
+
+        append_csv(expand_frame(data), outFile)
+        print('MetaboAnalyst query done!')
         data = list()
 
     else:
-        all_compounds = fileData
-        for p in patterns:
-            all_compounds['Compound Method'] = all_compounds['Compound Method'].str.replace(p, '')
-            all_compounds['Compound Method'] = all_compounds['Compound Method'].str.strip()
-        all_compounds['Compound Method'] = all_compounds['Compound Method'].str.lower()
-
-        queryList = ';'.join(all_compounds['Compound Method'].unique())
+        all_compounds = readDataset(filename, sheet, columns=['Compound Method'])
+        all_compounds['Compound Method'] = normalize_names(all_compounds['Compound Method'])
 
         # Query metaboAnalyst for additional database identifiers
-        queryDict = {"queryList": queryList,
-                     "inputType": "name"}
-        metabolites = json.dumps(queryDict)
-
-        # Query MetaboAnalyst using data set metabolites
-        url = "http://api.xialab.ca/mapcompounds"
-        headers = {
-            'Content-Type': "application/json",
-            'cache-control': "no-cache",
-        }
-        response = requests.request("POST", url, data=metabolites, headers=headers).json()
-        data = pd.DataFrame(response)
-
-        identifiers = ['hmdb_id', 'kegg_id', 'pubchem_id', 'chebi_id', 'chebi_id', 'metlin_id']
-        for id in identifiers:
-            data[id] = data[id].replace('-', np.nan)
-            data[id] = data[id].astype(str)
+        data = mapCompounds(all_compounds['Compound Method'].unique(), cache=cache,
+                            synonymIndex=synonymIndex, url=url)
+
+        # Identifiers are kept as nullable integers ('C00031' -> 31) where every value has the usual format
+        for id in IDENTIFIER_COLUMNS:
+            data[id] = compact_ids(data[id], *ID_FORMATS.get(id, ('', 0)))
         print('MetaboAnalyst query done!')
 
     return data
 
 
-def mapMetabolicModel(model):
+def _mapMetabolicModelTree(model):
+    """
+    _mapMetabolicModelTree is the original mapMetabolicModel parser, which loads the whole document with etree.parse
+    and only keeps ChEBI, HMDB and KEGG identifiers written as http://identifiers.org/<namespace>/ URIs. It writes one
+    row per rdf:li, so an annotation from any other namespace gives a row without identifiers.
+    """
+    from lxml import etree
+    context = etree.parse(model)
+
+    # Namespaces for different databases in the sbml models, with the prefix put back in front of the digits
+    patterns = [('HMDB', re.compile(r'.*http://identifiers.org/hmdb/HMDB(\d+)'), 'HMDB'),
+                ('CHEBI', re.compile(r'.*http://identifiers.org/chebi/CHEBI:(\d+)'), ''),
+                ('KEGG', re.compile(r'.*http://identifiers.org/kegg.compound/C(\d+)'), 'C')]
+
+    # Rows are collected column by column and turned into a dataframe in one go
+    modelMap = {col: [] for col in ['Metabolite', 'BIGG'] + [col for col, _, _ in patterns]}
+    for metabolite in context.iter(tag='{http://www.sbml.org/sbml/level3/version1/core}species'):
+        name = str(metabolite.get("name")).replace("'", "")
+        bigg = str(metabolite.get("metaid")).replace("'", "")
+        for element in metabolite.iter(tag='{http://www.w3.org/1999/02/22-rdf-syntax-ns#}li'):
+            content_string = etree.tostring(element).decode("utf-8")
+            modelMap['Metabolite'].append(name)
+            modelMap['BIGG'].append(bigg)
+            for col, pattern, prefix in patterns:
+                match = pattern.match(content_string)
+                modelMap[col].append(prefix + match.group(1) if match else None)
+    return pd.DataFrame(modelMap)
+
+
+def modelMapFromCompiled(compiled):
+    """
+    modelMapFromCompiled builds the model map (one row per annotation, see mapMetabolicModel) from a CompiledModel in
+    one vectorized step.
+
+    :param  compiled: A CompiledModel from the model cache
+    :return modelMap: A Pandas dataframe containing metabolite identifiers from the metabolic model
+    """
+    annotations = compiled.annotations
+    species = compiled.species.iloc[annotations['species'].values]
+    modelMap = pd.DataFrame({'Metabolite': species['name'].astype(str).str.replace("'", "").values,
+                             'BIGG': species['metaid'].astype(str).str.replace("'", "").values})
+    for key, col in ANNOTATION_COLUMNS.items():
+        modelMap[col] = annotations['identifier'].where(annotations['namespace'] == key).values
+    return modelMap
+
+
+@timed()
+def mapMetabolicModel(model, stream=True, modelCache=True, outFile='~/Data/Mappings/ME1/RECON1_ID_Map.csv'):
     """
     mapMetabolicModel takes in a metabolic model (xml format only), and parses the
     identifiers in the map. 
@@ -175,141 +328,205 @@ def mapMetabolicModel(model):
     Currently only tested with RECON1 - xml namespaces will change depending on metabolic models.
 
     :param  model:    A string describing the path to the metabolic model file (`.xml` or `.sbml` file types supported only.
-    :return modelMap: A Pandas dataframe containing metabolite identifiers from the metabolic model
+    :param  stream:   A boolean flag to parse the model species by species with iterparse and build the dataframe once
+                      at the end. Memory stays flat and runtime is linear in the number of species. Set it to False for
+                      the original whole-document parser.
+
+                      The two parsers agree on the ChEBI, HMDB and KEGG rows, but the streaming parser also reads the
+                      other identifiers.org namespaces (see ANNOTATION_COLUMNS) and compact URIs, and writes rows only
+                      for annotations it recognizes, where the original parser writes an empty row for every other
+                      rdf:li.
+    :param  modelCache: A boolean flag to read the species and annotations from the compiled model cache, which only
+                      reparses the model when the file changes (implies the streaming parser)
+    :param  outFile:  A string denoting the .csv file the model map is saved to (None to skip saving)
+    :return modelMap: A Pandas dataframe containing metabolite identifiers from the metabolic model. Identifier columns
+                      are compact nullable integers and text columns categoricals (see utilities.compact_frame). The
+                      saved .csv has the identifiers written back in the format of utilities.ID_FORMATS, so old
+                      five-digit HMDB IDs (HMDB01234) are saved in the seven-digit form (HMDB0001234).
     """
 
-    from lxml import etree
     print('Parsing metabolic model to get metabolite and associated identifiers')
-    context = etree.parse(model)
 
-    # Namespaces for different databases in the sbml models
-    chebi_pattern = re.compile(r'.*http://identifiers.org/chebi/CHEBI:(\d+)')
-    hmdb_pattern = re.compile(r'.*http://identifiers.org/hmdb/HMDB(\d+)')
-    kegg_pattern = re.compile(r'.*http://identifiers.org/kegg.compound/C(\d+)')
+    if modelCache is True:
+        from modelcache import loadCompiledModel
+        modelMap = modelMapFromCompiled(loadCompiledModel(model))
+
+    elif stream is True:
+        from sbml import iterAnnotations, iterSpecies
+
+        # Rows are collected column by column and turned into a dataframe in one go. Every rdf:li becomes one row
+        # holding the identifier it annotates.
+        columns = {col: [] for col in ['Metabolite', 'BIGG'] + list(ANNOTATION_COLUMNS.values())}
+        for metabolite in iterSpecies(model):
+            name = str(metabolite.get("name")).replace("'", "")
+            bigg = str(metabolite.get("metaid")).replace("'", "")
+            for key, identifier in iterAnnotations(metabolite):
+                for col in columns.values():
+                    col.append(None)
+                columns['Metabolite'][-1] = name
+                columns['BIGG'][-1] = bigg
+                columns[ANNOTATION_COLUMNS[key]][-1] = identifier
+        modelMap = pd.DataFrame(columns)
+
+    else:
+        modelMap = _mapMetabolicModelTree(model)
 
-    modelMap = pd.DataFrame()
-    for metabolite in context.iter(tag='{http://www.sbml.org/sbml/level3/version1/core}species'):
-        name = metabolite.get("name")
-        bigg = metabolite.get("metaid")
-        for element in metabolite.iter():
-            if element.tag == '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}li':
-                content = etree.tostring(element)
-                content_string = content.decode("utf-8")
-
-                metabolite_name = []
-                chebi = []
-                hmdb = []
-                kegg = []
-
-                # Get metabolite identifiers for CHEBI, HMDB and KEGG
-                metabolite_name.append(name)
-                metabolite_name = str(metabolite_name).replace(
-                    '[', '').replace(']', '')
-
-                if re.match(chebi_pattern, content_string):
-                    chebi_num = re.findall(chebi_pattern, content_string)
-                    chebi.append(chebi_num)
-                else:
-                    chebi.append(np.nan)
-                chebi = str(chebi).replace('[', '').replace(']', '')
-
-                if re.match(hmdb_pattern, content_string):
-                    hmdb_num = re.findall(hmdb_pattern, content_string)
-                    hmdb_num = ["HMDB" + h for h in hmdb_num]
-                    hmdb.append(hmdb_num)
-                else:
-                    hmdb.append(np.nan)
-                hmdb = str(hmdb).replace('[', '').replace(']', '')
-
-                if re.match(kegg_pattern, content_string):
-                    kegg_num = re.findall(kegg_pattern, content_string)
-                    kegg_num = ["C" + k for k in kegg_num]
-                    kegg.append(kegg_num)
-                else:
-                    kegg.append(np.nan)
-                kegg = str(kegg).replace('[', '').replace(']', '')
-
-                # Format stuff correctly before saving
-                modelMap = modelMap.append({'Metabolite': metabolite_name,
-                                            'BIGG': bigg, 'HMDB': hmdb,
-                                            'CHEBI': chebi, 'KEGG': kegg},
-                                           ignore_index=True)
-        element.clear()
-
-    for col in modelMap:
-        modelMap[col] = modelMap[col].astype(str)
-        modelMap[col] = modelMap[col].str.replace("'", "")
     #modelMap = modelMap.drop_duplicates(keep='first')
-    modelMap.to_csv('~/Data/Mappings/ME1/RECON1_ID_Map.csv', index=False)
+    modelMap = compact_frame(modelMap)
+    if outFile is not None:
+        expand_frame(modelMap).to_csv(outFile, index=False)
     print("Metabolic map complete")
     return modelMap
 
 
-def matchModelAndData(data, modelMap, synmatch=True):
+@timed()
+def matchModelAndData(data, modelMap, synmatch=True, chunksize=100000,
+                      queryFile='~/Data/Mappings/ME1/metaboanalyst_me1_query.csv',
+                      outFile='~/Data/Mappings/ME1/metaboanalyst_recon1_map.csv'):
     """
     matchModelAndData uses the identifiers from the metabolomics data and the model
     to find matches between them.
 
+    The ChEBI/KEGG -> model species index is built once from modelMap and probed with the query results, so the
+    model map is hashed a single time no matter how many chunks are read.
+
     :param  data:               A Pandas dataframe containing data queried from MetaboAnalyst.
     :param  modelMap:           A Pandas dataframe queried from mapping the metabolite names to the COBRA metabolic
                                 model.
+    :param  synmatch:           A boolean flag to stream the synonym query results from disk instead of using `data`
+    :param  chunksize:          An integer denoting the number of query results read per chunk in synmatch mode
+    :param  queryFile:          A string denoting the .csv file written by queryMetaboAnalyst (synmatch only)
+    :param  outFile:            A string denoting the .csv file matches are appended to (synmatch only)
     :return mergedModelDataMap: A Pandas dataframe of the merged map between the metabolomics data and the
                                 metabolic model.
     """
+    from modelindex import ModelIndex
 
     print('Match metabolomics identifiers and model identifiers by ChEBI and KEGG IDs')
+    index = ModelIndex(modelMap, keys={'CHEBI': 'chebi_id', 'KEGG': 'kegg_id'})
 
     if synmatch is True:
-        data = pd.read_csv(r'/home/scampit/Data/Mappings/ME1/metaboanalyst_me1_query.csv', dtype=str, chunksize=1E1)
+        data = pd.read_csv(queryFile, dtype=str, chunksize=int(chunksize))
         for chunk in data:
-            chebi = pd.merge(modelMap, chunk, left_on='CHEBI', right_on='chebi_id', how='inner')
-            chebi = chebi[["Metabolite", "query", "BIGG", "CHEBI"]]
-            chebi = chebi.dropna()
-
-            kegg = pd.merge(modelMap, chunk, left_on='KEGG', right_on='kegg_id', how='inner')
-            kegg = kegg[['Metabolite', 'query', 'BIGG', 'KEGG']]
-            kegg = kegg.dropna()
-            merged_data = pd.merge(chebi, kegg,
-                                          how='inner', on=['Metabolite', 'query', 'BIGG'])
-            merged_data.to_csv(r'~/Data/Mappings/ME1/metaboanalyst_recon1_map.csv', mode='a', header=False, index=False)
+            merged_data = index.match(chunk)
+            append_csv(merged_data, outFile, index=False)
+        merged_data = pd.read_csv(outFile, dtype=str)
     else:
-        chebi = pd.merge(modelMap, data, left_on='CHEBI', right_on='chebi_id')
-        chebi = chebi[["Metabolite", "query", "BIGG", "CHEBI"]]
-
-        kegg = pd.merge(modelMap, data, left_on='KEGG', right_on='kegg_id')
-        kegg = kegg[['Metabolite', 'query', 'BIGG', 'KEGG']]
-        merged_data = pd.merge(chebi, kegg,
-                                      how='inner', on=['Metabolite', 'query', 'BIGG'])
+        merged_data = index.match(data)
         merged_data = merged_data.drop_duplicates('query', keep='first')
     print("Found matching metabolites based on ChEBI and KEGG identities!")
     return merged_data
 
-def mapMetabolitePositionsInModel(mergedModelDataMap, model):
+@timed()
+def streamSynonymMatches(modelMap, pubchemFile='~/Data/Mappings/ME1/pubmed_me1_query.csv',
+                         outFile='~/Data/Mappings/ME1/metaboanalyst_recon1_map.sqlite', bufferSize=10000, prefetch=1,
+                         cache=True, synonymIndex=None, url=None):
+    """
+    streamSynonymMatches is the streaming form of the synmatch path (queryMetaboAnalyst followed by
+    matchModelAndData). Synonym rows flow through normalization -> MetaboAnalyst mapping -> model join one buffer at a
+    time, so peak memory is set by `bufferSize` and `prefetch` and not by the size of the PubChem synonym set. Each
+    synonym is looked up for the metabolite it was found for, and its matches are kept under that metabolite's name.
+
+    :param  modelMap:     A Pandas dataframe queried from mapping the metabolite names to the COBRA metabolic model
+    :param  pubchemFile:  A string denoting the .csv file written by queryPubChem
+    :param  outFile:      A string denoting the SQLite file the matches are written to (see synstream.MatchStore)
+    :param  bufferSize:   An integer denoting the number of synonym rows processed at a time
+    :param  prefetch:     An integer denoting the number of buffers read and mapped ahead of the model join
+    :param  cache:        True to use the shared on-disk response cache, False to disable it, or a ResponseCache.
+                          Names repeated in later buffers are answered from it instead of MetaboAnalyst.
+    :param  synonymIndex: An optional offline synonym index (True, a path or a SynonymIndex) tried before MetaboAnalyst
+    :param  url:          An optional string denoting the mapcompounds endpoint, e.g. of a local stand-in
+    :return mergedModelDataMap: A Pandas dataframe with the columns of matchModelAndData, one row per distinct
+                          (query, Metabolite, BIGG) match
+    """
+    from metaboanalyst import IDENTIFIER_COLUMNS
+    from modelindex import ModelIndex
+    from synonyms import resolveSynonymIndex
+    from synstream import MatchStore, iterSynonymPairs, prefetch as prefetched
+
+    print('Streaming PubChem synonyms through MetaboAnalyst and the model map')
+    index = ModelIndex(modelMap, keys={'CHEBI': 'chebi_id', 'KEGG': 'kegg_id'})
+    # Opened once rather than once per buffer
+    synonymIndex = resolveSynonymIndex(synonymIndex)
+
+    def mapped():
+        for pairs in iterSynonymPairs(pubchemFile, bufferSize):
+            data = mapCompounds(pairs['name'].unique(), cache=cache, synonymIndex=synonymIndex, url=url)
+            data = data.reindex(columns=['query'] + IDENTIFIER_COLUMNS).rename(columns={'query': 'name'})
+            yield pd.merge(pairs, data, on='name').drop('name', axis=1)
+
+    with MatchStore(outFile, index) as store:
+        buffers = 0
+        for data in prefetched(mapped(), prefetch):
+            store.write(index.match(data))
+            buffers += 1
+        print("%d synonym buffers, %d distinct matches" % (buffers, store.rows))
+        merged_data = store.read()
+    print("Found matching metabolites based on ChEBI and KEGG identities!")
+    return merged_data
+
+
+def positionTable(metaboliteIds, biggIds):
+    """
+    positionTable finds the model metabolites that appear in a list of BiGG identifiers. The 'M_' prefix is stripped
+    from the BiGG identifiers once, membership is tested against a hash set, and the table is built in one vectorized
+    step.
+
+    :param  metaboliteIds: A list of metabolite IDs in model order (e.g. 'glc_D_c')
+    :param  biggIds:       A list or Series of BiGG identifiers from the model map (e.g. 'M_glc_D_c')
+    :return biggRxn:       A Pandas dataframe with the 'Position', base 'Metabolite' ID and 'Compartment' of every match
+    """
+    biggSet = set(pd.Series(biggIds).dropna().astype(str).str.replace(r'^M_', '', regex=True))
+    ids = pd.Series(metaboliteIds, dtype=object)
+    keep = ids.isin(biggSet).values
+    parts = ids[keep].str.rsplit('_', n=1)
+    return pd.DataFrame({'Position': np.flatnonzero(keep),
+                         'Metabolite': parts.str[0].values,
+                         'Compartment': parts.str[-1].values})
+
+
+@timed()
+def mapMetabolitePositionsInModel(mergedModelDataMap, model, indexed=True, modelCache=True,
+                                  outFile='~/Data/Mappings/ME1/RECON1_position_map.csv'):
     """
     mapMetabolitePositionsInModel gets the metabolite positions using the cobrapy library.
 
     :param  mergedModelDataMap: A Pandas dataframe of the merged map between the metabolomics data and the metabolic
                                 model.
     :param  model:              A string denoting the path to the metabolic model (`.xml` or `.sbml` file types supported only.
+    :param  indexed:            A boolean flag to match model metabolites to BiGG IDs exactly through a hash set (see
+                                positionTable). Set it to False for the original substring scan, which also matches
+                                IDs contained in longer ones ('atp_c' in 'M_datp_c') and cuts the base ID at the
+                                first underscore ('glc_D_c' -> 'glc') instead of the last.
+    :param  modelCache:         A boolean flag to read the metabolite order from the compiled model cache instead of
+                                loading the model with cobrapy (indexed mode only)
+    :param  outFile:            A string denoting the .csv file the position map is saved to (None to skip saving)
     :return PositionModel:      A Pandas dataframe containing the positions for each metabolite in the metabolic model.
     """
 
-    import cobra
     print("Mapping metabolite positions in metabolic model")
-    bigg_ids = mergedModelDataMap['BIGG'].replace('M_', '')
-    bigg_ids = list(bigg_ids)
-    biggRxn = pd.DataFrame()
-    mdl = cobra.io.read_sbml_model(model)
-
-    for index, met in enumerate(mdl.metabolites):
-        if any(str(met) in m for m in bigg_ids):
-            biggRxn = biggRxn.append(pd.DataFrame({"Position": index,
-                                                   "Metabolite": [met]}
-                                                  ), ignore_index=True)
 
-    biggRxn['Metabolite'] = biggRxn['Metabolite'].astype(str)
-    biggRxn["Compartment"] = biggRxn["Metabolite"].str.rsplit('_').str[-1]
-    biggRxn["Metabolite"] = biggRxn["Metabolite"].str.split('_').str[0]
+    if indexed is True and modelCache is True:
+        from modelcache import loadCompiledModel
+        biggRxn = positionTable(loadCompiledModel(model).metabolites, mergedModelDataMap['BIGG'])
+    elif indexed is True:
+        import cobra
+        mdl = cobra.io.read_sbml_model(model)
+        biggRxn = positionTable([met.id for met in mdl.metabolites], mergedModelDataMap['BIGG'])
+    else:
+        import cobra
+        mdl = cobra.io.read_sbml_model(model)
+        bigg_ids = list(mergedModelDataMap['BIGG'].dropna().astype(str))
+
+        # Positions and IDs are collected in lists and turned into a dataframe once
+        positions, metabolites = [], []
+        for index, met in enumerate(mdl.metabolites):
+            if any(met.id in m for m in bigg_ids):
+                positions.append(index)
+                metabolites.append(met.id)
+        biggRxn = pd.DataFrame({'Position': positions, 'Metabolite': metabolites})
+        biggRxn["Compartment"] = biggRxn["Metabolite"].str.rsplit('_').str[-1]
+        biggRxn["Metabolite"] = biggRxn["Metabolite"].str.split('_').str[0]
 
     biggRxn = biggRxn.pivot_table(index='Metabolite',
                             columns='Compartment',
@@ -325,12 +542,14 @@ def mapMetabolitePositionsInModel(mergedModelDataMap, model):
                               left_index=True, right_on='BIGG')
     PositionModel = PositionModel.drop(['BIGG'], axis=1)
     PositionModel = PositionModel.set_index(['Query'])
-    PositionModel.to_csv(r'~/Data/Mappings/ME1/RECON1_position_map.csv', index=True)
+    if outFile is not None:
+        expand_frame(PositionModel).to_csv(outFile, index=True)
 
     print('Mapped metabolite positions in metabolic model to metabolite name')
     return PositionModel
 
 
+@timed()
 def constructFinalDataset(PositionModel, filename, sheet='Sheet1'):
     """
     constructFinalDataset merges the array of metabolite positions and the file name together.
@@ -343,10 +562,7 @@ def constructFinalDataset(PositionModel, filename, sheet='Sheet1'):
     """
 
     print("Merging metabolomics data to model map")
-    if os.path.splitext(filename)[1] is '.xls' or 'xlsx':
-        fileData = pd.read_excel(filename, sheet_name=sheet)
-    else:
-        fileData = pd.read_csv(filename)
+    fileData = readDataset(filename, sheet)
 
     # Load from Google Drive
     # wb = gc.open_by_url(filename)
@@ -358,54 +574,209 @@ def constructFinalDataset(PositionModel, filename, sheet='Sheet1'):
     # fileData.columns = header
 
     # Clean up regexes
-    all_compounds = fileData
-    patterns = ["[", "]", "'", '"', '.']
-    for p in patterns:
-        all_compounds['Compound Method'] = all_compounds['Compound Method'].str.replace(p, '')
-        all_compounds['Compound Method'] = all_compounds['Compound Method'].str.strip()
-        PositionModel.index = PositionModel.index.str.replace(p, '')
-        PositionModel.index = PositionModel.index.str.strip()
-
-    all_compounds['Compound Method'] = all_compounds['Compound Method'].str.lower()
-    PositionModel.index = PositionModel.index.str.lower()
-    print(PositionModel.index)
-    print(all_compounds['Compound Method'].values)
+    PositionModel.index = normalize_names(PositionModel.index)
+    df = _mergeWithModel(PositionModel, fileData)
+    print("Finished merging metabolomics data to model map!")
+    return df
 
+
+def _mergeWithModel(PositionModel, fileData):
+    # PositionModel.index must already be normalized
+    all_compounds = fileData
+    all_compounds['Compound Method'] = normalize_names(all_compounds['Compound Method'])
     df = pd.merge(PositionModel, all_compounds,
                   left_index=True, right_on='Compound Method',
                   how='inner')
-    #print(df)
+    # Excel gets the prefixed identifiers back
+    return expand_frame(df)
+
+
+_workerPositionModel = None
+
+
+def _initSheetWorker(PositionModel):
+    # Each worker receives the position model once instead of once per sheet
+    global _workerPositionModel
+    _workerPositionModel = PositionModel
+
+
+def _mergeSheet(fileData):
+    return _mergeWithModel(_workerPositionModel, fileData)
+
+
+@timed()
+def constructFinalDatasets(PositionModel, filename, sheets=None, outFile=None, maxWorkers=None):
+    """
+    constructFinalDatasets is the multi-sheet version of constructFinalDataset. The workbook is parsed once (through
+    the shared sheet cache), and the sheets are normalized and merged with the metabolite positions in a process pool. All sheets are saved through a
+    single Excel writer.
+
+    :param  PositionModel: A Pandas dataframe containing the metabolite positions in the metabolic model.
+    :param  filename:      A string denoting the path of the metabolomics workbook.
+    :param  sheets:        A list of tab names to merge (default: every tab)
+    :param  outFile:       An optional string denoting the Excel file the merged sheets are saved to
+    :param  maxWorkers:    An integer denoting the number of worker processes (default: one per core)
+    :return datasets:      A dictionary mapping each tab name to its merged Pandas dataframe, in workbook order
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    print("Merging metabolomics data to model map")
+    from sheetcache import readSheet, sheetNames
+
+    if sheets is None:
+        sheets = sheetNames(filename)
+    elif isinstance(sheets, str):
+        sheets = [sheets]
+    workbook = {sht: readSheet(filename, sht) for sht in sheets}
+
+    PositionModel = PositionModel.copy()
+    PositionModel.index = normalize_names(PositionModel.index)
+    maxWorkers = min(maxWorkers or os.cpu_count() or 1, len(workbook))
+    if maxWorkers <= 1:
+        merged = [_mergeWithModel(PositionModel, fileData) for fileData in workbook.values()]
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers, initializer=_initSheetWorker,
+                                 initargs=(PositionModel,)) as pool:
+            merged = list(pool.map(_mergeSheet, workbook.values()))
+    datasets = dict(zip(workbook, merged))
+
+    if outFile is not None:
+        with pd.ExcelWriter(outFile, engine='openpyxl') as writer:
+            for sht, df in datasets.items():
+                df.to_excel(writer, sheet_name=sht, index=False)
     print("Finished merging metabolomics data to model map!")
-    return df
+    return datasets
+
+def _removeArtifact(path):
+    # Stage outputs are appended to, so a rerun starts from an empty file
+    if os.path.exists(path):
+        os.remove(path)
+    return path
+
+
+def _pubchemStage(filename, sheet, outFile, bulk, cache, synonymIndex):
+    _removeArtifact(outFile)
+    queryPubChem(readDataset(filename, sheet), bulk=bulk, cache=cache, outFile=outFile, synonymIndex=synonymIndex)
+    return outFile
+
+
+def _metaboanalystStage(*upstream, filename, sheet, synmatch, cache, outFile, synonymIndex):
+    if synmatch is True:
+        queryMetaboAnalyst(filename, sheet, synmatch=True, cache=cache, pubchemFile=upstream[0],
+                           outFile=_removeArtifact(outFile), synonymIndex=synonymIndex)
+        return outFile
+    return queryMetaboAnalyst(filename, sheet, synmatch=False, cache=cache, synonymIndex=synonymIndex)
+
+
+def _matchStage(modelMap, data, synmatch, outFile):
+    if synmatch is True:
+        return matchModelAndData(None, modelMap, synmatch=True, queryFile=data, outFile=_removeArtifact(outFile))
+    return matchModelAndData(data, modelMap, synmatch=False)
+
+
+def _streamStage(modelMap, pubchemFile, bufferSize, cache, synonymIndex, outFile):
+    return streamSynonymMatches(modelMap, pubchemFile, outFile=outFile, bufferSize=bufferSize, cache=cache,
+                                synonymIndex=synonymIndex)
+
+
+def _positionStage(mergedModelDataMap, model):
+    mergedModelDataMap = mergedModelDataMap.rename(columns={'query': 'Query'})
+    return mapMetabolitePositionsInModel(mergedModelDataMap, model, outFile=None)
+
+
+def _finalStage(PositionModel, filename, sheet):
+    return constructFinalDataset(PositionModel, filename, sheet)
+
+
+def runPipeline(model, filename, sheet='Sheet1', workDir='~/Data/Mappings/ME1/pipeline', synmatch=False, bulk=True,
+                cache=True, synonymIndex=None, targets=None, force=(), stream=False, bufferSize=10000):
+    """
+    runPipeline runs the whole parser (model map -> PubChem synonyms -> MetaboAnalyst -> model matching -> model
+    positions -> final dataset) with a checkpoint after every stage. A stage is only rerun when its code, its
+    parameters, the model or data file, or an upstream stage has changed, so rerunning the same command after a crash
+    or a small change picks up where the last run stopped.
+
+    :param model:    A string denoting the path to the metabolic model
+    :param filename: A string denoting the path to the Excel file containing the metabolomics data
+    :param sheet:    A string denoting the tab name to read in
+    :param workDir:  A string denoting the directory checkpoints and intermediate .csv files are written to
+    :param synmatch: A boolean flag determining whether to perform PubChem synonym matching or not
+    :param bulk:     A boolean flag to query PubChem with the concurrent client (synmatch only)
+    :param cache:    A boolean flag to use the shared on-disk response cache
+    :param synonymIndex: An optional path to an offline synonym index tried before PubChem and MetaboAnalyst
+    :param targets:  A list of stage names to produce (default: 'final')
+    :param force:    A list of stage names to rerun even if their checkpoint is up to date
+    :param stream:   A boolean flag to map and match the PubChem synonyms in bounded-memory buffers (synmatch only, see
+                     streamSynonymMatches); the MetaboAnalyst and match stages become a single 'match' stage
+    :param bufferSize: An integer denoting the number of synonym rows per buffer (stream only)
+    :return:         A dictionary mapping each target stage to its result
+    """
+    from pipeline import Pipeline
+
+    # Every source file of the parser and of Python/Misc is part of each stage's fingerprint, so an edit to a function
+    # a stage calls (matchModelAndData, modelindex, utilities, ...) reruns it
+    here = os.path.dirname(os.path.abspath(__file__))
+    pipe = Pipeline(workDir, code=[here, os.path.join(here, os.pardir, 'Misc')])
+    pipe.add('modelMap', mapMetabolicModel, params={'model': model, 'outFile': None}, files=[model])
+
+    upstream = []
+    if synmatch is True:
+        pipe.add('pubchem', _pubchemStage,
+                 params={'filename': filename, 'sheet': sheet, 'bulk': bulk, 'cache': cache,
+                         'synonymIndex': synonymIndex, 'outFile': pipe.artifact('pubchem', '.csv')},
+                 files=[filename])
+        upstream = ['pubchem']
+    if synmatch is True and stream is True:
+        pipe.add('match', _streamStage, inputs=['modelMap', 'pubchem'],
+                 params={'bufferSize': bufferSize, 'cache': cache, 'synonymIndex': synonymIndex,
+                         'outFile': pipe.artifact('match', '.sqlite')})
+    else:
+        pipe.add('metaboanalyst', _metaboanalystStage, inputs=upstream,
+                 params={'filename': filename, 'sheet': sheet, 'synmatch': synmatch, 'cache': cache,
+                         'synonymIndex': synonymIndex, 'outFile': pipe.artifact('metaboanalyst', '.csv')},
+                 files=[filename])
+        pipe.add('match', _matchStage, inputs=['modelMap', 'metaboanalyst'],
+                 params={'synmatch': synmatch, 'outFile': pipe.artifact('match', '.csv')})
+    pipe.add('positions', _positionStage, inputs=['match'], params={'model': model}, files=[model])
+    pipe.add('final', _finalStage, inputs=['positions'], params={'filename': filename, 'sheet': sheet},
+             files=[filename])
+    return pipe.run(targets=targets or ['final'], force=force)
+
+
+def mapWorkbook(model, filename, outFile, sheet=None, workDir='~/Data/Mappings/ME1/pipeline', synmatch=False,
+                synonymIndex=None, force=(), stream=False, bufferSize=10000):
+    """
+    mapWorkbook maps a metabolomics workbook onto a metabolic model and writes the mapped data to an Excel file, with
+    the checkpoints of runPipeline. This is what the metabolomics-parser command runs.
+
+    :param model:    A string denoting the path to the metabolic model
+    :param filename: A string denoting the path to the Excel file containing the metabolomics data
+    :param outFile:  A string denoting the Excel file to write
+    :param sheet:    A string denoting the tab to map (default: every tab but the first, merged in parallel)
+    :param workDir:  A string denoting the directory checkpoints and intermediate .csv files are written to
+    :param synmatch: A boolean flag determining whether to perform PubChem synonym matching or not
+    :param synonymIndex: An optional path to an offline synonym index tried before PubChem and MetaboAnalyst
+    :param force:    A list of stage names to rerun even if their checkpoint is up to date
+    :param stream:   A boolean flag to stream the synonym matching in bounded-memory buffers (synmatch only)
+    :param bufferSize: An integer denoting the number of synonym rows per buffer (stream only)
+    """
+    if sheet:
+        df = runPipeline(model, filename, sheet, workDir=workDir, synmatch=synmatch, synonymIndex=synonymIndex,
+                         force=force, stream=stream, bufferSize=bufferSize)['final']
+        with pd.ExcelWriter(outFile, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name=sheet, index=False)
+    else:
+        # Map the model positions with the first data tab, then merge every data tab against them
+        from sheetcache import sheetNames
+        sheets = sheetNames(filename)[1:]
+        PositionModel = runPipeline(model, filename, sheets[0], workDir=workDir, synmatch=synmatch,
+                                    synonymIndex=synonymIndex, targets=['positions'], force=force, stream=stream,
+                                    bufferSize=bufferSize)['positions']
+        constructFinalDatasets(PositionModel, filename, sheets, outFile=outFile)
+
 
 if __name__=='__main__':
-    name = r'/home/scampit/Data/Expression/Metabolomics/ME1/raw/ME1_Metabolomics.xlsx'
-    model = r'/home/scampit/Data/CBM/MetabolicModels/RECON1/RECON1.xml'
-
-    # Create a spreadsheet that will save all of the data
-    from openpyxl import load_workbook
-    writer = pd.ExcelWriter(r'/home/scampit/Data/Expression/Metabolomics/ME1/processed/ME1_mapped_metabolomics.xlsx',
-                            engine='openpyxl')
-
-    xl = pd.ExcelFile(name)
-    sheetNames = xl.sheet_names
-    sheetNames = sheetNames[1:]
-
-    # Parts of the parser that will take a long time, especially if `synmatch` is True
-    #modelMap = mapMetabolicModel(model)
-    modelMap = pd.read_csv(r'~/Data/Mappings/ME1/RECON1_ID_Map.csv', dtype=str)
-    #data = queryMetaboAnalyst(filename=name, sheet=sheetNames[0], synmatch=True)
-    data = []
-    #data = pd.read_csv(r'/home/scampit/Data/Mappings/ME1/metaboanalyst_me1_query.csv')
-    #mergedModelDataMap = matchModelAndData(data, modelMap, synmatch=True)
-    mergedModelDataMap = pd.read_csv(r'~/Data/Mappings/ME1/metaboanalyst_recon1_map.csv')
-    PositionModel = mapMetabolitePositionsInModel(mergedModelDataMap, model)
-    #PositionModel = pd.read_csv(r'~/Data/Mappings/ME1/RECON1_position_map.csv', index_col='Query')
-    #df = constructFinalDataset(PositionModel, name, sheetNames[0])
-    #print(df)
-
-    # Save multiple sheets
-    #for sht in sheetNames:
-    #    df = constructFinalDataset(PositionModel, name, sht)
-    #    df.to_excel(writer, sheet_name=sht, index=False)
-    #writer.save()
+    # The command line lives in idmapping.cli, which parses arguments before anything heavy is imported
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from idmapping.cli import metabolomicsParser
+    metabolomicsParser(module=sys.modules[__name__])
@@ -0,0 +1,115 @@
+"""
+modelindex.py builds hash indexes from identifiers (ChEBI, KEGG, HMDB, ...) to the species of a metabolic model map.
+The indexes are built once per model and then probed with chunks of query results, so matching metabolomics data
+against the model costs O(model + data) instead of re-hashing the whole model map for every chunk. Identifier columns
+whose values are all `prefix + digits` are keyed on their integer local part (see utilities.compact_ids), so query
+values are parsed once and matched as int64 instead of as Python strings.
+
+@author: Scott Campit
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Misc'))
+from utilities import ID_FORMATS, compact_ids, expand_ids, parse_ids
+
+# Model map column -> MetaboAnalyst column that must agree for a data row to match a model species
+DEFAULT_KEYS = {'CHEBI': 'chebi_id', 'KEGG': 'kegg_id'}
+
+
+class KeyIndex:
+    """
+    KeyIndex maps one identifier column onto model species ids. Species ids for each identifier are stored
+    contiguously (CSR layout), and the identifier -> position lookup uses a unique pandas Index, whose hash table is
+    built on the first probe and reused for every later one.
+    """
+
+    def __init__(self, keys, species, prefix='', width=0):
+        """
+        :param keys:    An array of identifiers, one per model map row
+        :param species: An integer array of species ids, one per model map row
+        :param prefix:  A string denoting the namespace prefix in front of the digits of an identifier ('C' for KEGG)
+        :param width:   An integer denoting the zero-padded width of the digits
+        """
+        keys = compact_ids(pd.Series(keys), prefix, width)
+        self.prefix, self.width = prefix, width
+        self.numeric = pd.api.types.is_integer_dtype(keys.dtype)
+        valid = keys.notna().values
+        keys = keys[valid].astype('int64') if self.numeric else keys[valid].astype(str)
+        pairs = pd.DataFrame({'key': keys.values,
+                              'species': np.asarray(species)[valid]}).drop_duplicates()
+
+        codes, uniques = pd.factorize(pairs['key'])
+        order = np.argsort(codes, kind='mergesort')
+        self.keys = pd.Index(uniques)
+        self.species = pairs['species'].values[order]
+        self.counts = np.bincount(codes, minlength=len(uniques))
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def probe(self, values):
+        """
+        probe finds every (row, species) pair whose identifier appears in the index.
+
+        :param values: An array of identifiers to look up
+        :return:       A tuple of (row positions into `values`, species ids), both integer arrays
+        """
+        values = pd.Series(values)
+        if self.numeric:
+            # Values that do not parse get -1, which is never a key; parse_ids warns about them
+            values = parse_ids(values, self.prefix, warn=True).fillna(-1).astype('int64').values
+        else:
+            values = expand_ids(values, self.prefix, self.width).astype(object).astype(str).values
+        positions = self.keys.get_indexer(values)
+        rows = np.flatnonzero(positions >= 0)
+        positions = positions[rows]
+        counts = self.counts[positions]
+        offsets = np.repeat(self.starts[positions] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return np.repeat(rows, counts), self.species[offsets]
+
+
+class ModelIndex:
+    """
+    ModelIndex holds one KeyIndex per identifier column of a model map (see mapMetabolicModel). A data row matches a
+    model species when every identifier column in `keys` agrees.
+    """
+
+    def __init__(self, modelMap, keys=None):
+        """
+        :param modelMap: A Pandas dataframe with 'Metabolite', 'BIGG' and identifier columns
+        :param keys:     A dictionary mapping model map columns to the data columns they are matched against
+        """
+        self.keys = dict(DEFAULT_KEYS if keys is None else keys)
+        # A species is a distinct (Metabolite, BIGG) pair; the model map has one row per annotation
+        species = (modelMap['Metabolite'].astype(object).fillna('').astype(str) + '\t' +
+                   modelMap['BIGG'].astype(object).fillna('').astype(str))
+        codes, _ = pd.factorize(species)
+        _, first = np.unique(codes, return_index=True)
+        self.metabolites = modelMap['Metabolite'].values[first]
+        self.bigg = modelMap['BIGG'].values[first]
+        formats = dict(ID_FORMATS, **modelMap.attrs.get('id_formats', {}))
+        self.indexes = {col: KeyIndex(modelMap[col].values, codes, *formats.get(col, ('', 0))) for col in self.keys}
+
+    def match(self, data):
+        """
+        match joins query results against the model.
+
+        :param data: A Pandas dataframe with a 'query' column and the data columns named in `keys`
+        :return:     A Pandas dataframe with 'Metabolite', 'query', 'BIGG' and one column per model identifier
+        """
+        matched = None
+        for modelCol, dataCol in self.keys.items():
+            rows, species = self.indexes[modelCol].probe(data[dataCol].values)
+            part = pd.DataFrame({'query': data['query'].values[rows],
+                                 'species': species,
+                                 modelCol: data[dataCol].values[rows]})
+            matched = part if matched is None else pd.merge(matched, part, on=['query', 'species'])
+
+        matched = matched.dropna(subset=['query']).drop_duplicates()
+        matched['Metabolite'] = self.metabolites[matched['species'].values]
+        matched['BIGG'] = self.bigg[matched['species'].values]
+        # Merges of empty parts do not keep the column order, so it is set here
+        return matched[['Metabolite', 'query', 'BIGG'] + list(self.keys)].reset_index(drop=True)
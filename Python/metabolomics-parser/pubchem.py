@@ -0,0 +1,252 @@
+"""
+pubchem.py is a bulk client for the PubChem PUG-REST API. Metabolite names are resolved to substance IDs concurrently
+while respecting PubChem's request-per-second limit, and the substance records are then fetched in batches through
+the SID list endpoint.
+
+PubChem asks for no more than 5 requests per second, so the defaults below keep a few requests in flight and let the
+rate limiter decide the pace.
+
+@author: Scott Campit
+"""
+
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from cache import normalizeQuery
+from instrument import count
+from remote import RateLimiter, SingleFlight, TransientError, makeSession, requestWithRetry
+
+# PUBCHEM_URL points the client elsewhere, e.g. at a local stand-in (see standin.py)
+PUGREST = os.environ.get('PUBCHEM_URL', 'https://pubchem.ncbi.nlm.nih.gov/rest/pug')
+
+# Same columns (and order) as pubchempy.get_substances(..., as_dataframe=True)
+SUBSTANCE_COLUMNS = ['sid', 'source_id', 'source_name', 'standardized_cid', 'synonyms']
+
+# Columns of the synonym .csv written by queryPubChem, one row per (substance, synonym)
+SYNONYM_COLUMNS = ['sid', 'source_id', 'source_name', 'standardized_cid', 'Name', 'synonyms']
+
+# Shared by every client, so concurrent lookups of the same name (e.g. from several sheets) share one request
+_inflight = SingleFlight()
+
+
+def parseSubstance(record):
+    """
+    parseSubstance flattens a PC_Substances record into the fields pubchempy exposes on a Substance.
+
+    :param record: A dictionary from the 'PC_Substances' list of a PUG-REST JSON response
+    :return row:   A dictionary keyed by SUBSTANCE_COLUMNS
+    """
+    standardized = None
+    for compound in record.get('compound', []):
+        if compound['id']['type'] in (1, 'standardized'):
+            standardized = compound['id']['id']['cid']
+            break
+
+    db = record['source']['db']
+    return {'sid': record['sid']['id'],
+            'source_id': db['source_id']['str'],
+            'source_name': db['name'],
+            'standardized_cid': standardized,
+            'synonyms': record.get('synonyms', [])}
+
+
+def substanceRecord(substance):
+    """
+    substanceRecord turns a pubchempy Substance into the dictionary parseSubstance returns, so both clients share the
+    same cache entries.
+
+    :param substance: A pubchempy Substance
+    :return row:      A dictionary keyed by SUBSTANCE_COLUMNS
+    """
+    return {c: getattr(substance, c, None) for c in SUBSTANCE_COLUMNS}
+
+
+def iterSynonymRows(name, substances):
+    """
+    iterSynonymRows yields one row per synonym of each substance, using the synonym lists as returned by the API.
+    A substance without synonyms still yields one row (with an empty synonym) so the name is not lost.
+
+    :param name:       A string denoting the queried metabolite name
+    :param substances: An iterable of substance dictionaries (see parseSubstance) or pubchempy Substances
+    :return:           A generator of tuples ordered as SYNONYM_COLUMNS
+    """
+    for substance in substances:
+        if isinstance(substance, dict):
+            fields = [substance.get(c) for c in SUBSTANCE_COLUMNS]
+        else:
+            fields = [getattr(substance, c, None) for c in SUBSTANCE_COLUMNS]
+        sid, sourceId, sourceName, cid, synonyms = fields
+        for synonym in synonyms or [None]:
+            yield sid, sourceId, sourceName, cid, name, synonym
+
+
+class SynonymWriter:
+    """
+    SynonymWriter appends synonym rows to a .csv file in large buffered batches, writing the SYNONYM_COLUMNS header
+    when the file is created. Identifiers are written as integers and missing values as empty fields.
+    """
+
+    def __init__(self, path, batchSize=100000):
+        """
+        :param path:      A string denoting the .csv file to append to
+        :param batchSize: An integer denoting the number of rows buffered before they are written
+        """
+        path = os.path.expanduser(path)
+        header = not os.path.exists(path)
+        self.batchSize = batchSize
+        self.rows = 0
+        self._buffer = []
+        self._file = open(path, 'a', newline='', encoding='utf-8', buffering=1 << 20)
+        self._writer = csv.writer(self._file)
+        if header:
+            self._writer.writerow(SYNONYM_COLUMNS)
+
+    def writeRows(self, rows):
+        """
+        writeRows consumes an iterable of rows (e.g. from iterSynonymRows) without materializing it.
+        """
+        for row in rows:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batchSize:
+                self.flush()
+
+    def flush(self):
+        self._writer.writerows(self._buffer)
+        self.rows += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PubChemClient:
+    """
+    PubChemClient resolves metabolite names to PubChem substance records with a bounded number of requests in
+    flight. Transient failures are retried with backoff, and names that still fail are kept in `failed` instead of
+    being dropped silently.
+    """
+
+    def __init__(self, baseUrl=PUGREST, maxWorkers=5, rate=5, retries=5, batchSize=100, timeout=30, cache=None):
+        """
+        :param baseUrl:    A string denoting the PUG-REST root URL
+        :param maxWorkers: An integer denoting the number of requests kept in flight
+        :param rate:       An integer denoting the number of requests allowed per second
+        :param retries:    An integer denoting the number of retries for transient failures
+        :param batchSize:  An integer denoting the number of SIDs fetched per list request
+        :param timeout:    A float denoting the per-request timeout in seconds
+        :param cache:      An optional ResponseCache checked before going to the network
+        """
+        self.baseUrl = baseUrl.rstrip('/')
+        self.maxWorkers = maxWorkers
+        self.retries = retries
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = RateLimiter(rate=rate, period=1.0)
+        self.session = makeSession(poolSize=maxWorkers)
+        self.failed = []
+
+    def _get(self, method, path, **kwargs):
+        response = requestWithRetry(self.session, method, self.baseUrl + path,
+                                    limiter=self.limiter, retries=self.retries,
+                                    timeout=self.timeout, **kwargs)
+        # PUG-REST answers 404 (PUGREST.NotFound) when a name has no match
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def substanceIds(self, name):
+        """
+        substanceIds returns the SIDs that PubChem associates with a metabolite name.
+
+        :param name: A string denoting the metabolite name
+        :return:     A list of integer SIDs (empty if PubChem has no match)
+        """
+        return _inflight.do((self.baseUrl, 'substance/name', normalizeQuery(name)), self._substanceIds, name)
+
+    def _substanceIds(self, name):
+        result = self._get('GET', '/substance/name/%s/sids/JSON' % quote(name, safe=''))
+        if result is None:
+            return []
+        return result['IdentifierList']['SID']
+
+    def substanceRecords(self, sids):
+        """
+        substanceRecords fetches full substance records for a batch of SIDs in a single POST to the list endpoint.
+
+        :param sids: A list of integer SIDs
+        :return:     A list of dictionaries keyed by SUBSTANCE_COLUMNS
+        """
+        result = self._get('POST', '/substance/sid/JSON',
+                           data={'sid': ','.join(str(s) for s in sids)})
+        if result is None:
+            return []
+        return [parseSubstance(r) for r in result['PC_Substances']]
+
+    def _safeSubstanceIds(self, name):
+        try:
+            return self.substanceIds(name)
+        except (TransientError, IOError, ValueError) as err:
+            self.failed.append((name, str(err)))
+            count(failed_lookups=1)
+            return None
+
+    def _safeSubstanceRecords(self, sids):
+        try:
+            return self.substanceRecords(sids)
+        except (TransientError, IOError, ValueError) as err:
+            self.failed.append((sids, str(err)))
+            count(failed_lookups=1)
+            return []
+
+    def getSubstances(self, names):
+        """
+        getSubstances resolves every unique name to its substance records. Names are deduplicated after normalization,
+        names already in the cache are answered without touching the network, and fresh answers (including 'not
+        found') are written back to it.
+
+        :param names:  An iterable of metabolite names
+        :return:       A dictionary mapping each resolved name to a list of substance dictionaries
+        """
+        names = list(dict.fromkeys(names))
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.getMany('pubchem', 'substance/name', names)
+        # Names that only differ in case or spacing are looked up once and fanned back out below
+        missing = {}
+        for n in names:
+            if normalizeQuery(n) not in cached:
+                missing.setdefault(normalizeQuery(n), n)
+        missing = list(missing.values())
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            nameToSids = dict(zip(missing, pool.map(self._safeSubstanceIds, missing)))
+
+            allSids = list(dict.fromkeys(s for sids in nameToSids.values() if sids for s in sids))
+            batches = [allSids[i:i + self.batchSize] for i in range(0, len(allSids), self.batchSize)]
+            records = {}
+            for batch in pool.map(self._safeSubstanceRecords, batches):
+                for record in batch:
+                    records[record['sid']] = record
+
+        resolved = {name: [records[s] for s in sids if s in records]
+                    for name, sids in nameToSids.items() if sids is not None}
+        if self.cache is not None:
+            # Only cache names whose records all came back, so a failed batch is retried next run
+            self.cache.setMany('pubchem', 'substance/name',
+                               {name: recs for name, recs in resolved.items()
+                                if len(recs) == len(nameToSids[name])})
+
+        found = dict(cached)
+        found.update((normalizeQuery(name), recs) for name, recs in resolved.items())
+        return {name: found[normalizeQuery(name)] for name in names if found.get(normalizeQuery(name))}
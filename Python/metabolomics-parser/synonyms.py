@@ -0,0 +1,194 @@
+"""
+synonyms.py is an offline synonym index for metabolite names. It maps normalized synonyms to PubChem CIDs, and CIDs to
+ChEBI, KEGG and HMDB identifiers, in a SQLite database. The index is built from a PubChem CID-Synonym bulk file
+(https://ftp.ncbi.nlm.nih.gov/pubchem/Compound/Extras/CID-Synonym-filtered.gz) or from the synonym .csv files
+written by queryPubChem, and answers whole name lists locally so that only misses go to PubChem and MetaboAnalyst.
+
+PubChem lists database identifiers among the synonyms of a compound ('CHEBI:15422', 'HMDB0000538', 'C00002'), so the
+cross references come from the same file as the synonyms.
+
+@author: Scott Campit
+"""
+
+import gzip
+import os
+import re
+import sqlite3
+import sys
+
+import pandas as pd
+
+# Shared helpers live in Python/Misc (also needed when this file is run to build an index)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Misc'))
+from utilities import normalize_name
+
+DEFAULT_PATH = os.path.join(os.environ.get('UTILITIES_CACHE_DIR', os.path.expanduser('~/.cache/utilities')),
+                            'synonyms.sqlite')
+
+# Synonym patterns that are really database identifiers -> MetaboAnalyst column
+XREF_PATTERNS = [(re.compile(r'^CHEBI:(\d+)$'), 'chebi_id'),
+                 (re.compile(r'^(HMDB\d{5}(?:\d{2})?)$'), 'hmdb_id'),
+                 (re.compile(r'^(C\d{5})$'), 'kegg_id')]
+XREF_COLUMNS = ['hmdb_id', 'kegg_id', 'chebi_id']
+
+# Maximum number of bound parameters per statement in older SQLite builds
+_SQLITE_BATCH = 900
+_INSERT_BATCH = 100000
+
+
+def parseXref(synonym):
+    """
+    parseXref recognizes a synonym that is a ChEBI, HMDB or KEGG compound identifier.
+
+    :param synonym: A string denoting a raw (not normalized) synonym
+    :return:        A tuple of (MetaboAnalyst column, identifier), or None
+    """
+    for pattern, column in XREF_PATTERNS:
+        match = pattern.match(synonym)
+        if match:
+            return column, match.group(1)
+    return None
+
+
+class SynonymIndex:
+    """
+    SynonymIndex is an on-disk inverted index from normalized metabolite synonyms to PubChem CIDs and their
+    identifiers.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param path: A string denoting the path of the SQLite database file
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # Lookups may run in another thread, e.g. the prefetch thread of a streamed synonym match (see synstream.py)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS synonyms ('
+                           'synonym TEXT, cid INTEGER, PRIMARY KEY (synonym, cid)) WITHOUT ROWID')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS xrefs ('
+                           'cid INTEGER, namespace TEXT, identifier TEXT, '
+                           'PRIMARY KEY (cid, namespace, identifier)) WITHOUT ROWID')
+
+    def add(self, pairs):
+        """
+        add inserts (cid, raw synonym) pairs, committing in large batches.
+
+        :param pairs: An iterable of (cid, synonym) tuples
+        :return:      The number of pairs read
+        """
+        self._conn.execute('PRAGMA synchronous=OFF')
+        synonyms, xrefs, count = [], [], 0
+        for cid, synonym in pairs:
+            count += 1
+            synonyms.append((normalize_name(synonym), cid))
+            xref = parseXref(synonym)
+            if xref is not None:
+                xrefs.append((cid,) + xref)
+            if len(synonyms) >= _INSERT_BATCH:
+                self._flush(synonyms, xrefs)
+                synonyms, xrefs = [], []
+        self._flush(synonyms, xrefs)
+        self._conn.execute('PRAGMA synchronous=FULL')
+        return count
+
+    def _flush(self, synonyms, xrefs):
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO synonyms VALUES (?, ?)', synonyms)
+            self._conn.executemany('INSERT OR IGNORE INTO xrefs VALUES (?, ?, ?)', xrefs)
+
+    def addCidSynonymFile(self, path):
+        """
+        addCidSynonymFile loads a PubChem CID-Synonym file (tab separated 'cid<TAB>synonym' lines, optionally gzipped).
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(os.path.expanduser(path), 'rt', encoding='utf-8', errors='replace') as f:
+            return self.add((int(cid), synonym) for cid, _, synonym in
+                            (line.rstrip('\n').partition('\t') for line in f) if synonym)
+
+    def addQueryFile(self, path, chunksize=100000):
+        """
+        addQueryFile loads a synonym .csv written by queryPubChem. Both the queried name and every synonym of each
+        substance with a standardized CID are indexed.
+        """
+        count = 0
+        for chunk in pd.read_csv(path, usecols=['Name', 'standardized_cid', 'synonyms'], dtype=str,
+                                 chunksize=chunksize):
+            chunk = chunk[pd.to_numeric(chunk['standardized_cid'], errors='coerce').notna()]
+            cids = pd.to_numeric(chunk['standardized_cid']).astype('int64').tolist()
+            count += self.add((cid, name) for cid, name in zip(cids, chunk['Name']) if isinstance(name, str))
+            count += self.add((cid, syn.strip()) for cid, syn in zip(cids, chunk['synonyms'])
+                              if isinstance(syn, str) and syn.strip())
+        return count
+
+    def lookup(self, names, maxCids=5):
+        """
+        lookup resolves a list of names locally.
+
+        :param names:   An iterable of metabolite names
+        :param maxCids: An integer denoting the number of CIDs kept per name (lowest CIDs first)
+        :return:        A Pandas dataframe with the MetaboAnalyst 'query', 'pubchem_id', 'hmdb_id', 'kegg_id' and
+                        'chebi_id' columns, one row per (name, CID). Names that are not in the index are left out.
+        """
+        queries = {}
+        for name in dict.fromkeys(names):
+            queries.setdefault(normalize_name(name), []).append(name)
+        keys = list(queries)
+
+        rows = []
+        for i in range(0, len(keys), _SQLITE_BATCH):
+            batch = keys[i:i + _SQLITE_BATCH]
+            rows.extend(self._conn.execute(
+                'SELECT s.synonym, s.cid, x.namespace, MIN(x.identifier) FROM synonyms s '
+                'LEFT JOIN xrefs x ON x.cid = s.cid WHERE s.synonym IN (%s) '
+                'GROUP BY s.synonym, s.cid, x.namespace' % ','.join('?' * len(batch)), batch))
+
+        columns = ['query', 'pubchem_id'] + XREF_COLUMNS
+        if not rows:
+            return pd.DataFrame(columns=columns)
+        hits = pd.DataFrame(rows, columns=['synonym', 'pubchem_id', 'namespace', 'identifier'])
+        # CIDs without any cross reference come back with a NULL namespace; reindex drops that column
+        hits = hits.set_index(['synonym', 'pubchem_id', 'namespace'])['identifier'].unstack()
+        hits = hits.reindex(columns=XREF_COLUMNS).rename_axis(columns=None).reset_index()
+        hits = hits.sort_values(['synonym', 'pubchem_id']).groupby('synonym').head(maxCids)
+        hits['pubchem_id'] = hits['pubchem_id'].astype(str)
+        hits['query'] = hits['synonym'].map(queries)
+        return hits.explode('query')[columns].reset_index(drop=True)
+
+    def close(self):
+        self._conn.close()
+
+
+def resolveSynonymIndex(synonymIndex):
+    """
+    resolveSynonymIndex turns the `synonymIndex` argument of the parser functions into a SynonymIndex.
+
+    :param synonymIndex: None or False for no index, True for the index at DEFAULT_PATH, a path, or a SynonymIndex
+    :return:             A SynonymIndex, or None
+    """
+    if synonymIndex is None or synonymIndex is False:
+        return None
+    if synonymIndex is True:
+        return SynonymIndex()
+    if isinstance(synonymIndex, str):
+        return SynonymIndex(os.path.expanduser(synonymIndex))
+    return synonymIndex
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the offline metabolite synonym index.')
+    parser.add_argument('files', nargs='+', help='PubChem CID-Synonym files (.gz or plain) or queryPubChem .csv files')
+    parser.add_argument('--index', default=DEFAULT_PATH, help='SQLite index to add to')
+    args = parser.parse_args()
+
+    index = SynonymIndex(args.index)
+    for path in args.files:
+        if path.endswith('.csv'):
+            count = index.addQueryFile(path)
+        else:
+            count = index.addCidSynonymFile(path)
+        print('Indexed %d synonyms from %s' % (count, path))
+    index.close()
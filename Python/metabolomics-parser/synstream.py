@@ -0,0 +1,169 @@
+"""
+synstream.py runs synonym matching as a stream. The synonym .csv written by queryPubChem is read `bufferSize` rows at a
+time, and each buffer is normalized, mapped with MetaboAnalyst and joined against the model before it is dropped, so
+peak memory is set by the buffer size instead of by the number of synonyms. Reading and mapping run in a background
+thread at most `prefetch` buffers ahead of the join; the bounded queue between them is the backpressure. Matches go to
+a single SQLite file whose columns have a fixed order and type, and duplicates are dropped there rather than in memory.
+
+@author: Scott Campit
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+import threading
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Misc'))
+from utilities import expand_ids, normalize_names, parse_ids
+
+
+def iterSynonymPairs(path, bufferSize=10000):
+    """
+    iterSynonymPairs reads a synonym .csv (see pubchem.SYNONYM_COLUMNS) `bufferSize` rows at a time. Every row gives
+    two names to look up for the metabolite it was found for: the metabolite name itself and the synonym.
+
+    :param path:       A string denoting the .csv file written by queryPubChem
+    :param bufferSize: An integer denoting the number of rows read at a time
+    :return:           A generator of Pandas dataframes with the normalized 'query' (the metabolite name of the data)
+                       and 'name' (the name to look up), one row per distinct pair of the buffer
+    """
+    for chunk in pd.read_csv(os.path.expanduser(path), usecols=['Name', 'synonyms'], dtype=str,
+                             chunksize=int(bufferSize)):
+        query = normalize_names(chunk['Name'])
+        pairs = pd.DataFrame({'query': pd.concat([query, query], ignore_index=True),
+                              'name': pd.concat([query, normalize_names(chunk['synonyms'])], ignore_index=True)})
+        pairs = pairs[pairs['query'].fillna('').ne('') & pairs['name'].fillna('').ne('')]
+        yield pairs.drop_duplicates().reset_index(drop=True)
+
+
+def prefetch(iterable, depth=1):
+    """
+    prefetch iterates over `iterable` in a background thread, keeping at most `depth` items ready for the consumer.
+    The producer blocks while the queue is full, errors are re-raised in the consumer, and a consumer that stops early
+    stops the producer too.
+
+    :param iterable: An iterable
+    :param depth:    An integer denoting the number of items produced ahead of the consumer
+    :return:         A generator of the items of `iterable`
+    """
+    items = queue.Queue(maxsize=max(int(depth), 1))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as err:
+            put((done, err))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if err is not None:
+                raise err
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class MatchStore:
+    """
+    MatchStore is the output of a streamed synonym match: one SQLite 'matches' table with a column per model key.
+    Keys the model index matches as integers (see modelindex.KeyIndex) are stored as INTEGER, the others as TEXT,
+    so every buffer writes the same columns with the same types. A (query, Metabolite, BIGG) match is kept once.
+    """
+
+    def __init__(self, path, index):
+        """
+        :param path:  A string denoting the SQLite file to write (replaced if it exists)
+        :param index: The modelindex.ModelIndex the matches come from
+        """
+        self.path = os.path.expanduser(path)
+        self.keys = {col: index.indexes[col] for col in index.keys}
+        self.columns = ['Metabolite', 'query', 'BIGG'] + list(self.keys)
+        self.rows = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        types = ['TEXT', 'TEXT', 'TEXT'] + ['INTEGER' if key.numeric else 'TEXT' for key in self.keys.values()]
+        self._conn.execute('CREATE TABLE matches (%s, UNIQUE (query, Metabolite, BIGG))'
+                           % ', '.join('"%s" %s' % (c, t) for c, t in zip(self.columns, types)))
+        self._conn.execute('CREATE TABLE formats (col TEXT PRIMARY KEY, prefix TEXT, width INTEGER)')
+        self._conn.executemany('INSERT INTO formats VALUES (?, ?, ?)',
+                               [(col, key.prefix, key.width) for col, key in self.keys.items() if key.numeric])
+
+    def write(self, matches):
+        """
+        write adds the output of ModelIndex.match for one buffer.
+
+        :param matches: A Pandas dataframe with 'Metabolite', 'query', 'BIGG' and the model key columns
+        :return:        The number of new matches
+        """
+        columns = [matches[col].astype(object).astype(str).tolist() for col in ('Metabolite', 'query', 'BIGG')]
+        for col, key in self.keys.items():
+            if key.numeric:
+                # sqlite3 stores numpy integers as blobs
+                columns.append([None if pd.isna(v) else int(v) for v in parse_ids(matches[col], key.prefix)])
+            else:
+                columns.append(expand_ids(pd.Series(matches[col]), key.prefix, key.width).tolist())
+        rows = [tuple(None if pd.isna(v) else v for v in row) for row in zip(*columns)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR IGNORE INTO matches VALUES (%s)' % ','.join('?' * len(self.columns)),
+                                   rows)
+            self._conn.execute('COMMIT')
+            added = self._conn.total_changes - before
+        self.rows += added
+        return added
+
+    def read(self):
+        """
+        read loads the matches, with integer keys as nullable integers whose formats are kept in
+        `attrs['id_formats']` (see utilities.expand_frame).
+
+        :return: A Pandas dataframe with the columns of ModelIndex.match
+        """
+        with self._lock:
+            df = pd.read_sql_query('SELECT %s FROM matches ORDER BY rowid'
+                                   % ', '.join('"%s"' % c for c in self.columns), self._conn)
+            formats = {col: (prefix, width)
+                       for col, prefix, width in self._conn.execute('SELECT col, prefix, width FROM formats')}
+        for col in formats:
+            df[col] = df[col].astype('Int64')
+        df.attrs['id_formats'] = formats
+        return df
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,179 @@
+"""
+benchParserStages.py times and memory-profiles every stage of metabolomics-parser.py, plus the sep_object and
+convert_to_string helpers, on synthetic models and workbooks (see synthetic.py). It needs pytest-benchmark and makes no
+network requests: the PubChem/MetaboAnalyst stages are measured through the offline synonym index.
+
+    pytest test/benchParserStages.py --benchmark-autosave
+    pytest test/benchParserStages.py --benchmark-compare --benchmark-compare-fail=mean:15%
+
+The first command stores a baseline under .benchmarks/, the second fails when a stage got more than 15% slower.
+BENCH_MODELS picks the model sizes from synthetic.SIZES (default 'recon1,recon3d'; add 'recon3d-10x' for the large
+run) and BENCH_ROWS the rows per workbook sheet. The peak memory traced by tracemalloc during one extra call of each
+stage is saved with its result as extra_info['peak_mb'].
+
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# Keep the model, sheet and response caches of the benchmarks away from the real ones (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='bench-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+from modelcache import ModelCache
+from sheetcache import SheetCache
+from synonyms import SynonymIndex
+from synthetic import SIZES, metaboanalystResults, metaboliteName, writeModel, writeWorkbook
+from utilities import convert_to_string, normalize_names, sep_object
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import metabolomics_parser as parser
+
+MODELS = os.environ.get('BENCH_MODELS', 'recon1,recon3d').split(',')
+ROWS = int(os.environ.get('BENCH_ROWS', 2000))
+ROUNDS = 5
+
+
+def measure(benchmark, func, makeArgs=tuple, rounds=ROUNDS):
+    """
+    measure records the peak traced memory of one call to `func`, then benchmarks it. `makeArgs` builds fresh
+    arguments for every call (outside the timed region) for stages that modify or consume their inputs.
+    """
+    args = makeArgs()
+    tracemalloc.start()
+    try:
+        func(*args)
+        benchmark.extra_info['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    return benchmark.pedantic(func, setup=lambda: (makeArgs(), {}), rounds=rounds)
+
+
+@pytest.fixture(scope='module', params=MODELS)
+def inputs(request, tmp_path_factory):
+    """
+    inputs writes one synthetic model and workbook and runs the pipeline once, so each benchmark starts from the
+    output of the stage before it.
+    """
+    species = SIZES[request.param]
+    tmp = tmp_path_factory.mktemp(request.param)
+    model = writeModel(str(tmp / 'model.xml'), species)
+    workbook = str(tmp / 'data.xlsx')
+    sheets = writeWorkbook(workbook, species, rows=ROWS)
+
+    data = parser.readDataset(workbook, sheets[0])
+    names = normalize_names(sep_object(data, 'Compound Method', '/')['Compound Method']).unique()
+    results = metaboanalystResults(names, species)
+    modelMap = parser.mapMetabolicModel(model, outFile=None)
+    merged = parser.matchModelAndData(results, modelMap, synmatch=False).rename(columns={'query': 'Query'})
+    positions = parser.mapMetabolitePositionsInModel(merged.copy(), model, outFile=None)
+
+    index = SynonymIndex(str(tmp / 'synonyms.sqlite'))
+    bases = species // 3
+    index.add((100000 + b, metaboliteName(b)) for b in range(bases))
+    index.add((900000 + b, 'Unknown compound %d' % b) for b in range(10 * bases))
+
+    return {'tmp': tmp, 'species': species, 'model': model, 'workbook': workbook, 'sheets': sheets, 'data': data,
+            'names': names, 'results': results, 'modelMap': modelMap, 'merged': merged, 'positions': positions,
+            'index': index}
+
+
+def _freshDir(tmp, prefix):
+    return (str(tempfile.mkdtemp(prefix=prefix, dir=str(tmp))),)
+
+
+def test_read_sheet_cold(benchmark, inputs):
+    def read(cacheDir):
+        return SheetCache(cacheDir).read(inputs['workbook'], inputs['sheets'][0])
+    measure(benchmark, read, lambda: _freshDir(inputs['tmp'], 'sheets-'), rounds=2)
+
+
+def test_read_sheet_warm(benchmark, inputs):
+    measure(benchmark, parser.readDataset, lambda: (inputs['workbook'], inputs['sheets'][0], ['Compound Method']))
+
+
+def test_compile_model_cold(benchmark, inputs):
+    def compile(cacheDir):
+        return ModelCache(cacheDir).load(inputs['model'])
+    measure(benchmark, compile, lambda: _freshDir(inputs['tmp'], 'models-'))
+
+
+def test_map_metabolic_model_stream(benchmark, inputs):
+    measure(benchmark, parser.mapMetabolicModel, lambda: (inputs['model'], True, False, None))
+
+
+def test_map_metabolic_model_cached(benchmark, inputs):
+    measure(benchmark, parser.mapMetabolicModel, lambda: (inputs['model'], True, True, None))
+
+
+def test_sep_object(benchmark, inputs):
+    measure(benchmark, sep_object, lambda: (inputs['data'], 'Compound Method', '/'))
+
+
+def test_normalize_names(benchmark, inputs):
+    names = sep_object(inputs['data'], 'Compound Method', '/')['Compound Method']
+    measure(benchmark, normalize_names, lambda: (names,))
+
+
+def test_map_compounds_synonym_index(benchmark, inputs):
+    measure(benchmark, parser.mapCompounds, lambda: (inputs['names'], False, 500, 4, inputs['index']))
+
+
+def test_match_model_and_data(benchmark, inputs):
+    measure(benchmark, parser.matchModelAndData, lambda: (inputs['results'], inputs['modelMap'], False))
+
+
+def test_match_model_and_data_synmatch(benchmark, inputs):
+    queryFile = str(inputs['tmp'] / 'metaboanalyst.csv')
+    inputs['results'].to_csv(queryFile, index=False)
+
+    def makeArgs():
+        outFile = str(inputs['tmp'] / 'matches.csv')
+        if os.path.exists(outFile):
+            os.remove(outFile)
+        return inputs['results'], inputs['modelMap'], True, 100000, queryFile, outFile
+    measure(benchmark, parser.matchModelAndData, makeArgs)
+
+
+def test_stream_synonym_matches(benchmark, inputs):
+    # Every name with its upper-cased spelling as a synonym, resolved through the offline synonym index
+    names = pd.Series(inputs['names'])
+    pubchemFile = str(inputs['tmp'] / 'pubchem.csv')
+    pd.DataFrame({'sid': range(len(names)), 'source_id': '', 'source_name': '', 'standardized_cid': '',
+                  'Name': names, 'synonyms': names.str.upper()}).to_csv(pubchemFile, index=False)
+    measure(benchmark, parser.streamSynonymMatches,
+            lambda: (inputs['modelMap'], pubchemFile, str(inputs['tmp'] / 'matches.sqlite'), 1000, 1, False,
+                     inputs['index']))
+
+
+def test_map_metabolite_positions(benchmark, inputs):
+    measure(benchmark, parser.mapMetabolitePositionsInModel,
+            lambda: (inputs['merged'].copy(), inputs['model'], True, True, None))
+
+
+def test_construct_final_dataset(benchmark, inputs):
+    measure(benchmark, parser.constructFinalDataset,
+            lambda: (inputs['positions'].copy(), inputs['workbook'], inputs['sheets'][0]))
+
+
+def test_construct_final_datasets(benchmark, inputs):
+    measure(benchmark, parser.constructFinalDatasets,
+            lambda: (inputs['positions'].copy(), inputs['workbook'], inputs['sheets']), rounds=2)
+
+
+def test_convert_to_string(benchmark, inputs):
+    rng = np.random.default_rng(0)
+    values = rng.integers(1, 10 ** 6, size=ROWS * 50).astype(float)
+    values[rng.random(len(values)) < 0.3] = np.nan
+    measure(benchmark, convert_to_string, lambda: (pd.DataFrame({'chebi_id': values}), 'chebi_id'))
@@ -0,0 +1,7 @@
+"""
+conftest.py keeps the scripts that query the live PubChem and MetaboAnalyst APIs out of test collection; run them
+directly (python testPubChemAPI.py), optionally against a local stand-in (see Misc/standin.py).
+@author: Scott Campit
+"""
+
+collect_ignore = ['testMetaboAnalystAPI.py', 'testPubChemAPI.py']
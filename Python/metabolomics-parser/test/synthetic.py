@@ -0,0 +1,159 @@
+"""
+synthetic.py generates inputs for the benchmarks in benchParserStages.py: SBML models with identifiers.org
+annotations at genome-scale sizes, metabolomics workbooks whose 'Compound Method' names are '/'-joined, and the
+MetaboAnalyst results those names would map to. Everything is seeded, so repeated runs benchmark identical inputs.
+
+@author: Scott Campit
+"""
+
+import numpy as np
+import pandas as pd
+
+# Model name -> number of species
+SIZES = {'recon1': 3742, 'recon3d': 8399, 'recon3d-10x': 83990}
+
+COMPARTMENTS = ['c', 'm', 'e', 'x', 'r', 'l', 'n', 'g', 'i']
+
+_SPECIES = ('<species id="M_{id}" metaid="M_{id}" name="{name}" compartment="{comp}">'
+            '<annotation><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+            'xmlns:bqbiol="http://biomodels.net/biology-qualifiers/"><rdf:Description rdf:about="#M_{id}">'
+            '<bqbiol:is><rdf:Bag>{items}</rdf:Bag></bqbiol:is></rdf:Description></rdf:RDF></annotation></species>\n')
+_ITEM = '<rdf:li rdf:resource="http://identifiers.org/{0}"/>'
+_REACTION = ('<reaction id="R_rxn{id}" reversible="false" fast="false">'
+             '<annotation><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+             'xmlns:bqbiol="http://biomodels.net/biology-qualifiers/"><rdf:Description rdf:about="#R_rxn{id}">'
+             '<bqbiol:is><rdf:Bag><rdf:li rdf:resource="http://identifiers.org/bigg.reaction/rxn{id}"/>'
+             '<rdf:li rdf:resource="http://identifiers.org/ec-code/1.1.1.{ec}"/></rdf:Bag></bqbiol:is>'
+             '</rdf:Description></rdf:RDF></annotation>'
+             '<listOfReactants><speciesReference species="M_{a}" stoichiometry="1" constant="true"/></listOfReactants>'
+             '<listOfProducts><speciesReference species="M_{b}" stoichiometry="1" constant="true"/></listOfProducts>'
+             '<fbc:geneProductAssociation><fbc:geneProductRef fbc:geneProduct="G_{gene}_AT1"/>'
+             '</fbc:geneProductAssociation></reaction>\n')
+
+
+def metaboliteName(base):
+    """
+    metaboliteName returns the name of the base metabolite `base` (shared by all of its compartments).
+    """
+    return 'Metabolite %d' % base
+
+
+def _bases(species):
+    # Each base metabolite appears in three compartments, like most metabolites of genome-scale models
+    positions = np.arange(species)
+    bases = positions // 3
+    return bases, np.array(COMPARTMENTS)[(positions % 3 + bases) % len(COMPARTMENTS)]
+
+
+def writeModel(path, species=SIZES['recon1'], annotated=0.8, genes=None, reactions=None, seed=0):
+    """
+    writeModel writes an SBML Level 3 FBC model with `species` species, `reactions` annotated reactions and `genes`
+    gene products. A fraction `annotated` of the base metabolites carries ChEBI, KEGG, HMDB, BiGG and PubChem
+    annotations. The reactions sit between the species and the gene products, as in cobrapy-written models, so that
+    streaming parsers have to skip them.
+
+    :param path:      A string denoting the .xml file to write
+    :param species:   An integer denoting the number of species
+    :param annotated: A float denoting the fraction of annotated base metabolites
+    :param genes:     An integer denoting the number of gene products (species / 2 by default)
+    :param reactions: An integer denoting the number of reactions (2 * species by default, as in Recon models)
+    :param seed:      An integer seed
+    :return:          The path
+    """
+    rng = np.random.default_rng(seed)
+    bases, comps = _bases(species)
+    hasAnnotation = rng.random(bases.max() + 1) < annotated
+    genes = species // 2 if genes is None else genes
+    reactions = 2 * species if reactions is None else reactions
+    ids = ['met%d_%s' % (base, comp) for base, comp in zip(bases.tolist(), comps.tolist())]
+
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" '
+                'xmlns:fbc="http://www.sbml.org/sbml/level3/version1/fbc/version2" level="3" version="1">\n'
+                '<model id="synthetic">\n<listOfSpecies>\n')
+        for base, comp in zip(bases.tolist(), comps.tolist()):
+            items = ''
+            if hasAnnotation[base]:
+                items = ''.join(_ITEM.format(uri) for uri in (
+                    'chebi/CHEBI:%d' % (10000 + base), 'kegg.compound/C%05d' % (base % 100000),
+                    'hmdb/HMDB%07d' % base, 'bigg.metabolite/met%d' % base,
+                    'pubchem.compound/%d' % (100000 + base)))
+            f.write(_SPECIES.format(id='met%d_%s' % (base, comp), name=metaboliteName(base), comp=comp, items=items))
+        f.write('</listOfSpecies>\n<listOfReactions>\n')
+        for reaction, (a, b) in enumerate(rng.integers(species, size=(reactions, 2)).tolist()):
+            f.write(_REACTION.format(id=reaction, ec=reaction % 100, a=ids[a], b=ids[b],
+                                     gene=reaction % max(genes, 1)))
+        f.write('</listOfReactions>\n<fbc:listOfGeneProducts>\n')
+        for gene in range(genes):
+            f.write('<fbc:geneProduct fbc:id="G_%d_AT1" fbc:label="%d_AT1"/>\n' % (gene, gene))
+        f.write('</fbc:listOfGeneProducts>\n</model>\n</sbml>\n')
+    return path
+
+
+def compoundNames(species, rows, hits=0.7, seed=0):
+    """
+    compoundNames returns `rows` 'Compound Method' values of one to three '/'-joined names. A fraction `hits` of the
+    names are metabolites of a model with `species` species, written with the case and spacing noise of real sheets.
+
+    :return: A list of strings
+    """
+    rng = np.random.default_rng(seed)
+    nBases = max(species // 3, 1)
+    names = []
+    for count in rng.integers(1, 4, size=rows):
+        parts = []
+        for _ in range(count):
+            if rng.random() < hits:
+                name = metaboliteName(int(rng.integers(nBases)))
+                name = name.upper() if rng.random() < 0.2 else name
+            else:
+                name = 'Unknown compound %d' % rng.integers(10 * nBases)
+            parts.append(name + ' ' * int(rng.integers(2)))
+        names.append('/'.join(parts))
+    return names
+
+
+def writeWorkbook(path, species=SIZES['recon1'], sheets=3, rows=1000, samples=12, seed=0):
+    """
+    writeWorkbook writes a metabolomics workbook: a leading 'Info' sheet followed by `sheets` data sheets, each with a
+    'Compound Method' column and `samples` intensity columns.
+
+    :return: A list of the data sheet names
+    """
+    rng = np.random.default_rng(seed)
+    names = []
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'Study': ['synthetic'], 'Rows': [rows]}).to_excel(writer, sheet_name='Info', index=False)
+        for sheet in range(sheets):
+            name = 'Sheet%d' % (sheet + 1)
+            data = pd.DataFrame(rng.lognormal(10, 1, size=(rows, samples)),
+                                columns=['Sample %d' % (i + 1) for i in range(samples)])
+            data.insert(0, 'Compound Method', compoundNames(species, rows, seed=seed + sheet))
+            data.to_excel(writer, sheet_name=name, index=False)
+            names.append(name)
+    return names
+
+
+def metaboanalystResults(names, species=SIZES['recon1'], hits=0.8, seed=0):
+    """
+    metaboanalystResults returns what mapCompounds would return for `names`: a fraction `hits` of the synthetic
+    metabolite names get the identifiers writeModel annotates them with, and the rest get '-' placeholders.
+
+    :return: A Pandas dataframe of strings with 'query' and the MetaboAnalyst identifier columns
+    """
+    rng = np.random.default_rng(seed)
+    bases = pd.Series(list(names), dtype=object).str.extract(r'(?i)^metabolite (\d+)$', expand=False)
+    bases = pd.to_numeric(bases, errors='coerce')
+    found = (bases.notna() & (bases < species // 3) & (rng.random(len(bases)) < hits)).values
+    bases = bases.fillna(0).astype('int64').values
+
+    def column(values):
+        return np.where(found, values.astype(str), '-')
+
+    return pd.DataFrame({'query': list(names),
+                         'hmdb_id': np.where(found, ['HMDB%07d' % b for b in bases], '-'),
+                         'kegg_id': np.where(found, ['C%05d' % (b % 100000) for b in bases], '-'),
+                         'pubchem_id': column(100000 + bases),
+                         'chebi_id': column(10000 + bases),
+                         'metlin_id': '-'})
@@ -0,0 +1,38 @@
+"""
+testCache.py checks the size limit of the SQLite response cache in Python/Misc/cache.py.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+# Keep the response cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+from cache import ResponseCache
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """
+    test_cache_evicts_least_recently_used checks that writes past maxEntries evict the entries read least recently,
+    that replacing an entry does not evict anything, and that a reopened cache starts from the rows on disk.
+    """
+    path = str(tmp_path / 'responses.sqlite')
+    cache = ResponseCache(path, maxEntries=3)
+    cache.setMany('pubchem', 'substance/name', {'glucose': [1], 'atp': [2], 'citrate': [3]})
+    for _ in range(5):
+        cache.set('pubchem', 'substance/name', 'ATP', [2])
+    assert len(cache.getMany('pubchem', 'substance/name', ['glucose', 'atp', 'citrate'])) == 3
+
+    cache.get('pubchem', 'substance/name', 'glucose')
+    cache.set('pubchem', 'substance/name', 'pyruvate', [4])
+    kept = cache.getMany('pubchem', 'substance/name', ['glucose', 'atp', 'citrate', 'pyruvate'])
+    assert len(kept) == 3 and 'glucose' in kept and 'pyruvate' in kept
+    cache.close()
+
+    reopened = ResponseCache(path, maxEntries=3)
+    reopened.set('pubchem', 'substance/name', 'lactate', [5])
+    assert len(reopened.getMany('pubchem', 'substance/name', ['glucose', 'atp', 'citrate', 'pyruvate',
+                                                              'lactate'])) == 3
@@ -0,0 +1,100 @@
+"""
+testCli.py checks that the console commands only stamp their outputs as up to date when no remote lookup failed.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+# Keep the command stamps and caches of the tests away from the real ones (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import cli
+
+
+def fakeParser(failures, calls):
+    """
+    fakeParser stands in for metabolomics_parser: mapWorkbook writes the output and reports `failures.pop(0)` failed
+    lookups.
+    """
+    def mapWorkbook(model, filename, outFile, **kwargs):
+        import instrument
+        calls.append(outFile)
+        with open(outFile, 'w') as f:
+            f.write('mapped')
+        instrument.count(failed_lookups=failures.pop(0))
+    return SimpleNamespace(mapWorkbook=mapWorkbook)
+
+
+def test_metabolomics_parser_retries_failed_lookups(tmp_path):
+    """
+    test_metabolomics_parser_retries_failed_lookups checks that a run with failed lookups exits non-zero and is rerun
+    by the same command, and that a clean run is then up to date.
+    """
+    model, data = str(tmp_path / 'model.xml'), str(tmp_path / 'data.xlsx')
+    for path in (model, data):
+        with open(path, 'w') as f:
+            f.write(path)
+    argv = [model, data, 'Sheet1', '--workdir', str(tmp_path / 'work'), '--output', str(tmp_path / 'out.xlsx')]
+    failures, calls = [3, 0], []
+    module = fakeParser(failures, calls)
+
+    with pytest.raises(SystemExit) as excinfo:
+        cli.metabolomicsParser(argv, module=module)
+    assert excinfo.value.code != 0
+    assert not os.path.exists(str(tmp_path / 'work' / 'command.json'))
+
+    cli.metabolomicsParser(argv, module=module)
+    cli.metabolomicsParser(argv, module=module)
+    assert len(calls) == 2
+
+
+def test_identifier_mapper_retries_failed_chunks(tmp_path, monkeypatch):
+    """
+    test_identifier_mapper_retries_failed_chunks checks that a bulk mapping with a failed MyGene chunk exits non-zero,
+    that the same command then posts the chunk again, and that the finished map is up to date.
+    """
+    pytest.importorskip('openpyxl')
+    pytest.importorskip('requests')
+    sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+    sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'identifier-mapper'))
+    import mygeneclient
+    from remote import TransientError
+    from standin import StandInServer
+
+    source, output = str(tmp_path / 'genes.xlsx'), str(tmp_path / 'genes.csv')
+    pd.DataFrame({'Gene symbol': ['HIST1H4A', 'H3F3A', 'NOTAGENE']}).to_excel(source, sheet_name='Genes',
+                                                                               index=False)
+    posted = []
+    queryChunk = mygeneclient.MyGeneClient.queryChunk
+
+    def failFirstChunk(self, ids, scopes, fields, species):
+        posted.append(list(ids))
+        if len(posted) == 1:
+            raise TransientError('HTTP 503')
+        return queryChunk(self, ids, scopes, fields, species)
+
+    monkeypatch.setattr(mygeneclient.MyGeneClient, 'queryChunk', failFirstChunk)
+    with StandInServer(str(tmp_path / 'standin.sqlite')) as server:
+        server.recordMyGene('symbol', 'symbol,entrezgene', 'human',
+                            [{'query': 'HIST1H4A', '_id': '8359', 'symbol': 'H4C1', 'entrezgene': 8359},
+                             {'query': 'H3F3A', '_id': '3020', 'symbol': 'H3-3A', 'entrezgene': 3020}])
+        argv = [source, output, '--bulk', '--fields', 'symbol', 'entrezgene', '--base-url', server.serviceUrl('mygene')]
+
+        with pytest.raises(SystemExit) as excinfo:
+            cli.identifierMapper(argv)
+        assert excinfo.value.code != 0
+        assert '1 remote lookups failed' in str(excinfo.value.code)
+
+        cli.identifierMapper(argv)
+        cli.identifierMapper(argv)
+    assert posted == [['HIST1H4A', 'H3F3A', 'NOTAGENE']] * 2
+    assert pd.read_csv(output, index_col='query')['entrezgene'].dropna().astype(int).to_dict() == \
+        {'HIST1H4A': 8359, 'H3F3A': 3020}
@@ -0,0 +1,133 @@
+"""
+testGeneDb.py checks the importers of the local gene database in Python/identifier-mapper/genedb.py and that its
+lookups have the shape of MyGeneInfo.querymany(..., as_dataframe=True).
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Keep the gene database of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'identifier-mapper'))
+from genedb import GeneDatabase
+
+GENE_INFO = [
+    ['#tax_id', 'GeneID', 'Symbol', 'Synonyms', 'dbXrefs', 'description', 'type_of_gene'],
+    ['9606', '7157', 'TP53', 'BCC7|LFS1', 'MIM:191170|HGNC:HGNC:11998|Ensembl:ENSG00000141510', 'tumor protein p53',
+     'protein-coding'],
+    ['9606', '1956', 'EGFR', 'ERBB|ERBB1', 'MIM:131550|HGNC:HGNC:3236|Ensembl:ENSG00000146648',
+     'epidermal growth factor receptor', 'protein-coding'],
+    ['10090', '22059', 'Trp53', 'p53', 'MGI:MGI:98834|Ensembl:ENSMUSG00000059552', 'transformation related protein 53',
+     'protein-coding'],
+]
+
+GENE2ENSEMBL = [
+    ['#tax_id', 'GeneID', 'Ensembl_gene_identifier', 'RNA_nucleotide_accession.version', 'Ensembl_rna_identifier',
+     'protein_accession.version', 'Ensembl_protein_identifier'],
+    ['9606', '7157', 'ENSG00000141510', 'NM_000546.6', 'ENST00000269305.9', 'NP_000537.3', 'ENSP00000269305.4'],
+    ['9606', '7157', 'ENSG00000141510', 'NM_001126112.3', 'ENST00000445888.6', 'NP_001119584.1',
+     'ENSP00000391478.2'],
+    ['9606', '1956', 'ENSG00000146648', 'NM_005228.5', 'ENST00000275493.7', 'NP_005219.2', 'ENSP00000275493.2'],
+]
+
+HGNC = [
+    ['hgnc_id', 'symbol', 'entrez_id', 'ensembl_gene_id', 'uniprot_ids', 'alias_symbol', 'prev_symbol', 'omim_id',
+     'enzyme_id'],
+    ['HGNC:11998', 'TP53', '7157', 'ENSG00000141510', 'P04637', 'p53|LFS1', '', '191170', ''],
+    ['HGNC:3236', 'EGFR', '1956', 'ENSG00000146648', 'P00533', 'ERBB|ERBB1|HER1', 'ERBB', '131550', '2.7.10.1'],
+    ['HGNC:99999', 'WITHDRAWN1', '', '', '', '', '', '', ''],
+]
+
+UNIPROT = [
+    ['P04637', 'GeneID', '7157'],
+    ['P04637', 'KEGG', 'hsa:7157'],
+    ['P04637', 'PDB', '1A1U'],
+    ['P00533', 'GeneID', '1956'],
+    ['P00533', 'KEGG', 'hsa:1956'],
+    ['P00533', 'Reactome', 'R-HSA-177929'],
+    ['P00533', 'STRING', '9606.ENSP00000275493'],
+]
+
+
+def writeTable(path, rows):
+    path.write_text(''.join('\t'.join(row) + '\n' for row in rows))
+    return str(path)
+
+
+def loadDatabase(tmp_path):
+    db = GeneDatabase(str(tmp_path / 'genes.sqlite'))
+    counts = {'gene_info': db.addGeneInfo(writeTable(tmp_path / 'gene_info', GENE_INFO), species='human'),
+              'gene2ensembl': db.addGene2Ensembl(writeTable(tmp_path / 'gene2ensembl', GENE2ENSEMBL)),
+              'hgnc': db.addHgnc(writeTable(tmp_path / 'hgnc.txt', HGNC)),
+              'uniprot': db.addUniProtIdMapping(writeTable(tmp_path / 'idmapping.dat', UNIPROT))}
+    return db, counts
+
+
+def test_gene_database_importers(tmp_path):
+    """
+    test_gene_database_importers checks what each dump contributes: gene_info symbols, aliases and cross references
+    (of the requested species only), gene2ensembl accessions, HGNC symbols and EC numbers, and UniProt cross
+    references attached through their GeneID rows.
+    """
+    db, counts = loadDatabase(tmp_path)
+    assert not db.empty()
+    # Entrez ID, symbol, name, type, 2 aliases and 3 cross references for each human gene
+    assert counts['gene_info'] == 2 * 9
+    assert counts['gene2ensembl'] == 3 * 5
+    assert counts['uniprot'] == 2 + 4
+
+    df = db.querymany(['tp53', 'ERBB1', 'Trp53'], scopes='symbol,alias',
+                      fields='symbol,name,HGNC,MIM,ec,uniprot,kegg,pdb,reactome,ensembl.gene', species='human')
+    assert df.index.tolist() == ['tp53', 'ERBB1', 'Trp53']
+    assert df.loc['tp53', 'name'] == 'tumor protein p53'
+    assert df.loc['tp53', 'HGNC'] == '11998'
+    assert df.loc['tp53', 'MIM'] == '191170'
+    assert df.loc['tp53', 'uniprot'] == 'P04637'
+    assert df.loc['tp53', 'pdb'] == '1A1U'
+    assert df.loc['ERBB1', '_id'] == '1956'
+    assert df.loc['ERBB1', 'ec'] == '2.7.10.1'
+    assert df.loc['ERBB1', 'reactome'] == 'R-HSA-177929'
+    assert df.loc['ERBB1', 'kegg'] == 'hsa:1956'
+    assert df.loc['ERBB1', 'ensembl.gene'] == 'ENSG00000146648'
+    # Trp53 is a mouse gene, which was not loaded
+    assert df.loc['Trp53', 'notfound'] == True  # noqa: E712
+    assert 'STRING' not in df
+    assert db.querymany(['HGNC:99999', 'WITHDRAWN1'], scopes='symbol,HGNC')['notfound'].tolist() == [True, True]
+
+
+def test_gene_database_querymany_shape(tmp_path):
+    """
+    test_gene_database_querymany_shape checks that querymany gives the dataframe MyGeneInfo.querymany(...,
+    as_dataframe=True) builds from the same mygene.info hits: one row per hit indexed by query, sub-fields flattened
+    into dotted columns, several values kept as a list and a 'notfound' column for misses.
+    """
+    db, _ = loadDatabase(tmp_path)
+    hits = [{'query': 'TP53', '_id': '7157', '_score': 89.1, 'symbol': 'TP53', 'MIM': '191170',
+             'refseq': {'rna': ['NM_000546.6', 'NM_001126112.3'], 'protein': ['NP_000537.3', 'NP_001119584.1']}},
+            {'query': 'NOTAGENE', 'notfound': True},
+            {'query': 'egfr', '_id': '1956', '_score': 88.7, 'symbol': 'EGFR', 'MIM': '131550',
+             'refseq': {'rna': 'NM_005228.5', 'protein': 'NP_005219.2'}}]
+    # What querymany(..., as_dataframe=True) does with the hits
+    expected = pd.json_normalize(hits).set_index('query').drop(columns='_score')
+
+    df = db.querymany(['TP53', 'NOTAGENE', 'egfr'], scopes='symbol', fields='symbol,MIM,refseq', species='human')
+    pd.testing.assert_frame_equal(df.sort_index(axis=1), expected.sort_index(axis=1))
+
+
+def test_gene_database_fields_match_exactly(tmp_path):
+    """
+    test_gene_database_fields_match_exactly checks that field names are not matched as LIKE patterns: other cases
+    and '_' standing in for a character select nothing, while a field still selects its own sub-fields.
+    """
+    db, _ = loadDatabase(tmp_path)
+    assert list(db.querymany(['TP53'], fields='mim,Symbol,RefSeq,ensemb_').columns) == ['_id']
+    df = db.querymany(['TP53'], fields='ensembl')
+    assert sorted(df.columns) == ['_id', 'ensembl.gene', 'ensembl.protein', 'ensembl.transcript']
+    assert np.array_equal(df.loc['TP53', 'ensembl.transcript'], ['ENST00000269305.9', 'ENST00000445888.6'])
@@ -0,0 +1,36 @@
+"""
+testInstrument.py checks the memory fields of the stage metrics written by Python/Misc/instrument.py.
+@author: Scott Campit
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+import instrument
+
+
+def test_stage_memory_is_per_stage(tmp_path, monkeypatch):
+    """
+    test_stage_memory_is_per_stage checks that a stage reports how much the resident set grew while it ran, next to the
+    process peak so far, so a small stage that runs after a large one is not charged with the large one's peak.
+    """
+    if instrument._rssMb() is None:
+        pytest.skip('/proc/self/statm is not available')
+    metrics = tmp_path / 'metrics.jsonl'
+    monkeypatch.setitem(instrument._settings, 'metrics', str(metrics))
+
+    with instrument.stage('large'):
+        block = bytearray(64 * 2 ** 20)
+        block[::4096] = b'x' * len(block[::4096])
+    with instrument.stage('small'):
+        del block
+
+    large, small = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert 'max_rss_mb' not in large
+    assert large['rss_delta_mb'] >= 48
+    assert small['rss_delta_mb'] < 8
+    assert small['peak_rss_so_far_mb'] >= large['peak_rss_so_far_mb'] >= large['rss_delta_mb']
@@ -0,0 +1,44 @@
+"""
+testMapCompounds.py checks that MetaboAnalyst batches that fail are skipped without breaking the metabolite map.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+# Keep the response cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+import metaboanalyst
+from remote import TransientError
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import metabolomics_parser as parser
+
+
+def failBatch(self, names):
+    raise TransientError('unreachable')
+
+
+def test_map_compounds_all_batches_fail(monkeypatch, tmp_path):
+    """
+    test_map_compounds_all_batches_fail checks that queryMetaboAnalyst returns an empty map with every identifier
+    column when no MetaboAnalyst batch succeeds.
+    """
+    monkeypatch.setattr(metaboanalyst.MetaboAnalystClient, 'mapBatch', failBatch)
+    filename = str(tmp_path / 'data.csv')
+    pd.DataFrame({'Compound Method': ['Glucose', 'L-Alanine', 'ATP']}).to_csv(filename, index=False)
+
+    data = parser.queryMetaboAnalyst(filename, synmatch=False, cache=False, url='http://127.0.0.1:9/mapcompounds')
+    assert data.empty
+    assert list(data.columns) == ['query'] + metaboanalyst.IDENTIFIER_COLUMNS
+
+    data = parser.mapCompounds(['glucose'], cache=False, batchSize=1)
+    assert data.empty
+    assert list(data.columns) == ['query'] + metaboanalyst.IDENTIFIER_COLUMNS
@@ -1,6 +1,8 @@
+import os
 import requests
 
-url = "http://api.xialab.ca/mapcompounds"
+# METABOANALYST_URL points the script at a local stand-in (see Misc/standin.py)
+url = os.environ.get('METABOANALYST_URL', "http://api.xialab.ca/mapcompounds")
 
 payload = "{\n\t\"queryList\": \"1,3-Diaminopropane;2-Ketobutyric acid;2-Hydroxybutyric acid;\",\n\t\"inputType\": \"name\"\n}"
 headers = {
@@ -0,0 +1,105 @@
+"""
+testModelIndex.py checks that modelindex.ModelIndex matches query results to the model like the pandas merges on ChEBI
+and KEGG IDs it replaced.
+@author: Scott Campit
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from modelindex import ModelIndex
+from utilities import ID_FORMATS, compact_ids
+
+COLUMNS = ['Metabolite', 'query', 'BIGG', 'CHEBI', 'KEGG']
+
+
+def legacyMatch(data, modelMap):
+    """
+    legacyMatch is the original matchModelAndData join: ChEBI and KEGG matches, each without missing values, merged
+    on the metabolite, query and BiGG ID.
+    """
+    chebi = pd.merge(modelMap, data, left_on='CHEBI', right_on='chebi_id', how='inner')
+    chebi = chebi[['Metabolite', 'query', 'BIGG', 'CHEBI']].dropna()
+    kegg = pd.merge(modelMap, data, left_on='KEGG', right_on='kegg_id', how='inner')
+    kegg = kegg[['Metabolite', 'query', 'BIGG', 'KEGG']].dropna()
+    return pd.merge(chebi, kegg, how='inner', on=['Metabolite', 'query', 'BIGG'])
+
+
+def randomFrames(seed, keggPrefix='C'):
+    """
+    randomFrames builds a model map with one row per annotation (as mapMetabolicModel does) and MetaboAnalyst results
+    that share some of its ChEBI and KEGG IDs.
+    """
+    rng = np.random.default_rng(seed)
+    chebi = [str(i) for i in rng.choice(100000, 40, replace=False)]
+    kegg = ['%s%05d' % (keggPrefix, i) for i in rng.choice(20000, 40, replace=False)]
+
+    rows = []
+    for species in range(60):
+        name, bigg = 'metabolite %d' % (species % 45), 'm%d_c' % species
+        for _ in range(rng.integers(1, 4)):
+            rows.append({'Metabolite': name, 'BIGG': bigg, 'CHEBI': rng.choice(chebi), 'KEGG': np.nan})
+        for _ in range(rng.integers(0, 3)):
+            rows.append({'Metabolite': name, 'BIGG': bigg, 'CHEBI': np.nan, 'KEGG': rng.choice(kegg)})
+        rows.append({'Metabolite': name, 'BIGG': bigg, 'CHEBI': np.nan, 'KEGG': np.nan})
+    modelMap = pd.DataFrame(rows)
+
+    def pick(pool, n):
+        values = np.array(pool + ['-', '99999999'], dtype=object)[rng.integers(0, len(pool) + 2, n)]
+        values[rng.random(n) < 0.15] = np.nan
+        return values
+
+    n = 400
+    data = pd.DataFrame({'query': ['name %d' % i for i in rng.integers(0, 150, n)],
+                         'chebi_id': pick(chebi, n), 'kegg_id': pick(kegg, n)})
+    return data, modelMap
+
+
+def rowSet(df):
+    return sorted(map(tuple, df[COLUMNS].astype(str).values.tolist()))
+
+
+def test_model_index_matches_merge():
+    """
+    test_model_index_matches_merge checks ModelIndex.match against the merges on random model maps and query results,
+    with numeric and non-numeric KEGG IDs, and with string or compacted query identifiers.
+    """
+    for seed in range(10):
+        for keggPrefix in ('C', 'G'):
+            data, modelMap = randomFrames(seed, keggPrefix)
+            expected = rowSet(legacyMatch(data, modelMap).drop_duplicates())
+            assert expected
+
+            index = ModelIndex(modelMap, keys={'CHEBI': 'chebi_id', 'KEGG': 'kegg_id'})
+            assert index.indexes['CHEBI'].numeric
+            assert index.indexes['KEGG'].numeric == (keggPrefix == 'C')
+
+            matched = index.match(data)
+            assert list(matched.columns) == COLUMNS
+            assert not matched.duplicated().any()
+            assert rowSet(matched) == expected
+
+            compacted = data.copy()
+            for col in ('chebi_id', 'kegg_id'):
+                compacted[col] = compact_ids(data[col], *ID_FORMATS[col])
+            matched = index.match(compacted)
+            for col, dataCol in (('CHEBI', 'chebi_id'), ('KEGG', 'kegg_id')):
+                if pd.api.types.is_integer_dtype(matched[col].dtype):
+                    prefix, width = ID_FORMATS[dataCol]
+                    matched[col] = prefix + matched[col].astype('int64').astype(str).str.zfill(width)
+            assert rowSet(matched) == expected
+
+
+def test_model_index_no_match():
+    """
+    test_model_index_no_match checks that query results without a shared identifier give an empty match.
+    """
+    data, modelMap = randomFrames(0)
+    data['chebi_id'] = '-'
+    matched = ModelIndex(modelMap).match(data)
+    assert matched.empty
+    assert list(matched.columns) == COLUMNS
@@ -0,0 +1,81 @@
+"""
+testMyGeneClient.py checks that an interrupted bulk MyGene mapping resumes with only the chunks that failed, against
+the local stand-in server.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip('requests')
+
+# Keep the response cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'identifier-mapper'))
+import mygeneclient
+from cache import ResponseCache
+from remote import TransientError
+from standin import StandInServer
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import identifier_mapper as mapper
+
+GENES = ['TP53', 'EGFR', 'BRCA1', 'MYC', 'KRAS', 'PTEN', 'NOTAGENE']
+ENTREZ = {'TP53': 7157, 'EGFR': 1956, 'BRCA1': 672, 'MYC': 4609, 'KRAS': 3845, 'PTEN': 5728}
+
+
+def recordGenes(server, scopes, fields):
+    server.recordMyGene(scopes, fields, 'human',
+                        [{'query': g, '_id': str(e), 'symbol': g, 'entrezgene': e} for g, e in ENTREZ.items()])
+
+
+def failingChunks(monkeypatch, failures):
+    """
+    failingChunks records the chunks MyGeneClient posts and fails the first `failures[first id]` posts of a chunk.
+    """
+    posted = []
+    queryChunk = mygeneclient.MyGeneClient.queryChunk
+
+    def recordingQueryChunk(self, ids, scopes, fields, species):
+        posted.append(list(ids))
+        if failures.get(ids[0], 0) > 0:
+            failures[ids[0]] -= 1
+            raise TransientError('HTTP 503')
+        return queryChunk(self, ids, scopes, fields, species)
+
+    monkeypatch.setattr(mygeneclient.MyGeneClient, 'queryChunk', recordingQueryChunk)
+    return posted
+
+
+def test_mygene_bulk_resumes_failed_chunk(tmp_path, monkeypatch):
+    """
+    test_mygene_bulk_resumes_failed_chunk checks that a chunk that fails is left out of the map and the cache, while
+    the other chunks are cached, so a rerun only posts the failed chunk.
+    """
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    posted = failingChunks(monkeypatch, {'BRCA1': 1})
+    with StandInServer(str(tmp_path / 'standin.sqlite')) as server:
+        recordGenes(server, 'symbol', 'symbol,entrezgene')
+        query = dict(scopes='symbol', fields=['symbol', 'entrezgene'], species='human', cache=cache, bulk=True,
+                     chunkSize=2, maxWorkers=2, rate=1000, baseUrl=server.serviceUrl('mygene'))
+
+        df = mapper.queryMyGene(GENES, **query)
+        assert sorted(posted) == [['BRCA1', 'MYC'], ['KRAS', 'PTEN'], ['NOTAGENE'], ['TP53', 'EGFR']]
+        assert sorted(df.index) == ['EGFR', 'KRAS', 'NOTAGENE', 'PTEN', 'TP53']
+
+        del posted[:]
+        df = mapper.queryMyGene(GENES, **query)
+        assert posted == [['BRCA1', 'MYC']]
+        assert df.index.tolist() == GENES
+        assert df.loc['MYC', 'entrezgene'] == 4609
+        assert df.loc['NOTAGENE', 'notfound'] == True  # noqa: E712
+
+        del posted[:]
+        mapper.queryMyGene(GENES, **query)
+        assert posted == []
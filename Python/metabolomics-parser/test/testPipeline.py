@@ -0,0 +1,166 @@
+"""
+testPipeline.py checks that pipeline.Pipeline only reruns the stages whose fingerprint changed or whose remote lookups
+failed, and their downstream stages.
+@author: Scott Campit
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+import instrument
+from pipeline import Pipeline, _codeDigest
+
+CALLS = []
+# Failed lookups the next lookup() call reports, one entry per call
+FAILURES = []
+
+
+def load(filename, scale):
+    CALLS.append('load')
+    with open(filename) as f:
+        return [int(x) * scale for x in f.read().split()]
+
+
+def total(values):
+    CALLS.append('total')
+    return sum(values)
+
+
+def count(values):
+    CALLS.append('count')
+    return len(values)
+
+
+def report(total, count, label):
+    CALLS.append('report')
+    return '%s %d/%d' % (label, total, count)
+
+
+def lookup(values):
+    CALLS.append('lookup')
+    instrument.count(failed_lookups=FAILURES.pop(0))
+    return [v + 1 for v in values]
+
+
+def build(workDir, filename, scale=1, label='mean', code=()):
+    pipe = Pipeline(str(workDir), code=code)
+    pipe.add('load', load, params={'filename': filename, 'scale': scale}, files=[filename])
+    pipe.add('total', total, inputs=['load'])
+    pipe.add('count', count, inputs=['load'])
+    pipe.add('report', report, inputs=['total', 'count'], params={'label': label})
+    return pipe
+
+
+def run(pipe, **kwargs):
+    del CALLS[:]
+    result = pipe.run(**kwargs)
+    return result, sorted(CALLS)
+
+
+def test_pipeline_reruns_only_changed_stages(tmp_path):
+    """
+    test_pipeline_reruns_only_changed_stages checks that a warm run skips every stage, and that a changed parameter,
+    input file or `force` reruns the affected stage and every stage downstream of it, and nothing else.
+    """
+    filename = str(tmp_path / 'values.txt')
+    with open(filename, 'w') as f:
+        f.write('1 2 3')
+    workDir = tmp_path / 'work'
+
+    result, calls = run(build(workDir, filename))
+    assert result['report'] == 'mean 6/3'
+    assert calls == ['count', 'load', 'report', 'total']
+
+    result, calls = run(build(workDir, filename))
+    assert result['report'] == 'mean 6/3'
+    assert calls == []
+
+    result, calls = run(build(workDir, filename, label='sum'))
+    assert result['report'] == 'sum 6/3'
+    assert calls == ['report']
+
+    result, calls = run(build(workDir, filename, label='sum', scale=2))
+    assert result['report'] == 'sum 12/3'
+    assert calls == ['count', 'load', 'report', 'total']
+
+    with open(filename, 'w') as f:
+        f.write('1 2 3 4')
+    result, calls = run(build(workDir, filename, label='sum', scale=2))
+    assert result['report'] == 'sum 20/4'
+    assert calls == ['count', 'load', 'report', 'total']
+
+    result, calls = run(build(workDir, filename, label='sum', scale=2), force=['total'])
+    assert result['report'] == 'sum 20/4'
+    assert calls == ['report', 'total']
+
+    result, calls = run(build(workDir, filename, label='sum', scale=2), targets=['count'])
+    assert result == {'count': 4}
+    assert calls == []
+
+
+def test_pipeline_code_changes(tmp_path):
+    """
+    test_pipeline_code_changes checks that functions calling different names have different fingerprints, and that an
+    edit to a source file in `code` reruns every stage.
+    """
+    def a(x):
+        return total(x)
+
+    def b(x):
+        return count(x)
+
+    assert _codeDigest(a) != _codeDigest(b)
+
+    filename = str(tmp_path / 'values.txt')
+    with open(filename, 'w') as f:
+        f.write('1 2 3')
+    source = tmp_path / 'src'
+    source.mkdir()
+    with open(str(source / 'helper.py'), 'w') as f:
+        f.write('SCALE = 1\n')
+    workDir = tmp_path / 'work'
+
+    run(build(workDir, filename, code=[str(source)]))
+    result, calls = run(build(workDir, filename, code=[str(source)]))
+    assert calls == []
+
+    with open(str(source / 'helper.py'), 'w') as f:
+        f.write('SCALE = 2\n')
+    result, calls = run(build(workDir, filename, code=[str(source)]))
+    assert calls == ['count', 'load', 'report', 'total']
+
+
+def test_pipeline_retries_failed_lookups(tmp_path):
+    """
+    test_pipeline_retries_failed_lookups checks that a stage whose remote lookups failed is not marked up to date, so
+    the next run reruns it and the stages downstream of it until a run has no failures.
+    """
+    filename = str(tmp_path / 'values.txt')
+    with open(filename, 'w') as f:
+        f.write('1 2 3')
+    workDir = tmp_path / 'work'
+
+    def flakyPipeline():
+        pipe = Pipeline(str(workDir))
+        pipe.add('load', load, params={'filename': filename, 'scale': 1}, files=[filename])
+        pipe.add('lookup', lookup, inputs=['load'])
+        pipe.add('total', total, inputs=['lookup'])
+        return pipe
+
+    FAILURES[:] = [2, 0]
+    pipe = flakyPipeline()
+    result, calls = run(pipe)
+    assert result['total'] == 9
+    assert calls == ['load', 'lookup', 'total']
+    assert pipe.failed == {'lookup': 2}
+    assert not os.path.exists(str(workDir / 'lookup.json'))
+
+    pipe = flakyPipeline()
+    result, calls = run(pipe)
+    assert calls == ['lookup', 'total']
+    assert pipe.failed == {}
+
+    result, calls = run(flakyPipeline())
+    assert result['total'] == 9
+    assert calls == []
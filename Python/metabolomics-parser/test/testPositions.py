@@ -0,0 +1,46 @@
+"""
+testPositions.py checks that the indexed and the original substring-scan branches of mapMetabolitePositionsInModel find
+the same metabolite positions on a model whose IDs they read the same way.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+# Keep the model cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+from synthetic import writeModel
+from utilities import expand_frame
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import metabolomics_parser as parser
+
+
+def test_position_branches_agree(tmp_path):
+    """
+    test_position_branches_agree maps a merged map of synthetic metabolites (IDs like 'met12_c', with a single
+    underscore) through every branch of mapMetabolitePositionsInModel and compares the position tables.
+    """
+    pytest.importorskip('cobra')
+    pytest.importorskip('lxml')
+    model = writeModel(str(tmp_path / 'model.xml'), species=90, genes=10, reactions=30)
+
+    modelMap = expand_frame(parser.mapMetabolicModel(model, modelCache=False, outFile=None))
+    merged = modelMap[['Metabolite', 'BIGG']].drop_duplicates().iloc[::4].reset_index(drop=True)
+    merged['Query'] = merged['Metabolite'].str.lower()
+
+    def positions(**kwargs):
+        df = parser.mapMetabolitePositionsInModel(merged.copy(), model, outFile=None, **kwargs)
+        return df.sort_index().sort_index(axis=1)
+
+    substring = positions(indexed=False)
+    assert len(substring) > 0
+    pd.testing.assert_frame_equal(substring, positions(indexed=True, modelCache=False), check_dtype=False)
+    pd.testing.assert_frame_equal(substring, positions(indexed=True, modelCache=True), check_dtype=False)
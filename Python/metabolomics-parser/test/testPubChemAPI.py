@@ -3,9 +3,13 @@ testPubChemAPI.py runs tests on different components of the metabolomics-parse.p
 @author: Scott Campit
 """
 
+import os
 import pubchempy as pcp
 import pandas as pd
 
+# PUBCHEM_URL points pubchempy at a local stand-in (see Misc/standin.py)
+pcp.API_BASE = os.environ.get('PUBCHEM_URL', pcp.API_BASE)
+
 def test_parse_pubchem_compounds(filename):
     """
     :param:  filename:      A string denoting the path to the metabolomics file
@@ -0,0 +1,123 @@
+"""
+testPubChemClient.py checks how the bulk PubChem client handles throttling and failed requests, with a scripted
+session standing in for PUG-REST.
+@author: Scott Campit
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+requests = pytest.importorskip('requests')
+
+# Keep the response cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+from cache import ResponseCache
+from pubchem import PubChemClient
+
+SIDS = {'glucose': [1, 2], 'atp': [3]}
+
+
+def substance(sid):
+    return {'sid': {'id': sid}, 'source': {'db': {'name': 'ChEBI', 'source_id': {'str': 'S%d' % sid}}},
+            'compound': [{'id': {'type': 1, 'id': {'cid': 100 + sid}}}], 'synonyms': ['synonym %d' % sid]}
+
+
+class ScriptedSession:
+    """
+    ScriptedSession answers PUG-REST requests from SIDS, except that the first `failures[key]` requests for a name
+    (or for the SID batch, key 'sid') get `status`.
+    """
+
+    def __init__(self, failures=None, status=503):
+        self.failures = dict(failures or {})
+        self.status = status
+        self.requests = []
+
+    def request(self, method, url, data=None, **kwargs):
+        if method == 'GET':
+            key = url.split('/')[-3]
+        else:
+            key = 'sid'
+        self.requests.append(key)
+        if self.failures.get(key, 0) > 0:
+            self.failures[key] -= 1
+            return self.respond(self.status, {'error': 'busy'})
+        if key == 'sid':
+            sids = data['sid'].split(',')
+            return self.respond(200, {'PC_Substances': [substance(int(s)) for s in sids]})
+        if key not in SIDS:
+            return self.respond(404, {'Fault': {'Code': 'PUGREST.NotFound'}})
+        return self.respond(200, {'IdentifierList': {'SID': SIDS[key]}})
+
+    def respond(self, status, body):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        # Retry right away instead of backing off
+        response.headers['Retry-After'] = '0'
+        return response
+
+
+def makeClient(session, cache=None, retries=2):
+    client = PubChemClient(baseUrl='http://pubchem.test/%d' % id(session), rate=1000, retries=retries, cache=cache)
+    client.session = session
+    return client
+
+
+def test_pubchem_client_retries_transient_errors(tmp_path):
+    """
+    test_pubchem_client_retries_transient_errors checks that throttled (429) and busy (503) answers are retried until
+    the request goes through.
+    """
+    for status in (429, 503):
+        session = ScriptedSession({'glucose': 2, 'sid': 1}, status=status)
+        client = makeClient(session, ResponseCache(str(tmp_path / ('%d.sqlite' % status))))
+        found = client.getSubstances(['glucose', 'atp', 'unknown'])
+        assert client.failed == []
+        assert sorted(found) == ['atp', 'glucose']
+        assert [s['sid'] for s in found['glucose']] == [1, 2]
+        assert session.requests.count('glucose') == 3
+        assert session.requests.count('sid') == 2
+
+
+def test_pubchem_client_failed_name_not_cached(tmp_path):
+    """
+    test_pubchem_client_failed_name_not_cached checks that a name that fails after every retry ends up in `failed`, is
+    not cached (unlike a name PubChem does not know), and is looked up again on the next run.
+    """
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    client = makeClient(ScriptedSession({'atp': 3}), cache)
+    found = client.getSubstances(['glucose', 'atp', 'unknown'])
+    assert list(found) == ['glucose']
+    assert [query for query, _ in client.failed] == ['atp']
+    assert sorted(cache.getMany('pubchem', 'substance/name', ['glucose', 'atp', 'unknown'])) == ['glucose', 'unknown']
+
+    session = ScriptedSession()
+    rerun = makeClient(session, cache)
+    assert sorted(rerun.getSubstances(['glucose', 'atp', 'unknown'])) == ['atp', 'glucose']
+    assert session.requests == ['atp', 'sid']
+
+
+def test_pubchem_client_failed_sid_batch(tmp_path):
+    """
+    test_pubchem_client_failed_sid_batch checks that names whose substance records did not all come back are left out
+    of the cache, so the next run fetches them in full instead of replaying a partial answer.
+    """
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    client = makeClient(ScriptedSession({'sid': 3}), cache)
+    assert client.getSubstances(['glucose', 'atp']) == {}
+    assert [query for query, _ in client.failed] == [[1, 2, 3]]
+    assert cache.getMany('pubchem', 'substance/name', ['glucose', 'atp']) == {}
+
+    rerun = makeClient(ScriptedSession(), cache)
+    found = rerun.getSubstances(['glucose', 'atp'])
+    assert {name: [s['sid'] for s in recs] for name, recs in found.items()} == {'glucose': [1, 2], 'atp': [3]}
+    assert cache.getMany('pubchem', 'substance/name', ['glucose', 'atp']) == found
@@ -0,0 +1,55 @@
+"""
+testQueryPubChem.py checks that the bulk and pubchempy modes of queryPubChem write the same synonym rows.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+# Keep the response cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+from cache import ResponseCache
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import metabolomics_parser as parser
+
+SUBSTANCES = {
+    'glucose': [{'sid': 1, 'source_id': 'G1', 'source_name': 'ChEBI', 'standardized_cid': 5793,
+                 'synonyms': ['glucose', 'D-glucose']},
+                {'sid': 2, 'source_id': 'G2', 'source_name': 'KEGG', 'standardized_cid': 5793, 'synonyms': []}],
+    'atp': [{'sid': 3, 'source_id': 'A1', 'source_name': 'ChEBI', 'standardized_cid': 5957,
+             'synonyms': ['ATP', 'adenosine triphosphate']}],
+    'unknown compound': [],
+}
+
+
+def test_query_pubchem_repeated_names(tmp_path):
+    """
+    test_query_pubchem_repeated_names checks that both modes write the synonym rows of a repeated name once (for its
+    first spelling), with every answer coming from the response cache.
+    """
+    pcp = pytest.importorskip('pubchempy')
+    apiBase = pcp.API_BASE
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    cache.setMany('pubchem', 'substance/name', SUBSTANCES)
+    data = pd.DataFrame({'Compound Method': ['Glucose/ATP', 'glucose', 'ATP/Glucose', 'Unknown compound', 'ATP ']})
+
+    outFiles = {}
+    for bulk in (True, False):
+        outFiles[bulk] = str(tmp_path / ('bulk.csv' if bulk else 'pubchempy.csv'))
+        parser.queryPubChem(data, bulk=bulk, cache=cache, outFile=outFiles[bulk], baseUrl='http://127.0.0.1:9/rest')
+    # The pubchempy mode points pubchempy at baseUrl only while it runs
+    assert pcp.API_BASE == apiBase
+
+    bulkRows = pd.read_csv(outFiles[True])
+    pubchempyRows = pd.read_csv(outFiles[False])
+    pd.testing.assert_frame_equal(bulkRows, pubchempyRows)
+    # glucose: 3 rows (two substances, one without synonyms), atp: 2 rows
+    assert bulkRows['Name'].tolist() == ['glucose'] * 3 + ['atp'] * 2
@@ -0,0 +1,87 @@
+"""
+testRemote.py checks the request coalescing in Python/Misc/remote.py.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+from remote import SingleFlight
+
+CALLERS = 8
+
+
+def concurrentCalls(flight, key, func):
+    """
+    concurrentCalls starts CALLERS threads that call flight.do(key, func) together and returns their outcomes.
+    """
+    barrier = threading.Barrier(CALLERS)
+
+    def call():
+        barrier.wait()
+        try:
+            return flight.do(key, func)
+        except RuntimeError as err:
+            return err
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        return list(pool.map(lambda _: call(), range(CALLERS)))
+
+
+def test_single_flight_shares_one_call():
+    """
+    test_single_flight_shares_one_call checks that concurrent callers with the same key share one call and its result,
+    and that a later call with the key runs again.
+    """
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def lookup():
+        calls.append(1)
+        # Keep the call in flight until every caller has had the chance to join it
+        release.wait(timeout=5)
+        return ['SID %d' % len(calls)]
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    results = concurrentCalls(flight, 'glucose', lookup)
+    timer.join()
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert results[0] == ['SID 1']
+
+    assert flight.do('glucose', lookup) == ['SID 2']
+    assert flight._calls == {}
+
+
+def test_single_flight_shares_errors():
+    """
+    test_single_flight_shares_errors checks that every caller waiting on a call that fails receives its exception, and
+    that the failure is not remembered for the next call.
+    """
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def failing():
+        calls.append(1)
+        release.wait(timeout=5)
+        raise RuntimeError('HTTP 503')
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    results = concurrentCalls(flight, 'atp', failing)
+    timer.join()
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == 'HTTP 503' for result in results)
+
+    with pytest.raises(RuntimeError):
+        flight.do('atp', failing)
+    assert len(calls) == 2
+    assert flight.do('atp', lambda: 'recovered') == 'recovered'
@@ -0,0 +1,150 @@
+"""
+testSbmlAnnotations.py checks that identifiers.org annotation URIs from SBML models are split into clean identifiers,
+that SBML IDs are decoded into the same IDs cobrapy reads, that streaming a model keeps no skipped sections, and that
+the streaming and whole-document model parsers agree.
+@author: Scott Campit
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+from sbml import FBC_GENE_PRODUCT, SBML_SPECIES, decodeSbmlId, iterAnnotations, iterElements, parseIdentifiersUri
+
+
+def test_parse_identifiers_uri():
+    """
+    test_parse_identifiers_uri checks every supported namespace, in both path and compact URI forms.
+    """
+    expected = {
+        'http://identifiers.org/chebi/CHEBI:15422': ('chebi', '15422'),
+        'https://identifiers.org/CHEBI:15422': ('chebi', '15422'),
+        'http://identifiers.org/chebi/CHEBI%3A15422': ('chebi', '15422'),
+        'http://identifiers.org/hmdb/HMDB00538': ('hmdb', 'HMDB00538'),
+        'http://identifiers.org/kegg.compound/C00002': ('kegg.compound', 'C00002'),
+        'http://identifiers.org/bigg.metabolite/atp': ('bigg.metabolite', 'atp'),
+        'http://identifiers.org/metanetx.chemical/MNXM3': ('metanetx.chemical', 'MNXM3'),
+        'http://identifiers.org/inchikey/ZKHQWZAMYRWXGA-KQYNXXCUSA-J': ('inchikey', 'ZKHQWZAMYRWXGA-KQYNXXCUSA-J'),
+        'http://identifiers.org/seed.compound/cpd00002': ('seed', 'cpd00002'),
+        'http://identifiers.org/pubchem.compound/5957': ('pubchem.compound', '5957'),
+    }
+    for uri, annotation in expected.items():
+        assert parseIdentifiersUri(uri) == annotation
+
+
+def test_parse_identifiers_uri_unknown():
+    """
+    test_parse_identifiers_uri_unknown checks that other namespaces and non identifiers.org URIs are skipped.
+    """
+    assert parseIdentifiersUri('http://identifiers.org/reactome/R-ALL-113592') is None
+    assert parseIdentifiersUri('http://www.ebi.ac.uk/chebi/CHEBI:15422') is None
+
+
+def test_decode_sbml_id():
+    """
+    test_decode_sbml_id checks the escapes cobrapy writes for gene and species IDs.
+    """
+    assert decodeSbmlId('G_3098__46__1', 'G_') == '3098.1'
+    assert decodeSbmlId('G_80201__SBML_DOT__2', 'G_') == '80201.2'
+    assert decodeSbmlId('G_HGNC__58__8', 'G_') == 'HGNC:8'
+    assert decodeSbmlId('M_glc__D_c', 'M_') == 'glc__D_c'
+    assert decodeSbmlId('M_13dpg__45__c', 'M_') == '13dpg-c'
+    assert decodeSbmlId('M_a__SBML_DOT__b', 'M_') == 'a__SBML_DOT__b'
+    assert decodeSbmlId('atp_c', 'M_') == 'atp_c'
+
+
+def writeCobraModel(cobra, path):
+    """
+    writeCobraModel writes a model with cobrapy whose gene and metabolite IDs need escaping in SBML.
+    """
+    model = cobra.Model('escaped')
+    reaction = cobra.Reaction('R1')
+    reaction.add_metabolites({cobra.Metabolite('glc-D_c', compartment='c'): -1,
+                              cobra.Metabolite('glc-D_e', compartment='e'): 1})
+    reaction.gene_reaction_rule = '3098.1 or 80201.2 or HGNC:8'
+    model.add_reactions([reaction])
+    cobra.io.write_sbml_model(model, path)
+    return path
+
+
+def test_read_gene_ids_matches_cobra(tmp_path):
+    """
+    test_read_gene_ids_matches_cobra checks readGeneIds against cobrapy on a cobra-written model with dotted gene IDs.
+    """
+    cobra = pytest.importorskip('cobra')
+    pytest.importorskip('lxml')
+    from geneids import readGeneIds
+
+    path = writeCobraModel(cobra, str(tmp_path / 'escaped.xml'))
+    assert readGeneIds(path) == [gene.id for gene in cobra.io.read_sbml_model(path).genes]
+    assert sorted(readGeneIds(path)) == ['3098.1', '80201.2', 'HGNC:8']
+
+
+def test_compiled_model_matches_cobra(tmp_path):
+    """
+    test_compiled_model_matches_cobra checks the gene and metabolite IDs of a compiled model against cobrapy.
+    """
+    cobra = pytest.importorskip('cobra')
+    pytest.importorskip('lxml')
+    pytest.importorskip('pandas')
+    from modelcache import compileSbml
+
+    path = writeCobraModel(cobra, str(tmp_path / 'escaped.xml'))
+    model = cobra.io.read_sbml_model(path)
+    compiled = compileSbml(path)
+    assert compiled.geneIds == [gene.id for gene in model.genes]
+    assert compiled.metabolites == [met.id for met in model.metabolites]
+    assert compiled.metabolites == ['glc-D_c', 'glc-D_e']
+
+
+def test_iter_elements_keeps_tree_small(tmp_path):
+    """
+    test_iter_elements_keeps_tree_small streams the species and gene products of a model with a large reactions
+    section, and checks that the parsed tree only ever holds the current element, its ancestors and what the parser
+    has read ahead, never the reactions it skipped.
+    """
+    pytest.importorskip('lxml')
+    pytest.importorskip('numpy')
+    from synthetic import writeModel
+
+    path = writeModel(str(tmp_path / 'model.xml'), species=300, genes=50, reactions=5000)
+    counts = {SBML_SPECIES: 0, FBC_GENE_PRODUCT: 0}
+    annotated = 0
+    largest = 0
+    for element in iterElements(path, (SBML_SPECIES, FBC_GENE_PRODUCT)):
+        counts[element.tag] += 1
+        annotated += any(True for _ in iterAnnotations(element))
+        largest = max(largest, sum(1 for _ in element.getroottree().getroot().iter()))
+    assert counts == {SBML_SPECIES: 300, FBC_GENE_PRODUCT: 50}
+    assert annotated > 0
+    # The reactions section alone has 5000 * 14 elements
+    assert largest < 1000
+
+
+def test_map_metabolic_model_modes_agree(tmp_path):
+    """
+    test_map_metabolic_model_modes_agree checks that the streaming and the original whole-document parsers of
+    mapMetabolicModel give the same ChEBI, HMDB and KEGG rows, and that the original parser only adds empty rows for
+    the BiGG and PubChem annotations it does not read.
+    """
+    pytest.importorskip('lxml')
+    pytest.importorskip('numpy')
+    pytest.importorskip('pandas')
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+    from idmapping import metabolomics_parser as parser
+    from synthetic import writeModel
+    from utilities import expand_frame
+
+    path = writeModel(str(tmp_path / 'model.xml'), species=300, genes=20, reactions=100)
+    columns = ['Metabolite', 'BIGG', 'CHEBI', 'HMDB', 'KEGG']
+    streamed = expand_frame(parser.mapMetabolicModel(path, stream=True, modelCache=False, outFile=None))
+    tree = expand_frame(parser.mapMetabolicModel(path, stream=False, modelCache=False, outFile=None))
+
+    streamedIds = streamed[streamed[columns[2:]].notna().any(axis=1)][columns].reset_index(drop=True)
+    treeIds = tree[tree[columns[2:]].notna().any(axis=1)][columns].reset_index(drop=True)
+    assert len(treeIds) > 0
+    assert streamedIds.equals(treeIds)
+    # Every annotated species has five annotations, two of them outside ChEBI, HMDB and KEGG
+    assert len(tree) == len(streamed) == len(treeIds) * 5 // 3
@@ -0,0 +1,117 @@
+"""
+testSheetCache.py checks that the sheet cache in Python/Misc/sheetcache.py converts each sheet once, notices changed
+workbooks and falls back to pickle for sheets Arrow cannot store.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('openpyxl')
+
+# Keep the sheet cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+import sheetcache
+from sheetcache import SheetCache
+
+
+def writeWorkbook(path, sheets):
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+
+
+SHEETS = {'Sheet1': pd.DataFrame({'Compound Method': ['glucose', 'atp'], 'Sample': [1.5, 2.0]}),
+          'Sheet2': pd.DataFrame({'Compound Method': ['citrate'], 'Sample': [3.5]})}
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """
+    parsed records the sheets sheetcache asks pandas to parse.
+    """
+    calls = []
+    readExcel = pd.read_excel
+
+    def recordingReadExcel(filename, sheet_name=0, **kwargs):
+        calls.append(sheet_name)
+        return readExcel(filename, sheet_name=sheet_name, **kwargs)
+
+    monkeypatch.setattr(sheetcache.pd, 'read_excel', recordingReadExcel)
+    return calls
+
+
+def test_sheet_cache_hit(tmp_path, parsed):
+    """
+    test_sheet_cache_hit checks that a sheet is parsed on its first read only, and that reading one sheet does not
+    convert the others.
+    """
+    workbook = str(tmp_path / 'data.xlsx')
+    writeWorkbook(workbook, SHEETS)
+    cache = SheetCache(str(tmp_path / 'sheets'))
+
+    assert cache.sheetNames(workbook) == ['Sheet1', 'Sheet2']
+    assert parsed == []
+    pd.testing.assert_frame_equal(cache.read(workbook, 'Sheet2'), SHEETS['Sheet2'])
+    assert parsed == ['Sheet2']
+
+    pd.testing.assert_frame_equal(cache.read(workbook, 'Sheet2'), SHEETS['Sheet2'])
+    assert cache.read(workbook, 1, columns=['Sample'])['Sample'].tolist() == [3.5]
+    assert parsed == ['Sheet2']
+    pd.testing.assert_frame_equal(cache.read(workbook), SHEETS['Sheet1'])
+    assert parsed == ['Sheet2', 'Sheet1']
+    with pytest.raises(ValueError):
+        cache.read(workbook, 'Sheet3')
+
+
+def test_sheet_cache_invalidation(tmp_path, parsed):
+    """
+    test_sheet_cache_invalidation checks that a workbook that is rewritten, with a new size or modification time, is
+    converted again.
+    """
+    workbook = str(tmp_path / 'data.xlsx')
+    writeWorkbook(workbook, SHEETS)
+    cache = SheetCache(str(tmp_path / 'sheets'))
+    assert cache.read(workbook)['Compound Method'].tolist() == ['glucose', 'atp']
+
+    changed = {'Sheet1': pd.DataFrame({'Compound Method': ['pyruvate', 'lactate', 'alanine'],
+                                       'Sample': [1.0, 2.0, 3.0]})}
+    writeWorkbook(workbook, changed)
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.sheetNames(workbook) == ['Sheet1']
+    assert cache.read(workbook)['Compound Method'].tolist() == ['pyruvate', 'lactate', 'alanine']
+    assert parsed == ['Sheet1', 'Sheet1']
+
+    # Touching the workbook without changing it rehashes it, but keeps the converted sheets
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert cache.read(workbook)['Compound Method'].tolist() == ['pyruvate', 'lactate', 'alanine']
+    assert parsed == ['Sheet1', 'Sheet1']
+
+
+def test_sheet_cache_pickle_fallback(tmp_path, parsed, monkeypatch):
+    """
+    test_sheet_cache_pickle_fallback checks that a sheet Feather cannot store (here an Arrow error that is neither a
+    ValueError nor a TypeError) is kept as a pickle and read back from it.
+    """
+    pyarrow = pytest.importorskip('pyarrow')
+
+    def unsupported(self, path, **kwargs):
+        raise pyarrow.lib.ArrowNotImplementedError('unsupported column type')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_feather', unsupported)
+    workbook = str(tmp_path / 'data.xlsx')
+    writeWorkbook(workbook, SHEETS)
+    cache = SheetCache(str(tmp_path / 'sheets'))
+
+    pd.testing.assert_frame_equal(cache.read(workbook, 'Sheet1'), SHEETS['Sheet1'])
+    entry = cache._entry(workbook)[0]
+    assert sorted(os.listdir(entry)) == ['0.pkl', 'sheets.json']
+    assert cache.read(workbook, 'Sheet1', columns=['Sample'])['Sample'].tolist() == [1.5, 2.0]
+    assert parsed == ['Sheet1']
@@ -0,0 +1,104 @@
+"""
+testStandIn.py checks that the local stand-in in Python/Misc/standin.py replays what it recorded to the bulk clients,
+and that its injected rate limiting is retried by remote.requestWithRetry.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip('requests')
+
+# Keep the recordings of the tests away from the real ones (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'identifier-mapper'))
+import instrument
+import standin
+from metaboanalyst import MetaboAnalystClient
+from mygeneclient import MyGeneClient
+from pubchem import PubChemClient
+from remote import TransientError, makeSession, requestWithRetry
+from standin import StandInServer
+
+
+def substance(sid, cid, synonyms):
+    return {'sid': {'id': sid}, 'source': {'db': {'name': 'ChEBI', 'source_id': {'str': 'S%d' % sid}}},
+            'compound': [{'id': {'type': 1, 'id': {'cid': cid}}}], 'synonyms': synonyms}
+
+
+def recordAll(server):
+    server.recordPubChem('glucose', [substance(1, 5793, ['glucose', 'D-glucose']), substance(2, 5793, [])])
+    server.recordPubChem('unknown compound', [])
+    server.recordMetaboAnalyst([{'query': 'glucose', 'hmdb_id': 'HMDB0000122', 'kegg_id': 'C00031',
+                                 'pubchem_id': '5793', 'chebi_id': '4167', 'metlin_id': '-'}])
+    server.recordMyGene('symbol', 'entrezgene', 'human', [{'query': 'TP53', '_id': '7157', 'entrezgene': 7157},
+                                                         {'query': 'NOTAGENE', 'notfound': True}])
+
+
+def queryAll(server):
+    """
+    queryAll sends the same lookups to a stand-in through each bulk client and returns what they got.
+    """
+    pubchem = PubChemClient(baseUrl=server.serviceUrl('pubchem'), rate=1000)
+    metaboanalyst = MetaboAnalystClient(url=server.serviceUrl('metaboanalyst') + '/mapcompounds')
+    mygene = MyGeneClient(baseUrl=server.serviceUrl('mygene'), rate=1000)
+    answers = {'pubchem': pubchem.getSubstances(['Glucose', 'unknown compound']),
+               'metaboanalyst': metaboanalyst.mapNames(['Glucose', 'ATP']),
+               'mygene': mygene.queryMany(['TP53', 'NOTAGENE'], 'symbol', 'entrezgene', 'human')}
+    assert pubchem.failed == metaboanalyst.failed == mygene.failed == []
+    return answers
+
+
+def test_standin_replays_recording(tmp_path, monkeypatch):
+    """
+    test_standin_replays_recording records every service through a stand-in in record mode (proxying to a stand-in
+    that plays the real services) and checks that replaying the recording gives the clients the same answers.
+    """
+    with StandInServer(str(tmp_path / 'upstream.sqlite')) as upstream:
+        recordAll(upstream)
+        expected = queryAll(upstream)
+        assert [s['sid'] for s in expected['pubchem']['Glucose']] == [1, 2]
+        assert expected['pubchem']['Glucose'][0]['standardized_cid'] == 5793
+        assert expected['metaboanalyst'][1] == {'query': 'ATP', 'hmdb_id': '-', 'kegg_id': '-', 'pubchem_id': '-',
+                                                'chebi_id': '-', 'metlin_id': '-'}
+        assert expected['mygene']['NOTAGENE'][0]['notfound'] is True
+
+        monkeypatch.setattr(standin, 'UPSTREAMS', {service: upstream.serviceUrl(service)
+                                                   for service in standin.UPSTREAMS})
+        with StandInServer(str(tmp_path / 'recording.sqlite'), record=True) as recorder:
+            assert queryAll(recorder) == expected
+
+    with StandInServer(str(tmp_path / 'recording.sqlite')) as replay:
+        assert queryAll(replay) == expected
+        assert replay.stats['misses'] == 0
+
+
+def test_standin_rate_limit_is_retried(tmp_path):
+    """
+    test_standin_rate_limit_is_retried checks that requests over the injected rate limit get HTTP 429 with a
+    Retry-After header, which requestWithRetry honours until the request goes through, and that a request that runs
+    out of retries raises TransientError.
+    """
+    with StandInServer(str(tmp_path / 'standin.sqlite'), rateLimit=1) as server:
+        server.recordMetaboAnalyst([{'query': 'glucose', 'hmdb_id': 'HMDB0000122'}])
+        session = makeSession(poolSize=1)
+        url = server.serviceUrl('metaboanalyst') + '/mapcompounds'
+        data = '{"queryList": "glucose", "inputType": "name"}'
+
+        before = instrument.total('network_calls')
+        assert requestWithRetry(session, 'POST', url, data=data).status_code == 200
+        response = requestWithRetry(session, 'POST', url, data=data, retries=3)
+        assert response.status_code == 200
+        assert response.json()['hmdb_id'] == ['HMDB0000122']
+        assert server.stats['throttled'] >= 1
+        assert instrument.total('network_calls') - before == server.stats['requests']
+
+        with pytest.raises(TransientError, match='HTTP 429'):
+            requestWithRetry(session, 'POST', url, data=data, retries=0)
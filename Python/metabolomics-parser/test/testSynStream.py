@@ -0,0 +1,130 @@
+"""
+testSynStream.py checks that streamSynonymMatches finds the matches of the in-memory synmatch path (queryMetaboAnalyst
+followed by matchModelAndData) on a synthetic model, and how synstream.prefetch hands errors and early stops between
+its threads.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+# Keep the model cache of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir))
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir, 'Misc'))
+import metaboanalyst
+from synstream import prefetch
+from synthetic import metaboanalystResults, metaboliteName, writeModel
+from utilities import expand_frame
+
+sys.path.append(os.path.join(HERE, os.pardir, os.pardir))
+from idmapping import metabolomics_parser as parser
+
+SPECIES = 90
+KEYS = ['query', 'Metabolite', 'BIGG', 'CHEBI', 'KEGG']
+
+
+def mapBatch(self, names):
+    # Every synthetic metabolite name maps, so the answer does not depend on how the names are batched
+    return metaboanalystResults(names, species=SPECIES, hits=1.0).to_dict('records')
+
+
+def matchSet(df):
+    return set(expand_frame(df)[KEYS].astype(str).itertuples(index=False, name=None))
+
+
+def synmatchBothWays(tmp_path, synonyms):
+    """
+    synmatchBothWays writes a PubChem synonym .csv with (Name, synonym) rows and runs the in-memory and the streamed
+    synmatch paths on it.
+    """
+    pubchemFile = str(tmp_path / 'pubchem.csv')
+    pd.DataFrame({'sid': range(len(synonyms)), 'source_id': '', 'source_name': '', 'standardized_cid': '',
+                  'Name': [name for name, _ in synonyms],
+                  'synonyms': [synonym for _, synonym in synonyms]}).to_csv(pubchemFile, index=False)
+    model = writeModel(str(tmp_path / 'model.xml'), species=SPECIES, genes=10, reactions=30)
+    modelMap = parser.mapMetabolicModel(model, modelCache=False, outFile=None)
+
+    for name in ('metaboanalyst.csv', 'match.csv'):
+        if os.path.exists(str(tmp_path / name)):
+            os.remove(str(tmp_path / name))
+    parser.queryMetaboAnalyst(synmatch=True, cache=False, pubchemFile=pubchemFile,
+                              outFile=str(tmp_path / 'metaboanalyst.csv'), url='http://127.0.0.1:9/mapcompounds')
+    inMemory = parser.matchModelAndData(None, modelMap, synmatch=True, queryFile=str(tmp_path / 'metaboanalyst.csv'),
+                                        outFile=str(tmp_path / 'match.csv'))
+    streamed = parser.streamSynonymMatches(modelMap, pubchemFile, outFile=str(tmp_path / 'match.sqlite'),
+                                           bufferSize=3, prefetch=2, cache=False,
+                                           url='http://127.0.0.1:9/mapcompounds')
+    return matchSet(inMemory), matchSet(streamed)
+
+
+def test_streamed_synmatch_matches_in_memory(tmp_path, monkeypatch):
+    """
+    test_streamed_synmatch_matches_in_memory checks that both synmatch paths find the same (query, Metabolite, BiGG,
+    ChEBI, KEGG) matches when the synonyms are spellings of the metabolite names, and that a synonym naming another
+    metabolite only adds matches under the original name in the streamed path, which also looks the synonyms up.
+    """
+    pytest.importorskip('lxml')
+    monkeypatch.setattr(metaboanalyst.MetaboAnalystClient, 'mapBatch', mapBatch)
+    names = [metaboliteName(b) for b in (0, 4, 7, 11, 19)] + ['Unknown compound 3']
+    spellings = [(name, spelling) for name in names for spelling in (name.upper(), ' %s ' % name)]
+
+    inMemory, streamed = synmatchBothWays(tmp_path, spellings)
+    assert len(inMemory) > 0
+    assert streamed == inMemory
+
+    inMemory, streamed = synmatchBothWays(tmp_path, spellings + [(names[0], metaboliteName(23))])
+    extra = streamed - inMemory
+    assert inMemory < streamed
+    assert {(query, metabolite) for query, metabolite, *_ in extra} == {(names[0].lower(), metaboliteName(23))}
+
+
+def test_prefetch_order_and_errors():
+    """
+    test_prefetch_order_and_errors checks that prefetch yields the items in order and re-raises an error of the
+    producer in the consumer, after the items produced before it.
+    """
+    assert list(prefetch(iter(range(10)), depth=3)) == list(range(10))
+
+    def failing():
+        yield 1
+        yield 2
+        raise ValueError('bad synonym row')
+
+    received = []
+    with pytest.raises(ValueError, match='bad synonym row'):
+        for item in prefetch(failing(), depth=1):
+            received.append(item)
+    assert received == [1, 2]
+
+
+def test_prefetch_stops_producer_early():
+    """
+    test_prefetch_stops_producer_early checks that a consumer that stops early stops the producer thread, which may be
+    blocked on the full queue, instead of leaving it running.
+    """
+    produced = []
+
+    def endless():
+        while True:
+            produced.append(len(produced))
+            yield produced[-1]
+
+    before = set(threading.enumerate())
+    buffers = prefetch(endless(), depth=2)
+    assert [next(buffers) for _ in range(3)] == [0, 1, 2]
+    # Let the producer fill the queue and block on it
+    time.sleep(0.2)
+    buffers.close()
+    assert set(threading.enumerate()) - before == set()
+    count = len(produced)
+    time.sleep(0.2)
+    assert len(produced) == count <= 3 + 2 + 1
@@ -0,0 +1,85 @@
+"""
+testSynonyms.py checks that the offline synonym index in synonyms.py picks the ChEBI, HMDB and KEGG identifiers out of
+the PubChem synonyms and resolves names like the MetaboAnalyst columns it stands in for.
+@author: Scott Campit
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+# Keep the synonym index of the tests away from the real one (read at import time)
+os.environ.setdefault('UTILITIES_CACHE_DIR', tempfile.mkdtemp(prefix='test-cache-'))
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from synonyms import SynonymIndex, parseXref
+
+# CID-Synonym lines: glucose with its identifiers among the synonyms, and a name shared by seven compounds
+CID_SYNONYMS = [(5793, 'D-Glucose'), (5793, 'Glucose'), (5793, 'CHEBI:4167'), (5793, 'C00031'),
+                (5793, 'HMDB0000122'), (5793, 'HMDB00122'), (5793, 'C000311'), (5793, 'chebi:4167x'),
+                (5957, 'ATP'), (5957, 'Adenosine triphosphate')] + \
+               [(cid, 'Sugar') for cid in (107, 101, 106, 103, 105, 102, 104)]
+
+
+def test_parse_xref():
+    """
+    test_parse_xref checks which synonyms are taken for identifiers: the whole synonym has to be a ChEBI, HMDB (old
+    five- or new seven-digit) or KEGG compound identifier.
+    """
+    assert parseXref('CHEBI:15422') == ('chebi_id', '15422')
+    assert parseXref('HMDB0000538') == ('hmdb_id', 'HMDB0000538')
+    assert parseXref('HMDB00538') == ('hmdb_id', 'HMDB00538')
+    assert parseXref('C00002') == ('kegg_id', 'C00002')
+    for synonym in ('chebi:15422', 'CHEBI:15422 ', 'HMDB000538', 'C000021', 'D00002', 'ATP'):
+        assert parseXref(synonym) is None
+
+
+def test_synonym_index_lookup(tmp_path):
+    """
+    test_synonym_index_lookup checks a lookup against an index built from a gzipped CID-Synonym file: names are
+    matched after normalization, each spelling gets its own rows, identifiers come from the synonyms (the lowest one
+    per namespace), at most maxCids CIDs (the lowest) are kept per name, and pubchem_id is a string.
+    """
+    path = tmp_path / 'CID-Synonym-filtered.gz'
+    with gzip.open(str(path), 'wt', encoding='utf-8') as f:
+        f.writelines('%d\t%s\n' % pair for pair in CID_SYNONYMS)
+    index = SynonymIndex(str(tmp_path / 'synonyms.sqlite'))
+    assert index.addCidSynonymFile(str(path)) == len(CID_SYNONYMS)
+
+    hits = index.lookup(['Glucose', ' glucose', 'ATP', 'sugar', 'unknown compound'])
+    assert list(hits.columns) == ['query', 'pubchem_id', 'hmdb_id', 'kegg_id', 'chebi_id']
+    assert hits['pubchem_id'].map(type).eq(str).all()
+
+    glucose = hits[hits['pubchem_id'] == '5793'].set_index('query')
+    assert sorted(glucose.index) == [' glucose', 'Glucose']
+    assert glucose.loc['Glucose', ['hmdb_id', 'kegg_id', 'chebi_id']].tolist() == ['HMDB0000122', 'C00031', '4167']
+
+    atp = hits[hits['query'] == 'ATP']
+    assert atp['pubchem_id'].tolist() == ['5957']
+    assert atp[['hmdb_id', 'kegg_id', 'chebi_id']].isna().all(axis=None)
+
+    assert hits.loc[hits['query'] == 'sugar', 'pubchem_id'].tolist() == ['101', '102', '103', '104', '105']
+    assert len(index.lookup(['Sugar'], maxCids=2)) == 2
+    assert 'unknown compound' not in set(hits['query'])
+    assert index.lookup(['unknown compound']).empty
+
+
+def test_synonym_index_query_file(tmp_path):
+    """
+    test_synonym_index_query_file checks that a queryPubChem .csv indexes the queried names and the synonyms of
+    substances with a standardized CID, and skips substances without one.
+    """
+    queryFile = str(tmp_path / 'pubchem.csv')
+    pd.DataFrame({'sid': [1, 2, 3], 'source_id': ['G1', 'G2', 'X1'], 'source_name': ['ChEBI', 'KEGG', 'Other'],
+                  'standardized_cid': ['5793', '5793', None], 'Name': ['glucose', 'glucose', 'glucose'],
+                  'synonyms': ['CHEBI:4167', 'Dextrose', 'Blood sugar']}).to_csv(queryFile, index=False)
+    index = SynonymIndex(str(tmp_path / 'synonyms.sqlite'))
+    assert index.addQueryFile(queryFile) == 4
+
+    hits = index.lookup(['dextrose', 'Glucose', 'blood sugar'])
+    assert sorted(hits['query']) == ['Glucose', 'dextrose']
+    assert hits['pubchem_id'].tolist() == ['5793', '5793']
+    assert hits['chebi_id'].tolist() == ['4167', '4167']
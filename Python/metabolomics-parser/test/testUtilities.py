@@ -0,0 +1,158 @@
+"""
+testUtilities.py checks the dataframe helpers in Python/Misc/utilities.py against the implementations they replaced.
+@author: Scott Campit
+"""
+
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'Misc'))
+from utilities import compact_frame, compact_ids, expand_frame, expand_ids, iter_sep_object, parse_ids, sep_object
+
+
+def legacySepObject(df, col, regex):
+    """
+    legacySepObject is the original sep_object, which joins the split pieces back onto the frame by index label.
+    """
+    df = df.copy()
+    s = df[col].str.split(regex).apply(pd.Series).stack()
+    s.index = s.index.droplevel(-1)
+    s.name = col
+    del df[col]
+    s = pd.DataFrame(s)
+    df = pd.merge(df, s, how='inner', left_index=True, right_index=True)
+    df = df.drop_duplicates(keep='first')
+    return df
+
+
+def sepObjectFrame(index):
+    rng = np.random.default_rng(len(index))
+    names = np.array(['glucose', 'atp', 'l-alanine', 'citrate', 'pyruvate'])
+    values = ['/'.join(rng.choice(names, rng.integers(1, 4))) for _ in index]
+    values[1] = None
+    return pd.DataFrame({'Metabolite': values, 'Sample': rng.integers(0, 3, len(index))}, index=index)
+
+
+def test_sep_object_unique_index():
+    """
+    test_sep_object_unique_index checks that sep_object gives the rows of the original implementation on a unique
+    index. On an unsorted index the rows follow the input frame, so a duplicate keeps its first row in that order.
+    """
+    for index in (range(50), np.random.default_rng(0).permutation(50)):
+        df = sepObjectFrame(index)
+        new = sep_object(df, 'Metabolite', '/')
+        old = legacySepObject(df, 'Metabolite', '/')
+        if df.index.is_monotonic_increasing:
+            pd.testing.assert_frame_equal(new, old)
+        assert sorted(map(tuple, new.values.tolist())) == sorted(map(tuple, old.values.tolist()))
+        assert (np.diff(df.index.get_indexer(new.index)) >= 0).all()
+        assert 'Metabolite' in df
+
+        chunked = sep_object(df, 'Metabolite', '/', chunksize=7)
+        pd.testing.assert_frame_equal(chunked, new)
+        pd.testing.assert_frame_equal(pd.concat(iter_sep_object([df.iloc[:20], df.iloc[20:]], 'Metabolite', '/')),
+                                      new)
+
+
+def test_sep_object_duplicate_index():
+    """
+    test_sep_object_duplicate_index checks that rows sharing an index label are split on their own: the result is
+    that of the original implementation on a unique index, with the labels put back.
+    """
+    index = np.repeat(np.arange(10), 3)
+    df = sepObjectFrame(index)
+    new = sep_object(df, 'Metabolite', '/')
+
+    positional = legacySepObject(df.reset_index(drop=True), 'Metabolite', '/')
+    expected = positional.set_axis(df.index[positional.index]).drop_duplicates(keep='first')
+    pd.testing.assert_frame_equal(new, expected)
+
+    # The original joined every piece of a label with every row of that label
+    df = pd.DataFrame({'Sample': [1, 2], 'Metabolite': ['atp', 'glucose']}, index=[0, 0])
+    assert len(legacySepObject(df, 'Metabolite', '/')) == 4
+    assert sep_object(df, 'Metabolite', '/').values.tolist() == [[1, 'atp'], [2, 'glucose']]
+
+
+def test_compact_ids_round_trip():
+    """
+    test_compact_ids_round_trip checks that identifiers in the usual format come back from expand_ids unchanged, and
+    that missing placeholders become missing values.
+    """
+    for values, prefix, width in ((['C00031', 'C00002', None, '-', 'C10000'], 'C', 5),
+                                  (['HMDB0000122', 'nan', 'HMDB0000538', ''], 'HMDB', 7),
+                                  (['15422', '17234', None, '<NA>'], '', 0)):
+        compacted = compact_ids(pd.Series(values), prefix, width)
+        assert compacted.dtype == 'UInt32'
+        expanded = expand_ids(compacted, prefix, width)
+        assert expanded.fillna('missing').tolist() == [v if v not in (None, '-', 'nan', '', '<NA>') else 'missing'
+                                                       for v in values]
+
+
+def test_compact_ids_formats():
+    """
+    test_compact_ids_formats checks HMDB width normalization, floats read from .csv files, and the categorical
+    fallback for columns with identifiers in another format.
+    """
+    # Five-digit HMDB IDs are the old form of the seven-digit ones
+    compacted = compact_ids(pd.Series(['HMDB00122', 'HMDB0000122', 'HMDB0000538']), 'HMDB', 7)
+    assert compacted.tolist() == [122, 122, 538]
+    assert expand_ids(compacted, 'HMDB', 7).tolist() == ['HMDB0000122', 'HMDB0000122', 'HMDB0000538']
+
+    # ChEBI IDs of a column with missing values are read as floats
+    assert compact_ids(pd.Series([15422.0, np.nan, 3.0])).tolist() == [15422, pd.NA, 3]
+    assert compact_ids(pd.Series(['15422.0', 'nan', '3'])).tolist() == [15422, pd.NA, 3]
+    assert parse_ids(pd.Series(['15422.5'])).isna().all()
+
+    compacted = compact_ids(pd.Series(['C00031', 'G00012', None]), 'C', 5)
+    assert isinstance(compacted.dtype, pd.CategoricalDtype)
+    assert expand_ids(compacted, 'C', 5).fillna('missing').tolist() == ['C00031', 'G00012', 'missing']
+
+
+def test_parse_ids_warns_about_dropped_ids():
+    """
+    test_parse_ids_warns_about_dropped_ids checks that parse_ids(warn=True) reports the identifiers it turns into
+    missing values, but not the placeholders that already mean missing.
+    """
+    import instrument
+
+    before = instrument.total('unparsed_ids')
+    with pytest.warns(UserWarning, match="1 identifiers do not have the form C<digits>.*'G00012'"):
+        parsed = parse_ids(['C00031', 'G00012', '-', None, 'nan'], 'C', warn=True)
+    assert parsed.tolist() == [31, pd.NA, pd.NA, pd.NA, pd.NA]
+    assert instrument.total('unparsed_ids') - before == 1
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        parse_ids(['C00031', 'G00012'], 'C')
+
+
+def test_compact_frame_round_trip():
+    """
+    test_compact_frame_round_trip checks that expand_frame restores a frame stored with compact_frame, using the
+    formats kept in its attrs.
+    """
+    df = pd.DataFrame({'query': ['glucose', 'atp', 'unknown'],
+                       'hmdb_id': ['HMDB0000122', 'HMDB0000538', '-'],
+                       'kegg_id': ['C00031', 'C00002', 'G00012'],
+                       'chebi_id': ['17234', '15422', None],
+                       'score': [1.0, 0.5, np.nan]})
+    compacted = compact_frame(df)
+    assert compacted['hmdb_id'].dtype == 'UInt32'
+    assert compacted['chebi_id'].dtype == 'UInt32'
+    assert isinstance(compacted['kegg_id'].dtype, pd.CategoricalDtype)
+    assert isinstance(compacted['query'].dtype, pd.CategoricalDtype)
+    assert compacted.attrs['id_formats'] == {'hmdb_id': ('HMDB', 7), 'chebi_id': ('', 0)}
+
+    expected = df.copy()
+    expected.loc[2, 'hmdb_id'] = np.nan
+    expected.loc[2, 'chebi_id'] = np.nan
+    pd.testing.assert_frame_equal(expand_frame(compacted), expected)
+
+    # Custom formats travel with the frame
+    compacted = compact_frame(pd.DataFrame({'id': ['X01', 'X22']}), formats={'id': ('X', 2)})
+    assert expand_frame(compacted)['id'].tolist() == ['X01', 'X22']